@@ -0,0 +1,137 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Windowed per topic aggregation stage of the broker
+# Semester: Spring 2023
+###############################################
+#
+# High rate topics (humidity, sound, pressure...) are forwarded one sample at
+# a time. When the [Aggregation] section of the config file is enabled, the
+# broker also keeps the numeric samples of the configured topics (or topic
+# patterns) and, at the end of every window of WindowMs, publishes their
+# min, max, mean and count on the derived topic <Prefix>/<topic>, e.g.:
+#   agg/humidity:{"min": 12.1, "max": 97.3, "mean": 55.0, "count": 812, ...}
+# Dashboards and slow subscribers can subscribe to the derived topics and get
+# one message per window instead of every sample.
+#
+# Windows are aligned to the clock (so that all brokers close them at the
+# same time) and the samples of a window go into a preallocated NumPy buffer
+# per topic. Whenever the buffer fills up (and when the window closes) it is
+# reduced in one vectorized pass into the running min/max/sum/count of the
+# window, so the memory per topic stays fixed whatever the sample rate.
+#
+# import statements
+import json, math, time
+from Apps.Common.common import make_header
+from Apps.Common.content_filter import to_number
+from Apps.Common.topic_trie import is_pattern, topic_matches
+np = None # numpy, only imported once aggregation is enabled (it takes longer than the rest of the broker)
+
+"""import numpy for the windows"""
+def load_numpy():
+  global np
+  try: import numpy as np
+  except ImportError: raise Exception("Aggregation needs numpy (pip install numpy)")
+
+"""TopicWindow class"""
+class TopicWindow():
+
+  """constructor"""
+  def __init__(self, size, start, end):
+    self.samples = np.empty(size) # samples not yet reduced
+    self.used = 0                 # number of samples in the buffer
+    self.start = start            # window start (seconds since the epoch)
+    self.end = end                # window end (seconds since the epoch)
+    self.min = math.inf           # running aggregates of the reduced samples
+    self.max = -math.inf
+    self.sum = 0.0
+    self.count = 0
+
+  """add a sample to the window"""
+  def add(self, value):
+    if self.used == len(self.samples): self.reduce()
+    self.samples[self.used] = value
+    self.used += 1
+
+  """reduce the buffered samples into our running aggregates"""
+  def reduce(self):
+    if self.used == 0: return
+    chunk = self.samples[:self.used]
+    self.min = min(self.min, float(chunk.min()))
+    self.max = max(self.max, float(chunk.max()))
+    self.sum += float(chunk.sum())
+    self.count += self.used
+    self.used = 0
+
+  """return the aggregates of the window"""
+  def aggregate(self):
+    self.reduce()
+    return {"min": self.min, "max": self.max, "mean": self.sum / self.count,
+            "count": self.count, "start": self.start, "end": self.end}
+
+"""Aggregator class"""
+class Aggregator():
+
+  """constructor"""
+  def __init__(self, logger, config, name):
+    self.logger = logger      # internal logger for print statements
+    self.name = name          # the name we publish the aggregates under
+    self.enabled = False      # whether we aggregate at all
+    self.topics = []          # the topics (or patterns) we aggregate
+    self.window = 1.0         # window length in seconds
+    self.buffer_size = 1024   # samples buffered per topic before a reduction
+    self.prefix = "agg"       # first level of the derived topics
+    self.windows = {}         # topic -> its open TopicWindow
+    self.wanted = {}          # topic -> whether we aggregate it (cached match)
+    self.seqs = {}            # derived topic -> sequence number of its last aggregate
+    self.ready = []           # frames of aggregates closed while adding samples
+    if config.has_section("Aggregation"):
+      settings = config["Aggregation"]
+      self.enabled = settings.getboolean("Enabled", False)
+      self.topics = [t.strip() for t in settings.get("Topics", "").split(",") if t.strip()]
+      self.window = int(settings.get("WindowMs", "1000")) / 1000
+      self.buffer_size = int(settings.get("BufferSize", "1024"))
+      self.prefix = settings.get("Prefix", "agg")
+    if self.enabled: load_numpy()
+
+  """tells if we aggregate the topic"""
+  def aggregates(self, topic):
+    if topic not in self.wanted:
+      self.wanted[topic] = not topic.startswith(self.prefix + "/") and any(
+        topic == t or (is_pattern(t) and topic_matches(t, topic)) for t in self.topics)
+    return self.wanted[topic]
+
+  """add the value of a publication on the topic (if we aggregate it)"""
+  def add(self, topic, value, now):
+    if not self.enabled or not self.aggregates(topic): return
+    number = to_number(value)
+    if number is None: return
+    window = self.windows.get(topic)
+    if window and now >= window.end:
+      self.ready.append(self.close(topic))
+      window = None
+    if window is None:
+      start = math.floor(now / self.window) * self.window
+      window = self.windows[topic] = TopicWindow(self.buffer_size, start, start + self.window)
+    window.add(number)
+
+  """ms until the next window closes (None if no window is open)"""
+  def timeout(self):
+    if not self.windows: return None
+    return max(0, int((min(w.end for w in self.windows.values()) - time.time()) * 1000) + 1)
+
+  """return the frames of every aggregate that is due"""
+  def flush(self, now):
+    frames, self.ready = self.ready, []
+    for topic in [t for t, w in self.windows.items() if now >= w.end]:
+      frames.append(self.close(topic))
+    return frames
+
+  """close the window of the topic and return the frames of its aggregate"""
+  def close(self, topic):
+    aggregate = self.windows.pop(topic).aggregate()
+    derived = f"{self.prefix}/{topic}"
+    self.seqs[derived] = self.seqs.get(derived, 0) + 1
+    data = f"{derived}:{json.dumps(aggregate)}"
+    self.logger.debug(f"Aggregator::close - {data}")
+    return [data.encode(), json.dumps(make_header(self.name, self.seqs[derived])).encode()]
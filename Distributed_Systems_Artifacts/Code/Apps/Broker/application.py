@@ -16,6 +16,7 @@
 import sys, os, time, argparse, logging, random
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, dump
+from Apps.Common.profiling import install_profiler
 from Apps.Broker.middleware import BrokerMW
 
 """BrokerAppln class"""
@@ -76,6 +77,30 @@ def parseCmdLineArgs():
     "-c", "--config", default="Apps/Common/config.ini", 
     help="configuration file (default: Apps/Common/config.ini)"
   )
+  parser.add_argument(
+    "-rp", "--replay_port", type=int, default=0, 
+    help="Port on which we serve replays of our topic logs, default=0 (our port + 1)"
+  )
+  parser.add_argument(
+    "-fp", "--federation_port", type=int, default=0, 
+    help="Port on which the brokers of other sites link to us, default=0 (our port + 2)"
+  )
+  parser.add_argument(
+    "-mp", "--metrics_port", type=int, default=0, 
+    help="Port on which our metrics are served over HTTP, default=0 (not served)"
+  )
+  parser.add_argument(
+    "-w", "--workers", type=int, default=1, 
+    help="Number of worker processes our topics are forwarded by, default=1 (this process)"
+  )
+  parser.add_argument(
+    "-pf", "--profile", default="", choices=["", "sample", "cprofile"], 
+    help="Profile us from the start with this profiler, default='' (only on SIGUSR1, with sample)"
+  )
+  parser.add_argument(
+    "-pd", "--profile_dir", default="Logs/profiles", 
+    help="Directory our profiles are written to, default=Logs/profiles"
+  )
   parser.add_argument(
     "-l", "--loglevel", type=int, default=logging.INFO, 
     choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], 
@@ -96,6 +121,8 @@ def main():
     logger.debug("Main: resetting log level to {}".format(args.loglevel))
     logger.setLevel(args.loglevel)
     logger.debug("Main: effective log level is {}".format(logger.getEffectiveLevel()))
+    # profile us from the start (with --profile) or whenever we get SIGUSR1
+    install_profiler(logger, "broker", args)
     # Obtain a publisher application
     logger.debug("Main: obtain the object")
     pub_app = BrokerAppln(logger)    # get the object
@@ -0,0 +1,228 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Broker to broker federation of several sites
+# Semester: Spring 2023
+###############################################
+#
+# Brokers only serve the publishers and subscribers of their own cluster, so
+# a subscriber in another network segment had to connect across the WAN to
+# every broker. When the [Federation] section of the config file is enabled
+# the lead brokers of a site (a cluster with its own zookeeper, discovery and
+# brokers) bridge to the lead brokers of other sites instead:
+# - every lead broker binds a ROUTER socket on its federation port and
+#   connects a DEALER socket to each of Peers, the bridge endpoints of the
+#   neighbouring sites. A link carries both ways, so it is listed on one
+#   side only
+# - over every link a broker sends a summary of the interest behind it every
+#   SummaryInterval seconds (and as soon as its own subscriptions change):
+#     [SUMMARY, {"site": our site, "interest": {topic or pattern: path}}]
+#   Our interest is what our subscribers subscribed to (see subscription),
+#   plus what the other links summarized, each with the sites it came
+#   through. A topic covered by a pattern of the summary is left out
+#   (aggregated), so a summary grows with the distinct interest of the
+#   remote side, not with its number of subscribers
+# - a message of one of our publishers (or one that came over a link) is
+#   sent towards every site that wants its topic, over the link with the
+#   shortest path to it, as
+#     [DATA, sites it went through, message frames...]
+#   and the broker at the other end forwards it to its own subscribers
+#   (and on to its own links) as if one of its publishers had sent it
+# Loops are prevented both ways: interest is never summarized back to a site
+# on its path (and a summary entry with our own site on its path is
+# ignored), and a message is never sent to a site it already went through
+# (and is dropped if it reaches one). A link whose summaries stop for three
+# intervals is forgotten until it sends one again. Cross site traffic so
+# follows the remote interest, not what is published. (A topic whose
+# interest a pattern hid may still come over two paths, the dedup window of
+# its subscribers drops the second copy.)
+#
+# import statements
+import json, time
+import zmq
+from Apps.Common.content_filter import parse_filter, is_filter_key
+from Apps.Common.topic_trie import TopicTrie, is_pattern_key, key_pattern, \
+  KEY_SUFFIX, SEPARATOR, SINGLE, MULTI
+
+# first frame of the federation messages on a link
+SUMMARY = b"__fs:"
+DATA = b"__fd:"
+# summaries missed before a link is forgotten
+MISSED_SUMMARIES = 3
+
+"""return the topic (or pattern) a subscription of one of our subscribers asks for (None if none)"""
+def subscription_interest(key):
+  if is_pattern_key(key): return key_pattern(key)
+  if is_filter_key(key):
+    try: return parse_filter(key).topic
+    except ValueError: return None  # the broker ignores it as well
+  if key.startswith("__"): return None  # heartbeats and the like are not topics
+  if key.endswith(KEY_SUFFIX): return key[:-len(KEY_SUFFIX)]
+  # any other prefix asks for everything under its levels
+  if key.endswith(SEPARATOR): return key + MULTI
+  return MULTI
+
+"""tells if everything the topic (or pattern) matches is matched by the pattern as well"""
+def covers(pattern, topic):
+  levels = topic.split(SEPARATOR)
+  for i, level in enumerate(pattern.split(SEPARATOR)):
+    if level == MULTI: return True
+    if i >= len(levels) or levels[i] == MULTI: return False
+    if level != SINGLE and level != levels[i]: return False
+  return len(levels) == len(pattern.split(SEPARATOR))
+
+"""return the interest without what another of its patterns already covers"""
+def aggregate(interest):
+  patterns = [p for p in interest if SINGLE in p.split(SEPARATOR) or MULTI in p.split(SEPARATOR)]
+  return {topic: path for topic, path in interest.items()
+          if not any(p != topic and covers(p, topic) for p in patterns)}
+
+"""Link class"""
+class Link():
+
+  """constructor"""
+  def __init__(self, sock, identity=None):
+    self.sock = sock          # our DEALER socket (or the ROUTER socket the link came in on)
+    self.identity = identity  # routing identity of the peer on our ROUTER socket (None for a DEALER)
+    self.site = None          # the site at the other end (once it sent a summary)
+    self.interest = {}        # topic or pattern -> sites its interest came through
+    self.trie = TopicTrie()   # the topics and patterns of interest, to match topics against
+    self.heard = None         # when the last summary came
+
+  """send the frames to the other end"""
+  def send(self, frames):
+    if self.identity is not None: frames = [self.identity] + frames
+    self.sock.send_multipart(frames, flags=zmq.DONTWAIT)
+
+"""Federation class"""
+class Federation():
+
+  """constructor"""
+  def __init__(self, logger, config, name):
+    self.logger = logger        # internal logger for print statements
+    self.name = name            # the name of our broker
+    self.enabled = False        # whether we bridge to other sites at all
+    self.site = None            # the name of our site
+    self.peers = []             # bridge endpoints of the sites we connect to
+    self.interval = 1.0         # seconds between two summaries
+    self.router = None          # our ROUTER socket the links of other sites come in on
+    self.links = {}             # DEALER socket (or ROUTER identity) -> Link
+    self.local = {}             # subscription key of our subscribers -> topic or pattern it wants
+    self.changed = False        # whether our summaries are out of date
+    self.next_summary = 0       # when our summaries go out next
+    self.metrics = None         # our runtime counters (the broker's)
+    if config.has_section("Federation"):
+      settings = config["Federation"]
+      self.enabled = settings.getboolean("Enabled", False)
+      self.site = settings.get("Site", "site1")
+      self.peers = [p.strip() for p in settings.get("Peers", "").split(",") if p.strip()]
+      self.interval = float(settings.get("SummaryInterval", "1"))
+
+  """bind our bridge on the endpoint, connect to our peers and poll them all with the poller"""
+  def start(self, context, endpoint, poller):
+    self.router = context.socket(zmq.ROUTER)
+    self.router.bind(endpoint)
+    poller.register(self.router, zmq.POLLIN)
+    for peer in self.peers:
+      dealer = context.socket(zmq.DEALER)
+      dealer.connect(peer)
+      poller.register(dealer, zmq.POLLIN)
+      self.links[dealer] = Link(dealer)
+    self.changed = True
+    self.logger.info(f"Federation of site {self.site} bridged on {endpoint}, peers: {self.peers}")
+
+  """note a subscribe (or unsubscribe) our XPUB socket got from one of our subscribers"""
+  def subscription(self, data):
+    key = data[1:].decode()
+    interest = subscription_interest(key)
+    if interest is None: return
+    # XPUB tells us about the first subscribe and the last unsubscribe of a key
+    before = set(self.local.values())
+    if data[0] == 1: self.local[key] = interest
+    else: self.local.pop(key, None)
+    if set(self.local.values()) != before: self.changed = True
+
+  """tells if the socket is one of our links"""
+  def owns(self, sock):
+    return sock is self.router or sock in self.links
+
+  """receive a message of a link (returns the frames and path of a message to forward, or None)"""
+  def receive(self, sock):
+    frames = sock.recv_multipart()
+    if sock is self.router:
+      identity = frames.pop(0)
+      link = self.links.setdefault(identity, Link(self.router, identity))
+    else: link = self.links[sock]
+    if frames[0] == SUMMARY: self.update(link, json.loads(frames[1]))
+    elif frames[0] == DATA:
+      path = frames[1].decode().split(",")
+      # it went around a loop (say while the summaries were changing)
+      if self.site in path: return None
+      if self.metrics: self.metrics.inc("federation_in_total", site=path[-1])
+      return frames[2:], path
+    return None
+
+  """take in the summary of a link"""
+  def update(self, link, summary):
+    if link.site is None: self.logger.info(f"Federation link up with site {summary['site']}")
+    link.site = summary["site"]
+    link.heard = time.time()
+    # interest that went through us is our own coming back around
+    interest = {topic: path for topic, path in summary["interest"].items() if self.site not in path}
+    if interest == link.interest: return
+    link.interest = interest
+    link.trie = TopicTrie()
+    for topic in interest: link.trie.insert(topic, topic)
+    self.changed = True  # our other links may want to hear about it
+    self.logger.debug(f"Federation::update - site {link.site} wants: {sorted(interest)}")
+
+  """send the message towards every site that wants its topic and did not see it yet"""
+  def send(self, topic, frames, path=None):
+    path = (path or []) + [self.site]
+    # every site that wants the topic is reached over the link with the shortest path to it
+    best = {}  # site the interest came from -> (sites on the way, link)
+    for link in self.links.values():
+      if link.site is None or link.site in path: continue
+      for interest in link.trie.match(topic):
+        sites = link.interest[interest]
+        if sites[-1] in path: continue
+        if sites[-1] not in best or len(sites) < best[sites[-1]][0]: best[sites[-1]] = (len(sites), link)
+    for link in {id(link): link for _, link in best.values()}.values():
+      try:
+        link.send([DATA, ",".join(path).encode()] + frames)
+        if self.metrics: self.metrics.inc("federation_out_total", site=link.site)
+      except zmq.Again:
+        if self.metrics: self.metrics.inc("federation_dropped_total", site=link.site)
+
+  """return the summary of the interest behind us for the link (never its own interest)"""
+  def summary(self, link):
+    interest = {topic: [self.site] for topic in self.local.values()}
+    for other in self.links.values():
+      if other is link: continue
+      for topic, path in other.interest.items():
+        if link.site in path: continue
+        if topic not in interest or len(path) + 1 < len(interest[topic]): interest[topic] = [self.site] + path
+    return {"site": self.site, "interest": aggregate(interest)}
+
+  """send our summaries when they are due (or changed) and forget the links that went quiet"""
+  def tick(self):
+    now = time.time()
+    if not self.changed and now < self.next_summary: return
+    for key, link in list(self.links.items()):
+      if link.heard is not None and now - link.heard > MISSED_SUMMARIES * self.interval:
+        self.logger.info(f"Federation link with site {link.site} went quiet, forgetting it")
+        if link.identity is not None:
+          del self.links[key]
+          continue
+        # our DEALER keeps reconnecting, the site behind it starts over once it is back
+        self.links[key] = link = Link(link.sock)
+      try: link.send([SUMMARY, json.dumps(self.summary(link)).encode()])
+      except zmq.Again: pass  # the next one will do
+    self.changed = False
+    self.next_summary = now + self.interval
+    if self.metrics: self.metrics.set("federation_links", len([l for l in self.links.values() if l.site]))
+
+  """milliseconds until our next summary, as a poll timeout"""
+  def timeout(self):
+    if not self.enabled: return None
+    return max(0, int((self.next_summary - time.time()) * 1000)) + 1
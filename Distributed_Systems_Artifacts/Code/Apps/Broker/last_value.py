@@ -0,0 +1,60 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Last value cache of the broker
+# Semester: Spring 2023
+###############################################
+#
+# A new subscriber used to know nothing about a topic until its next
+# publication (or the next history broadcast). When the [LastValue] section
+# of the config file is enabled the broker keeps the frames of the last
+# publication and of the last history of every topic (and, with
+# PerPublisher, of every publisher of the topic). Its XPUB socket is made
+# verbose so that it hears about every subscription, not only the first of
+# a key, and sends the matching snapshot as soon as a subscription arrives:
+#   "topic:"        the cached messages of the topic
+#   "*pattern:"     the cached messages of every topic the pattern matches
+#   "?filter:"      the cached publications that pass the filter (and the history)
+#   other prefixes  the cached messages of every topic they are a prefix of
+# Snapshots go out under the subscription key, so subscribers that already
+# had them get them once more and drop them by their header (see dedup.py).
+#
+# import statements
+from Apps.Common.content_filter import parse_filter, is_filter_key
+from Apps.Common.topic_trie import is_pattern_key, key_pattern, topic_matches
+
+"""LastValueCache class"""
+class LastValueCache():
+
+  """constructor"""
+  def __init__(self, config):
+    self.enabled = False        # whether we cache at all
+    self.per_publisher = False  # keep the last messages of every publisher of a topic
+    self.entries = {}           # topic -> (publisher, kind) -> (frames, value)
+    if config.has_section("LastValue"):
+      self.enabled = config["LastValue"].getboolean("Enabled", False)
+      self.per_publisher = config["LastValue"].getboolean("PerPublisher", False)
+
+  """keep the frames of a message (kind is data or history) as the last one of its topic"""
+  def store(self, topic, pub, kind, frames, value=None):
+    if not self.enabled: return
+    slot = (pub if self.per_publisher else None, kind)
+    self.entries.setdefault(topic, {})[slot] = (list(frames), value)
+
+  """return the frames to send to a new subscription with the given key"""
+  def snapshot(self, key):
+    if not self.enabled: return []
+    if is_pattern_key(key):
+      pattern = key_pattern(key)
+      return [[key.encode()] + frames for topic, entries in self.entries.items()
+              if topic_matches(pattern, topic) for frames, _ in entries.values()]
+    if is_filter_key(key):
+      try: f = parse_filter(key)
+      except ValueError: return []
+      # compressed publications we never decoded have no value to filter on
+      return [[key.encode()] + frames for (_, kind), (frames, value) in self.entries.get(f.topic, {}).items()
+              if kind == "history" or (value is not None and f.matches(value))]
+    if key.endswith(":") and key[:-1] in self.entries:
+      return [frames for frames, _ in self.entries[key[:-1]].values()]
+    return [frames for topic, entries in self.entries.items()
+            if (topic + ":").startswith(key) for frames, _ in entries.values()]
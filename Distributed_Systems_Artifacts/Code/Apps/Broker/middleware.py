@@ -10,16 +10,42 @@
 # So in addition to the REQ socket to talk to the Discovery service, it will have 
 # both PUB and SUB sockets as it must work on behalf of the real publishers and 
 # subscribers. So this will have the logic of both publisher and subscriber middleware.
+# Its PUB side is an XPUB socket so that it sees the content filters of its
+# subscribers (see Apps/Common/content_filter.py) and only forwards a message
+# under a filter key when the filter matches. Wildcard subscriptions arrive
+# the same way and are matched through a topic trie (Apps/Common/topic_trie.py).
+# It can also publish windowed aggregates of its topics (see aggregation.py).
+# With --workers K > 1 the forwarding itself is done by K worker processes,
+# each owning a partition of the topics, and this process only routes the
+# messages of its publishers to them (see workers.py).
+# Lead brokers of different sites can be federated, exchanging only the
+# topics the other side has subscribers for (see federation.py).
 #
 # Import statements
-import sys, os, zmq, json, time, random
+import sys, os, zmq, json, time, configparser
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, \
-  send_message, disseminate, register
+  send_message, register, parse_header, zk_hosts
 from Apps.Common import discovery_pb2
+from Apps.Common.lookup_cache import LookupCache
+from Apps.Common.transport import bind_endpoints, host_id, endpoint_of
+from Apps.Common.flow_control import FlowControl
+from Apps.Common.metrics import Metrics
+from Apps.Common.codec import Codec
+from Apps.Broker.topic_log import LogStore
+from Apps.Broker.aggregation import Aggregator
+from Apps.Broker.last_value import LastValueCache
+from Apps.Broker.workers import WorkerPool, worker_endpoints
+from Apps.Broker.federation import Federation
+from Apps.Common.failure_detector import Heartbeat, HEARTBEAT
+from Apps.Common.tracing import pop_trace, stamp
+from Apps.Common.content_filter import FilterIndex, is_filter_key
+from Apps.Common.topic_trie import TopicTrie, is_pattern_key, key_pattern
+from Apps.Common.coordination import ensure_paths, claim, swap
 from kazoo.client import KazooClient
 from kazoo.recipe.watchers import ChildrenWatch
 from kazoo.recipe.watchers import DataWatch
+from kazoo.exceptions import NoNodeError
 
 """Broker Middleware class"""
 class BrokerMW():
@@ -27,7 +53,7 @@ class BrokerMW():
   """constructor"""
   def __init__(self, logger):
     self.logger = logger  # internal logger for print statements
-    self.pub = None       # will be a ZMQ PUB socket for dissemination
+    self.pub = None       # will be a ZMQ XPUB socket for dissemination
     self.sub = None       # will be a ZMQ SUB socket for listening to pubs
     self.req = None       # will be a ZMQ REQ socket to talk to Discov service
     self.poller = None    # used to wait on incoming replies
@@ -41,6 +67,23 @@ class BrokerMW():
     self.index = None     # our current co-lead index
     self.pub_listen = False # used to tell if we are listening for new pubs
     self.watch_lead = False # used to tell if we are watching the leaders
+    self.cache = None     # cache of our discovery lookups (revalidated by registry epoch)
+    self.host = None      # id of the host we run on (to find co-located peers)
+    self.endpoints = None # every endpoint our PUB socket is bound on
+    self.connected = None # the publisher endpoints our SUB socket is connected to
+    self.flow = None      # our high-water marks and drop counters
+    self.metrics = None   # our runtime counters and histograms
+    self.log = None       # our durable per topic message log
+    self.replay = None    # the endpoint we serve replays of our log on
+    self.filters = None   # index of the content filters our subscribers gave us
+    self.patterns = None  # trie of the wildcard patterns our subscribers gave us
+    self.aggregator = None # our windowed per topic aggregation stage
+    self.codec = None     # decodes compressed values when we have to look at them
+    self.last_values = None # the last messages of every topic, sent to new subscribers
+    self.workers = None   # our worker processes (if the forwarding is spread over several)
+    self.heartbeat = None # our heartbeats (if they are enabled)
+    self.federation = None # our links to the brokers of other sites (if federated)
+    self.bridge = None    # the endpoint the brokers of other sites link to us on
 
   """configure/initialize"""
   def configure(self, args):
@@ -51,33 +94,105 @@ class BrokerMW():
       self.port = args.port
       self.addr = args.addr
       self.pubs = []
+      self.connected = set()
+      self.cache = LookupCache()
+      # Get the configuration object
+      config = configparser.ConfigParser()
+      config.read(args.config)
+      self.host = host_id(config)
+      self.configure_stages(config)
+      if args.metrics_port: self.metrics.serve(self.addr, args.metrics_port)
+      self.workers = WorkerPool(self.logger, config, args)
+      if self.federation.enabled and self.workers.enabled:
+        self.logger.info("Federation needs us to forward our topics ourselves (no --workers), not federating.")
+        self.federation.enabled = False
+      if self.federation.enabled: self.bridge = f"tcp://{self.addr}:{args.federation_port or int(self.port) + 2}"
       # Now setup ZMQ
-      context = zmq.Context()  # returns a singleton object
+      context = zmq.Context.instance()  # returns a singleton object
       self.poller = zmq.Poller()
       # Now setup the sockets
       self.req = context.socket(zmq.REQ)
-      self.pub = context.socket(zmq.PUB)
+      self.pub = context.socket(zmq.XPUB)
       self.sub = context.socket(zmq.SUB)
       self.poller.register(self.req, zmq.POLLIN)
-      bind_string = f"tcp://{self.addr}:{self.port}"
-      self.logger.debug(f"BrokerMW::configure - bound to: {bind_string}")
-      self.pub.bind(bind_string)
+      self.flow.configure_sender(self.pub)
+      # the last value cache needs to hear about every subscription, not only the first of a key
+      if self.last_values.enabled: self.pub.setsockopt(zmq.XPUB_VERBOSE, 1)
+      self.flow.configure_receiver(self.sub)
+      self.endpoints = bind_endpoints(self.logger, self.pub, config, self.name, self.addr, self.port)
+      self.logger.debug(f"BrokerMW::configure - bound to: {self.endpoints}")
+      if self.workers.enabled:
+        # our topics are forwarded (and logged) by our worker processes
+        self.workers.start(context, self.pub)
+        if self.workers.logged:
+          self.replay = f"tcp://{self.addr}:{args.replay_port or int(self.port) + 1}"
+          self.workers.serve(context, self.replay)
+      else:
+        # Serve replays of our topic log (if we keep one)
+        self.log = LogStore(self.logger, config, self.name)
+        if self.log.enabled:
+          self.replay = f"tcp://{self.addr}:{args.replay_port or int(self.port) + 1}"
+          self.log.serve(context, self.replay)
       # Finally, subscribe to any/all topics
       self.sub.subscribe("")
       # Now setup the zookeeper kazoo client
-      self.zkc = KazooClient(hosts='10.0.0.1:2181')
+      self.zkc = KazooClient(hosts=zk_hosts(config))
       self.zkc.start()
       return self.join_zookeeper()
     except Exception as e: handle_exception(e)
 
+  """configure/initialize one of the worker processes of a broker (see workers.py)"""
+  def configure_worker(self, args, index, count):
+    try:
+      self.logger.debug(f"BrokerMW::configure_worker - worker {index} of {count}")
+      self.name = args.name
+      self.port = args.port
+      self.addr = args.addr
+      # Get the configuration object
+      config = configparser.ConfigParser()
+      config.read(args.config)
+      self.configure_stages(config, index)
+      # the heartbeats of the broker go out through the proxy, once (not once per worker)
+      self.heartbeat.enabled = self.heartbeat.enabled and index == 0
+      self.federation.enabled = False # (see configure)
+      if args.metrics_port: self.metrics.serve(self.addr, args.metrics_port + 1 + index)
+      endpoints = worker_endpoints(config, self.name, self.port, count)
+      # we get the messages of our topics from the broker process and publish through its proxy
+      context = zmq.Context.instance()
+      self.sub = context.socket(zmq.PULL)
+      self.pub = context.socket(zmq.XPUB)
+      self.flow.configure_sender(self.pub)
+      if self.last_values.enabled: self.pub.setsockopt(zmq.XPUB_VERBOSE, 1)
+      self.flow.configure_receiver(self.sub)
+      self.sub.connect(endpoints["in"][index])
+      self.pub.connect(endpoints["out"])
+      # every worker keeps the log of its own topics
+      self.log = LogStore(self.logger, config, f"{self.name}-w{index}")
+      if self.log.enabled: self.log.serve(context, endpoints["replay"][index])
+    except Exception as e: handle_exception(e)
+
+  """set up the stages every forwarded message goes through"""
+  def configure_stages(self, config, worker=None):
+    try:
+      self.filters = FilterIndex()
+      self.patterns = TopicTrie()
+      self.flow = FlowControl(self.logger, config, "Broker")
+      self.metrics = Metrics("broker", self.name if worker is None else f"{self.name}-w{worker}")
+      self.flow.metrics = self.metrics
+      self.aggregator = Aggregator(self.logger, config, self.name)
+      self.codec = Codec(self.logger, config)
+      self.last_values = LastValueCache(config)
+      self.heartbeat = Heartbeat(config, f"{self.addr}:{self.port}")
+      self.federation = Federation(self.logger, config, self.name)
+      self.federation.metrics = self.metrics
+    except Exception as e: handle_exception(e)
+
   """handles configuring this nodes place in zookeeper"""
   def join_zookeeper(self):
       try:
           self.logger.debug("BrokerMW::join_zookeeper")
-          self.zkc.ensure_path('/broker/leaders')
-          self.zkc.ensure_path('/broker/backups')
-          if not self.zkc.exists('/broker/leaders/lead-0'):
-              self.zkc.create('/broker/leaders/lead-0', f'{self.addr}:{self.port}'.encode(), ephemeral=True)
+          ensure_paths(self.zkc, '/broker/leaders', '/broker/backups')
+          if claim(self.zkc, '/broker/leaders/lead-0', f'{self.addr}:{self.port}'.encode()):
               self.is_lead = True
               self.index = 0
           else:
@@ -86,26 +201,26 @@ class BrokerMW():
           return self.is_lead
       except Exception as e: handle_exception(e)
 
-  """handles configuring this nodes place in zookeeper as a co-leader"""
+  """handles configuring this nodes place in zookeeper as a co-leader (returns False if another took it)"""
   def join_zookeeper_as_colead(self, index):
       try:
           self.logger.debug("BrokerMW::join_zookeeper_as_colead")
-          self.zkc.ensure_path('/broker/leaders')
-          if self.zkc.exists(f'/broker/backups/backup-{self.addr}:{self.port}'):
-            self.zkc.delete(f'/broker/backups/backup-{self.addr}:{self.port}')
-          self.zkc.create('/broker/leaders/lead-' + index, f'{self.addr}:{self.port}'.encode(), ephemeral=True)
+          # leave the backups and take the lead znode in one transaction
+          if not swap(self.zkc, f'/broker/backups/backup-{self.addr}:{self.port}',
+                      '/broker/leaders/lead-' + index, f'{self.addr}:{self.port}'.encode()): return False
           self.is_lead = True
           self.index = int(index)
+          return True
       except Exception as e: handle_exception(e)
 
   """handles configuring this nodes place in zookeeper as a backup"""
   def return_to_backup_pool(self):
       try:
           self.logger.debug("BrokerMW::return_to_backup_pool")
-          self.zkc.ensure_path('/broker/backups')
-          if self.index and self.zkc.exists(f'/broker/leaders/lead-{str(self.index)}'):
-            self.zkc.delete(f'/broker/leaders/lead-{str(self.index)}')
-          self.zkc.create(f'/broker/backups/backup-{self.addr}:{self.port}', b'broker-backup', ephemeral=True)
+          # leave the lead znode and rejoin the backups in one transaction
+          backup = f'/broker/backups/backup-{self.addr}:{self.port}'
+          if self.index: swap(self.zkc, f'/broker/leaders/lead-{str(self.index)}', backup, b'broker-backup')
+          else: claim(self.zkc, backup, b'broker-backup')
           self.is_lead = False
           if not self.pub_listen: self.listen_for_new_pubs()
           if not self.watch_lead: self.watch_leaders()
@@ -125,14 +240,14 @@ class BrokerMW():
   def leader_left(self, data, stat):
       try:
           self.logger.debug("BrokerMW::leader_left")
+          self.metrics.inc("zk_events_total", watch="broker_leader")
           # only continue if a lead has died and we are not a lead
           if data == None and stat == None and self.is_lead == False:
               self.logger.info("A lead broker node has left.")
-              time.sleep(random.uniform(0, 1)) # random wait so there is no leader overlap
-              if not self.zkc.exists('/broker/leaders/lead-0'):
-                  self.logger.info("Setting self as a new lead node.")
-                  self.zkc.delete(f'/broker/backups/backup-{self.addr}:{self.port}')
-                  self.zkc.create('/broker/leaders/lead-0', f'{self.addr}:{self.port}'.encode(), ephemeral=True)
+              # of the backups racing for the lead exactly one commits this transaction
+              if swap(self.zkc, f'/broker/backups/backup-{self.addr}:{self.port}',
+                      '/broker/leaders/lead-0', f'{self.addr}:{self.port}'.encode()):
+                  self.logger.info("Set self as a new lead node.")
                   self.is_lead = True
                   self.register_and_listen()
               else: self.logger.info("Another node has replaced the dead lead.")
@@ -144,7 +259,7 @@ class BrokerMW():
     self.logger.info("Registering app with discovery service.")
     result = self.register()
     self.logger.debug(f"BrokerAppln::driver - result: {str(result)}")
-    self.logger.info("Broker app registered.")
+    self.logger.info(f"Broker app registered {self.metrics.startup():.3f}s after our process started.")
     # Now, find all publishers that are registered with discovery
     self.logger.info("Locating all registered publishers.")
     pubs = self.locate_pubs()
@@ -173,6 +288,7 @@ class BrokerMW():
   """Handles the event where there are changes to discovery leader in zookeeper"""
   def handle_discovery_change(self, data, stat):
     try:
+      self.metrics.inc("zk_events_total", watch="discovery_leader")
       if (data):
         self.logger.debug(f"BrokerMW::handle_discovery_change - data: {data}")
         self.logger.info("Connecting to the lead discovery service.")
@@ -184,7 +300,8 @@ class BrokerMW():
         # now build a register req message
         register_req = discovery_pb2.RegisterReq()
         register(self.logger, register_req.BROKER, self.name, 
-               self.addr, self.port, self.req)
+               self.addr, self.port, self.req, host=self.host, endpoints=self.endpoints,
+               replay=self.replay)
         self.event_loop()
         self.logger.info("Subscriber app registered.")
     except Exception as e: handle_exception(e)
@@ -193,16 +310,30 @@ class BrokerMW():
   def locate_pubs(self):
     try:
       self.logger.debug("BrokerMW::locate_pubs")
+      # no need to ask discovery if nothing has changed since our last answer
+      epoch, cached_pubs = self.cache.get(None)
+      if self.cache.is_fresh(None):
+        self.logger.debug(f"BrokerMW::locate_pubs - cached answer is current (epoch {epoch})")
+        self.metrics.inc("lookup_cache_hits_total")
+        return cached_pubs
+      start = time.time()
       # build the request message
       disc_req = discovery_pb2.DiscoveryReq()
       getpubs_msg = discovery_pb2.LookupAllPubsReq()
+      getpubs_msg.epoch = epoch
+      getpubs_msg.host = self.host
+      getpubs_msg.pid = os.getpid()
+      getpubs_msg.broker = f"{self.addr}:{self.port}"
       disc_req.msg_type = discovery_pb2.LOOKUP_ALL_PUBS
       disc_req.pubs_req.CopyFrom(getpubs_msg)
       # send the message
       send_message(self.logger, self.req, disc_req)
       # now go to our event loop to receive a response to this request
-      publishers = self.event_loop()
-      return publishers
+      resp = self.event_loop()
+      self.metrics.observe("lookup_rpc_seconds", time.time() - start)
+      if resp.not_modified: self.logger.debug("BrokerMW::locate_pubs - cached answer revalidated")
+      else: cached_pubs = resp.publishers
+      return self.cache.store(None, resp.epoch, cached_pubs)
     except Exception as e: handle_exception(e)
 
   """listen to zookeeper for alerts about new publishers joining"""
@@ -212,41 +343,82 @@ class BrokerMW():
       self.logger.info("Watching current pubs load to balance if needed...")
       self.zkc.ensure_path('/discovery/pubs')
       ChildrenWatch(self.zkc, '/discovery/pubs', self.handle_pubs_change)
+      DataWatch(self.zkc, '/discovery/epoch', self.handle_epoch_change)
       self.pub_listen = True
     except Exception as e: handle_exception(e)
+
+  """Handles the event where discovery announces a new registry epoch"""
+  def handle_epoch_change(self, data, stat):
+    try:
+      self.metrics.inc("zk_events_total", watch="epoch")
+      if stat:
+        self.logger.debug(f"BrokerMW::handle_epoch_change - epoch: {stat.version}")
+        self.cache.observe(stat.version)
+        # the registry (or our pairings) changed, so our publishers may have as well
+        if self.is_lead: self.subscribe_to_new_pubs()
+    except Exception as e: handle_exception(e)
+
+  """Locates the registered publishers and subscribes to any that are new to us"""
+  def subscribe_to_new_pubs(self):
+    try:
+      self.logger.debug("BrokerMW::subscribe_to_new_pubs")
+      pubs = self.locate_pubs()
+      if (len(pubs) == 0): self.logger.info("No publishers present. Waiting...")
+      else:
+        included = False
+        for pub1 in pubs:
+          p1 = json.loads(pub1)
+          for pub2 in self.pubs:
+            p2 = json.loads(pub2)
+            if p1['name'] == p2['name']: included = True
+          if not included:
+            pub_addr = endpoint_of(p1)
+            if self.connect_to_pub(pub_addr): 
+              self.logger.info(f"Subscribed to new publisher: {pub_addr}")
+          included = False
+      self.disconnect_unpaired(pubs)
+      self.pubs = pubs
+    except Exception as e: handle_exception(e)
+
+  """disconnect from the publishers that discovery paired with another broker"""
+  def disconnect_unpaired(self, pubs):
+    try:
+      paired = self.paired_pubs()
+      if paired is None: return
+      # logical publishers of one process share an endpoint we may still need
+      keep = {endpoint_of(json.loads(pub)) for pub in pubs}
+      for pub in self.pubs:
+        p = json.loads(pub)
+        pub_addr = endpoint_of(p)
+        if p['name'] not in paired and pub_addr not in keep and pub_addr in self.connected:
+          self.sub.disconnect(pub_addr)
+          self.connected.discard(pub_addr)
+          self.logger.info(f"Publisher {p['name']} moved to another broker. Unsubscribed from: {pub_addr}")
+    except Exception as e: handle_exception(e)
+
+  """return the names of the publishers the pairing table gives us (None if there is no table)"""
+  def paired_pubs(self):
+    try:
+      data, _ = self.zkc.get('/discovery/pairing')
+      return set(json.loads(data)["brokers"].get(f"{self.addr}:{self.port}", {}))
+    except NoNodeError: return None
+    except Exception as e: handle_exception(e)
   
   """Handles the event where there are changes to the pubs in zookeeper"""
   def handle_pubs_change(self, children):
     try:
       self.logger.debug(f"BrokerMW::handle_pubs_change - children: {children}")
+      self.metrics.inc("zk_events_total", watch="pubs")
       leaders = self.zkc.get_children('/broker/leaders')
       index = len(leaders)
       self.logger.debug(f"BrokerMW::handle_pubs_change - index: {index}")
       if self.is_lead and len(self.pubs) == 0:
-        time.sleep(0.5) # sleep for a moment to not overwhelm
-        pubs = self.locate_pubs()
-        if (len(pubs) == 0): self.logger.info("No publishers present. Waiting...")
-        else:
-          included = False
-          for pub1 in pubs:
-            p1 = json.loads(pub1)
-            for pub2 in self.pubs:
-              p2 = json.loads(pub2)
-              if p1['name'] == p2['name']: included = True
-            if not included:
-              pub_addr = f"tcp://{p1['ip']}:{p1['port']}"
-              self.sub.connect(pub_addr)
-              self.logger.info(f"Subscribed to new publisher: {pub_addr}")
-            included = False
-        self.pubs = pubs
+        # the registry epoch watch picks up the new pubs once discovery knows them
+        self.logger.debug("BrokerMW::handle_pubs_change - waiting on discovery epoch")
       elif len(self.pubs) == 0 and len(children) > index:
-        time.sleep(random.uniform(0, 1)) # random wait so there is no co-leader overlap
-        node_exists = self.zkc.exists('/broker/leaders/lead-' + str(index))
-        self.logger.debug(f"BrokerMW::handle_pubs_change - node_exists: {node_exists}")
-        if not node_exists:
-          self.logger.info(f"Load increased. Joining as co-lead to balance new load.")
-          # join zookeeper as a co-lead broker
-          self.join_zookeeper_as_colead(str(index))
+        # join zookeeper as a co-lead broker (of the backups racing for it exactly one does)
+        if self.join_zookeeper_as_colead(str(index)):
+          self.logger.info(f"Load increased. Joined as co-lead to balance new load.")
           # register with discovery to get paired with a pub
           self.register_and_listen()
       elif len(self.pubs) > 0:
@@ -270,29 +442,163 @@ class BrokerMW():
       self.logger.debug("BrokerMW::sub_to_pubs")
       # Subscribe to each publisher
       for pub in pubs:
-        p = json.loads(pub)
-        pub_addr = f"tcp://{p['ip']}:{p['port']}"
-        self.sub.connect(pub_addr)
-        self.logger.info(f"Subscribed to publisher: {pub_addr}")
+        pub_addr = endpoint_of(pub)
+        if self.connect_to_pub(pub_addr): 
+          self.logger.info(f"Subscribed to publisher: {pub_addr}")
         self.pubs.append(pub)
     except Exception as e: handle_exception(e)
+
+  """connect our SUB socket to the endpoint (returns False if already connected)"""
+  def connect_to_pub(self, pub_addr):
+    try:
+      # logical publishers hosted by one process all share the same endpoint
+      if pub_addr in self.connected: return False
+      self.sub.connect(pub_addr)
+      self.connected.add(pub_addr)
+      return True
+    except Exception as e: handle_exception(e)
   
-  """listen to all of our subscribed publishers"""
+  """listen to all of our subscribed publishers (and to the subscriptions of our subscribers)"""
   def listen_to_pubs(self):
     try:
       self.logger.debug("BrokerMW::listen_to_pubs")
+      if self.workers and self.workers.enabled: return self.route_to_workers()
+      poller = zmq.Poller()
+      poller.register(self.sub, zmq.POLLIN)
+      poller.register(self.pub, zmq.POLLIN)
+      if self.federation.enabled: self.federation.start(zmq.Context.instance(), self.bridge, poller)
       while True:
-        # receive and disseminate messages from the publishers
-        message_bytes = self.sub.recv_multipart()
-        message = str(message_bytes[0], 'UTF-8')
-        self.logger.debug(f"BrokerMW::listen_to_pubs - Passing on message from publisher: {message}")
-        # determine if a message is a history message
-        if "hs-" in message and "-hw-" in message:
-          # if it is a history message, add our info to the message
-          msg_parts = message.split("hs-")
-          new_message = msg_parts[0] + f"pi-{self.addr}:{self.port}-hs-" + msg_parts[1]
-          disseminate(self.logger, self.pub, new_message)
-        else: disseminate(self.logger, self.pub, message)
+        # wake up in time to close the next aggregation window (if any is open), for our heartbeats
+        # and for our federation summaries
+        timeouts = [t for t in (self.aggregator.timeout(), self.heartbeat.timeout(),
+                                self.federation.timeout()) if t is not None]
+        events = dict(poller.poll(min(timeouts) if timeouts else None))
+        if self.pub in events: self.handle_subscription()
+        if self.sub in events: self.forward()
+        for sock in events:
+          if self.federation.owns(sock): self.receive_federated(sock)
+        if self.aggregator.enabled: self.publish_aggregates()
+        if self.federation.enabled: self.federation.tick()
+        self.heartbeat.beat(self.pub)
+    except Exception as e: handle_exception(e)
+
+  """receive a message on one of our federation links (and forward it if it is a publication)"""
+  def receive_federated(self, sock):
+    try:
+      received = self.federation.receive(sock)
+      if received: self.forward(*received)
+    except Exception as e: handle_exception(e)
+
+  """pass every message of our publishers on to the worker owning its topic"""
+  def route_to_workers(self):
+    try:
+      while True: self.workers.route(self.sub.recv_multipart(copy=False))
+    except Exception as e: handle_exception(e)
+
+  """publish the aggregates of every window that has closed"""
+  def publish_aggregates(self):
+    try:
+      for frames in self.aggregator.flush(time.time()):
+        topic = frames[0].split(b":", 1)[0].decode()
+        self.flow.send(self.pub, frames)
+        self.last_values.store(topic, self.name, "data", frames, frames[0].split(b":", 1)[1].decode())
+        for key in self.patterns.match(topic): self.flow.send(self.pub, [key.encode()] + frames, topic)
+        self.metrics.inc("aggregates_total", topic=topic)
+    except Exception as e: handle_exception(e)
+
+  """handle a subscribe/unsubscribe of one of our subscribers"""
+  def handle_subscription(self):
+    try:
+      data = self.pub.recv()
+      # the other sites only get the topics our subscribers want
+      if self.federation.enabled: self.federation.subscription(data)
+      # XPUB only tells us about the first subscribe (every one if verbose) and the last unsubscribe of a key
+      key = data[1:].decode()
+      if is_pattern_key(key):
+        if data[0] == 1: self.patterns.insert(key_pattern(key), key)
+        else: self.patterns.remove(key_pattern(key), key)
+        self.logger.info(f"Wildcard subscription {'added' if data[0] == 1 else 'removed'}: {key}")
+      elif is_filter_key(key):
+        if data[0] == 1:
+          if self.filters.add(key): self.logger.info(f"New subscription filter: {key}")
+          else: self.logger.info(f"Ignoring unrecognized subscription filter: {key}")
+        else:
+          self.filters.remove(key)
+          self.logger.info(f"Subscription filter removed: {key}")
+      # a new subscriber gets the current state of what it subscribed to right away
+      if data[0] == 1: self.send_snapshot(key)
+    except Exception as e: handle_exception(e)
+
+  """send the cached last messages matching a new subscription"""
+  def send_snapshot(self, key):
+    try:
+      keyed = is_filter_key(key) or is_pattern_key(key)
+      for frames in self.last_values.snapshot(key):
+        # snapshots for filters and patterns come under their key
+        topic = frames[1 if keyed else 0].split(b":", 1)[0].decode()
+        self.flow.send(self.pub, frames, topic)
+        self.metrics.inc("snapshot_sends_total", topic=topic)
+    except Exception as e: handle_exception(e)
+
+  """receive a message from one of our publishers (or take one from another site) and disseminate it"""
+  def forward(self, message_bytes=None, path=None):
+    try:
+      # the path of a message from another site holds the sites it went through
+      if message_bytes is None: message_bytes = self.sub.recv_multipart()
+      received = time.time()
+      # the heartbeats of our publishers are for discovery, not for our subscribers
+      if message_bytes[0].startswith(HEARTBEAT): return
+      # a traced message keeps its trace out of our log and last value cache
+      trace = pop_trace(message_bytes)
+      message = str(message_bytes[0], 'UTF-8')
+      self.logger.debug(f"BrokerMW::forward - Passing on message from publisher: {message}")
+      topic = message.split(":")[0]
+      self.metrics.inc("messages_in_total", topic=topic)
+      self.metrics.inc("bytes_in_total", sum(len(frame) for frame in message_bytes))
+      # count any messages the publisher sent that never reached us
+      header = parse_header(message_bytes)
+      if header:
+        self.flow.observe(header["pub"], topic, header["seq"])
+        self.metrics.observe("latency_seconds", time.time() - header["ts"])
+      # determine if a message is a history message
+      if "hs-" in message and "-hw-" in message:
+        # if it is a history message, add our info to the message
+        msg_parts = message.split("hs-")
+        new_message = msg_parts[0] + f"pi-{self.addr}:{self.port}-hs-" + msg_parts[1]
+        message_bytes[0] = new_message.encode()
+        # every filtering subscriber of the topic needs the history as well
+        keys = self.filters.keys(topic)
+        self.last_values.store(topic, header["pub"] if header else None, "history", message_bytes)
+      else:
+        if self.log.enabled:
+          # keep the message for replays (publisher histories are not worth keeping)
+          self.log.append(topic, header["ts"] if header else time.time(), message_bytes)
+          self.metrics.inc("messages_logged_total", topic=topic)
+        value = message.split(":", 1)[1]
+        known = not self.codec.compressed(header)
+        # compressed frames pass through untouched unless a filter or the aggregation needs the value
+        if not known and (self.filters.has_filters(topic) or
+            (self.aggregator.enabled and self.aggregator.aggregates(topic))):
+          value = self.codec.decode(message_bytes, header).split(":", 1)[1]
+          self.metrics.inc("messages_decoded_total", topic=topic)
+          known = True
+        keys = self.filters.match(topic, value)
+        self.aggregator.add(topic, value, time.time())
+        # a compressed value we did not decode is not known (to filter snapshots on)
+        self.last_values.store(topic, header["pub"] if header else None, "data", message_bytes, value if known else None)
+      keys += self.patterns.match(topic)
+      # the trace gets our in and out times appended, the other frames are not touched
+      if trace is not None:
+        message_bytes = message_bytes + [stamp(stamp(trace, self.name, "in", received), self.name, "out")]
+      # pass on the header (and any compressed) frame untouched
+      self.flow.send(self.pub, message_bytes)
+      # and once more under every matching filter (or pattern) key
+      for key in keys:
+        self.flow.send(self.pub, [key.encode()] + message_bytes, topic)
+        self.metrics.inc("filter_sends_total", topic=topic)
+      # and on to the other sites that want it
+      if self.federation.enabled: self.federation.send(topic, message_bytes, path)
+      self.flow.maybe_report()
     except Exception as e: handle_exception(e)
 
   """run event loop where we expect to receive replies to sent requests"""
@@ -321,6 +627,6 @@ class BrokerMW():
           raise Exception(disc_resp.register_resp.fail_reason) # return register error
         else: return disc_resp.register_resp.result # return response to register
       elif disc_resp.msg_type == discovery_pb2.LOOKUP_ALL_PUBS:
-        return disc_resp.pubs_resp.publishers # return response to lookup_all_pubs request
+        return disc_resp.pubs_resp # return response to lookup_all_pubs request
       else: raise Exception("Unrecognized response message.")
     except Exception as e: handle_exception(e)
@@ -0,0 +1,300 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Durable per topic message log of the broker
+# Semester: Spring 2023
+###############################################
+#
+# The history of a topic used to live only in the memory of its publishers,
+# so it was gone as soon as they died. The broker now appends every message
+# it forwards to an append-only log per topic so that late (or returning)
+# subscribers can ask for a replay:
+# (1) the log of a topic is split into segments of SegmentBytes. A segment
+#     is a preallocated file that is memory mapped, so an append is a copy
+#     into the map and a read is a slice of it (no read calls, no copies)
+# (2) every message gets the next offset of its topic. Each segment keeps
+#     an index entry (position, timestamp) per message in a .idx file next
+#     to it, so a replay can start from an offset or from a point in time
+# (3) whole segments are deleted once the topic is over RetentionBytes or
+#     once their newest message is older than RetentionSeconds
+#
+# Replays are served by a thread of their own on a ROUTER socket, so a big
+# replay never holds up live forwarding. The records are handed to ZMQ as
+# slices of the map (zero copy for anything above the pyzmq copy threshold).
+#
+# A record in a segment is laid out as:
+#   length (u32) | timestamp (f64) | then per frame: length (u32) | frame
+# (a message is two frames, or three when its payload is compressed)
+#
+# import statements
+import os, mmap, time, struct, bisect, threading, zmq
+from urllib.parse import quote, unquote
+from Apps.Common import topic_pb2
+from Apps.Common.topic_trie import is_pattern, topic_matches
+
+RECORD = struct.Struct("<Id")  # length of the rest of the record, timestamp
+FRAME = struct.Struct("<I")    # length of a frame of the message
+INDEX = struct.Struct("<Qd")   # position of the record in its segment, timestamp
+
+"""length of the record body holding the frames"""
+def record_length(frames):
+  return sum(FRAME.size + len(frame) for frame in frames)
+
+"""Segment class"""
+class Segment():
+
+  """constructor (opens or creates the segment whose first offset is base)"""
+  def __init__(self, path, base, size):
+    self.base = base          # offset of the first message in this segment
+    self.log_path = os.path.join(path, f"{base:020d}.log")
+    self.idx_path = os.path.join(path, f"{base:020d}.idx")
+    self.index = []           # (position, timestamp) of every message in this segment
+    self.position = 0         # where the next record goes
+    self.file = open(self.log_path, "a+b")
+    if os.path.getsize(self.log_path) < size: self.file.truncate(size)
+    self.size = os.path.getsize(self.log_path)
+    self.map = mmap.mmap(self.file.fileno(), self.size)
+    self.recover()
+    self.idx_file = open(self.idx_path, "ab")
+
+  """load our index and add any records that made it into the log but not the index"""
+  def recover(self):
+    if os.path.exists(self.idx_path):
+      with open(self.idx_path, "rb") as idx:
+        data = idx.read()
+      usable = len(data) - len(data) % INDEX.size
+      self.index = [INDEX.unpack_from(data, i) for i in range(0, usable, INDEX.size)]
+      if usable != len(data):
+        with open(self.idx_path, "r+b") as idx: idx.truncate(usable)
+    if self.index:
+      last = self.index[-1][0]
+      self.position = last + RECORD.size + RECORD.unpack_from(self.map, last)[0]
+    # a zero length marks the preallocated space that was never written
+    while self.position + RECORD.size <= self.size:
+      length, ts = RECORD.unpack_from(self.map, self.position)
+      if length == 0 or self.position + RECORD.size + length > self.size: break
+      self.index.append((self.position, ts))
+      with open(self.idx_path, "ab") as idx: idx.write(INDEX.pack(self.position, ts))
+      self.position += RECORD.size + length
+
+  """tells if a record of the given length still fits in this segment"""
+  def fits(self, length):
+    return self.position + RECORD.size + length <= self.size
+
+  """append a message (its frames) and return its position"""
+  def append(self, ts, frames):
+    length = record_length(frames)
+    start = self.position
+    body = start + RECORD.size
+    for frame in frames:
+      self.map[body:body + FRAME.size] = FRAME.pack(len(frame))
+      self.map[body + FRAME.size:body + FRAME.size + len(frame)] = frame
+      body += FRAME.size + len(frame)
+    # the length goes in last so a torn record looks like free space
+    RECORD.pack_into(self.map, start, length, ts)
+    self.idx_file.write(INDEX.pack(start, ts))
+    self.index.append((start, ts))
+    self.position = start + RECORD.size + length
+    return start
+
+  """return (timestamp, frames) of the message with the given offset, the frames as slices of the map"""
+  def read(self, offset):
+    start, ts = self.index[offset - self.base]
+    body = start + RECORD.size
+    end = body + RECORD.unpack_from(self.map, start)[0]
+    view = memoryview(self.map)
+    frames = []
+    while body < end:
+      frame_len = FRAME.unpack_from(self.map, body)[0]
+      frames.append(view[body + FRAME.size:body + FRAME.size + frame_len])
+      body += FRAME.size + frame_len
+    return ts, frames
+
+  """return the first offset in this segment published at or after the given time"""
+  def find(self, ts):
+    return self.base + bisect.bisect_left(self.index, ts, key=lambda entry: entry[1])
+
+  """the offset the next message in this segment would get"""
+  def next_offset(self):
+    return self.base + len(self.index)
+
+  """timestamp of the newest message in this segment (0 if empty)"""
+  def newest(self):
+    return self.index[-1][1] if self.index else 0
+
+  """write our dirty pages and index entries to disk"""
+  def flush(self):
+    self.map.flush()
+    self.idx_file.flush()
+
+  """delete our files (readers still holding slices keep the map alive)"""
+  def delete(self):
+    self.idx_file.close()
+    self.file.close()
+    os.remove(self.log_path)
+    os.remove(self.idx_path)
+
+"""TopicLog class"""
+class TopicLog():
+
+  """constructor (opens the existing segments of the topic, if any)"""
+  def __init__(self, path, segment_bytes):
+    self.path = path                    # directory holding our segments
+    self.segment_bytes = segment_bytes  # preallocated size of a new segment
+    self.lock = threading.Lock()        # the replay thread reads while we append
+    self.segments = []                  # our segments, oldest first
+    os.makedirs(path, exist_ok=True)
+    bases = sorted(int(f[:-4]) for f in os.listdir(path) if f.endswith(".log"))
+    for base in bases:
+      segment_path = os.path.join(path, f"{base:020d}")
+      # a crash right after a rollover can leave a segment that was never preallocated (nor written)
+      if os.path.getsize(segment_path + ".log") == 0:
+        os.remove(segment_path + ".log")
+        if os.path.exists(segment_path + ".idx"): os.remove(segment_path + ".idx")
+        continue
+      self.segments.append(Segment(path, base, 0))
+    if not self.segments: self.segments.append(Segment(path, 0, segment_bytes))
+
+  """append a message and return its offset"""
+  def append(self, ts, frames):
+    active = self.segments[-1]
+    length = record_length(frames)
+    if not active.fits(length):
+      active.flush()
+      active = Segment(self.path, active.next_offset(), max(self.segment_bytes, RECORD.size + length))
+      with self.lock: self.segments.append(active)
+    offset = active.next_offset()
+    active.append(ts, frames)
+    return offset
+
+  """the oldest offset we still hold"""
+  def first_offset(self):
+    with self.lock: return self.segments[0].base
+
+  """the offset the next message will get"""
+  def next_offset(self):
+    with self.lock: return self.segments[-1].next_offset()
+
+  """return the first offset published at or after the given time"""
+  def find(self, ts):
+    with self.lock: segments = list(self.segments)
+    for segment in segments:
+      if segment.newest() >= ts: return segment.find(ts)
+    return segments[-1].next_offset()
+
+  """yield (offset, timestamp, frames) from the given offset up to the current end"""
+  def read(self, offset, end):
+    with self.lock: segments = list(self.segments)
+    for segment in segments:
+      while segment.base <= offset < min(segment.next_offset(), end):
+        yield (offset,) + segment.read(offset)
+        offset += 1
+
+  """delete the oldest segments that are over our size or age limits"""
+  def enforce_retention(self, max_bytes, max_age):
+    with self.lock:
+      while len(self.segments) > 1:
+        oldest = self.segments[0]
+        total = sum(segment.position for segment in self.segments)
+        too_big = max_bytes and total > max_bytes
+        too_old = max_age and oldest.newest() < time.time() - max_age
+        if not (too_big or too_old): break
+        self.segments.pop(0).delete()
+
+  """write all of our segments to disk"""
+  def flush(self):
+    with self.lock:
+      for segment in self.segments: segment.flush()
+
+"""LogStore class"""
+class LogStore():
+
+  """constructor"""
+  def __init__(self, logger, config, name):
+    self.logger = logger        # internal logger for print statements
+    self.enabled = False        # whether we keep a log at all
+    self.path = None            # directory holding the logs of every topic
+    self.segment_bytes = 0      # preallocated size of a segment
+    self.retention_bytes = 0    # max bytes kept per topic (0 = no limit)
+    self.retention_seconds = 0  # max age of a segment (0 = no limit)
+    self.flush_interval = 0     # seconds between two flushes to disk
+    self.last_check = 0         # when we last flushed and enforced retention
+    self.topics = {}            # topic -> TopicLog
+    self.lock = threading.Lock() # guards self.topics
+    if config.has_section("TopicLog"):
+      settings = config["TopicLog"]
+      self.enabled = settings.getboolean("Enabled", False)
+      self.path = os.path.join(settings.get("Dir", "/tmp/cs6381/log"), name)
+      self.segment_bytes = int(settings.get("SegmentBytes", str(16 * 1024 * 1024)))
+      self.retention_bytes = int(settings.get("RetentionBytes", "0"))
+      self.retention_seconds = int(settings.get("RetentionSeconds", "0"))
+      self.flush_interval = int(settings.get("FlushInterval", "1"))
+    self.last_check = time.time()
+    # reopen the logs we kept before a restart so that they can be replayed
+    if self.enabled and os.path.isdir(self.path):
+      for topic in os.listdir(self.path): self.topic(unquote(topic))
+
+  """return the log of the topic (opening or creating it if needed)"""
+  def topic(self, topic):
+    with self.lock:
+      if topic not in self.topics:
+        # hierarchical topic names must not turn into nested directories
+        self.topics[topic] = TopicLog(os.path.join(self.path, quote(topic, safe="")), self.segment_bytes)
+      return self.topics[topic]
+
+  """append the frames of a received message to the log of its topic"""
+  def append(self, topic, ts, frames):
+    offset = self.topic(topic).append(ts, frames)
+    if time.time() - self.last_check >= self.flush_interval:
+      self.last_check = time.time()
+      for log in list(self.topics.values()):
+        log.flush()
+        log.enforce_retention(self.retention_bytes, self.retention_seconds)
+    return offset
+
+  """serve replay requests on a ROUTER socket bound to the endpoint (in a thread of its own)"""
+  def serve(self, context, endpoint):
+    router = context.socket(zmq.ROUTER)
+    # fail on peers that went away instead of silently dropping their replay
+    router.setsockopt(zmq.ROUTER_MANDATORY, 1)
+    router.bind(endpoint)
+    self.logger.debug(f"LogStore::serve - replays served on: {endpoint}")
+    threading.Thread(target=self.serve_replays, args=(router,), daemon=True).start()
+
+  """answer replay requests forever"""
+  def serve_replays(self, router):
+    while True:
+      # every frame before the request routes the replay back (more than one behind a worker pool)
+      *identity, request = router.recv_multipart()
+      replay_req = topic_pb2.ReplayReq()
+      try:
+        replay_req.ParseFromString(request)
+        self.replay(router, identity, replay_req)
+      except zmq.ZMQError as e:
+        self.logger.info(f"Replay of {replay_req.topic} stopped: {e}")
+      # a bad request must not keep us from serving the next one
+      except Exception as e:
+        self.logger.info(f"Ignoring a bad replay request ({type(e).__name__}: {e})")
+
+  """stream the requested part of the topic log (or of the logs of every topic matching a pattern)"""
+  def replay(self, router, identity, replay_req):
+    with self.lock:
+      if is_pattern(replay_req.topic):
+        logs = [log for topic, log in self.topics.items() if topic_matches(replay_req.topic, topic)]
+      else: logs = [self.topics[replay_req.topic]] if replay_req.topic in self.topics else []
+    replay_end = topic_pb2.ReplayEnd()
+    replay_end.topic = replay_req.topic
+    for log in logs:
+      end = log.next_offset()  # messages logged during the replay arrive live anyway
+      start = log.find(replay_req.from_ts) if replay_req.from_ts else replay_req.from_offset
+      start = max(start, log.first_offset())
+      if replay_req.max_records: end = min(end, start + replay_req.max_records)
+      self.logger.info(f"Replaying {log.path} offsets {start} to {end}")
+      for offset, ts, frames in log.read(start, end):
+        router.send_multipart(identity + [b"R", str(offset).encode()] + frames, copy=False)
+        replay_end.count += 1
+      # offsets are per topic, so they only tell something for a single topic
+      if len(logs) == 1:
+        replay_end.first_offset = log.first_offset()
+        replay_end.next_offset = end
+    router.send_multipart(identity + [b"E", replay_end.SerializeToString()])
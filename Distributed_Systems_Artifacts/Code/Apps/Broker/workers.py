@@ -0,0 +1,160 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Worker processes of a multi-core broker
+# Semester: Spring 2023
+###############################################
+#
+# A broker is one Python process, so its forwarding tops out at one core.
+# With --workers K > 1 the broker starts K worker processes and every topic
+# is owned by one of them (crc32 of the topic modulo K). The broker process
+# itself keeps everything else (zookeeper, discovery, the SUB socket
+# connected to the publishers and the advertised XPUB endpoint) and only
+# routes the frames it receives:
+#
+#   publishers -> SUB -> route by topic -> PUSH (ipc) -> PULL worker i
+#   worker i XPUB -> XSUB (ipc) -> proxy -> advertised XPUB -> subscribers
+#
+# Every worker runs the usual forwarding stages (filters, patterns, log,
+# aggregation, last values) for its topics only. The proxy passes the
+# subscriptions of our subscribers up to every worker, so each of them
+# knows every filter and pattern and sends the snapshots of its own topics.
+# Each worker keeps the topic log of its topics under <name>-w<i>; replay
+# requests on the advertised replay endpoint are routed to the worker that
+# owns the topic (or to all of them for a pattern), and their ends merged.
+#
+# import statements
+import os, zlib, time, logging, threading, zmq
+from Apps.Common import topic_pb2
+from Apps.Common.topic_trie import is_pattern
+
+"""return the index of the worker owning the topic (bytes or str)"""
+def partition(topic, count):
+  if isinstance(topic, str): topic = topic.encode()
+  return zlib.crc32(topic) % count
+
+"""return the ipc endpoints the broker and its workers talk over"""
+def worker_endpoints(config, name, port, count):
+  ipc_dir = "/tmp/cs6381"
+  if config.has_section("Transport"): ipc_dir = config["Transport"].get("IpcDir", ipc_dir)
+  os.makedirs(ipc_dir, exist_ok=True)
+  prefix = f"ipc://{ipc_dir}/{name}-{port}"
+  return {"out": f"{prefix}-out.ipc",
+          "in": [f"{prefix}-w{i}.ipc" for i in range(count)],
+          "replay": [f"{prefix}-w{i}-replay.ipc" for i in range(count)]}
+
+"""entry point of a worker process"""
+def run_worker(args, index, count, parent):
+  logging.basicConfig(level=args.loglevel,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+  logger = logging.getLogger(f"BrokerWorker{index}")
+  # go away with the broker process, whichever way it ended
+  def watch_parent():
+    while os.getppid() == parent: time.sleep(1)
+    os._exit(0)
+  threading.Thread(target=watch_parent, daemon=True).start()
+  from Apps.Common.profiling import install_profiler
+  install_profiler(logger, "broker", args, f"{args.name}-w{index}")
+  from Apps.Broker.middleware import BrokerMW
+  mw_obj = BrokerMW(logger)
+  mw_obj.configure_worker(args, index, count)
+  mw_obj.listen_to_pubs()
+
+"""WorkerPool class"""
+class WorkerPool():
+
+  """constructor"""
+  def __init__(self, logger, config, args):
+    self.logger = logger        # internal logger for print statements
+    self.args = args            # the arguments the workers are configured with
+    self.count = args.workers   # number of worker processes
+    self.enabled = self.count > 1 # whether we run workers at all
+    self.logged = False         # whether the workers keep topic logs
+    self.endpoints = None       # ipc endpoints shared with the workers
+    self.pushes = []            # PUSH socket to every worker
+    self.procs = []             # the worker processes
+    if config.has_section("TopicLog"): self.logged = config["TopicLog"].getboolean("Enabled", False)
+    if self.enabled: self.endpoints = worker_endpoints(config, args.name, args.port, self.count)
+
+  """start the workers and proxy their XPUB sockets onto our (advertised) XPUB socket"""
+  def start(self, context, front):
+    xsub = context.socket(zmq.XSUB)
+    xsub.bind(self.endpoints["out"])
+    for endpoint in self.endpoints["in"]:
+      push = context.socket(zmq.PUSH)
+      push.setsockopt(zmq.SNDHWM, front.getsockopt(zmq.SNDHWM))
+      push.bind(endpoint)
+      self.pushes.append(push)
+    # spawned (not forked) since we already hold zmq and zookeeper state
+    import multiprocessing # only here, a broker without workers does not pay for importing it
+    mp = multiprocessing.get_context("spawn")
+    for index in range(self.count):
+      proc = mp.Process(target=run_worker, args=(self.args, index, self.count, os.getpid()), daemon=True)
+      proc.start()
+      self.procs.append(proc)
+    self.logger.info(f"Started {self.count} broker workers: {[proc.pid for proc in self.procs]}")
+    # the proxy runs in zmq (without the GIL), both ways: messages down, subscriptions up
+    threading.Thread(target=zmq.proxy, args=(xsub, front), daemon=True).start()
+
+  """pass the frames of a received message on to the worker owning its topic"""
+  def route(self, frames):
+    topic = frames[0].bytes.split(b":", 1)[0]
+    self.pushes[partition(topic, self.count)].send_multipart(frames, copy=False)
+
+  """serve replay requests on the endpoint by routing them to the workers (in a thread of its own)"""
+  def serve(self, context, endpoint):
+    front = context.socket(zmq.ROUTER)
+    front.setsockopt(zmq.ROUTER_MANDATORY, 1)
+    front.bind(endpoint)
+    dealers = []
+    for worker_endpoint in self.endpoints["replay"]:
+      dealer = context.socket(zmq.DEALER)
+      dealer.connect(worker_endpoint)
+      dealers.append(dealer)
+    self.logger.debug(f"WorkerPool::serve - replays served on: {endpoint}")
+    threading.Thread(target=self.route_replays, args=(front, dealers), daemon=True).start()
+
+  """pass replay requests to the workers and their replays back, merging the ends"""
+  def route_replays(self, front, dealers):
+    poller = zmq.Poller()
+    poller.register(front, zmq.POLLIN)
+    for dealer in dealers: poller.register(dealer, zmq.POLLIN)
+    pending = {}  # requester identity -> [ends still expected, merged ReplayEnd] (patterns only)
+    while True:
+      events = dict(poller.poll())
+      if front in events:
+        # a bad request must not keep us from routing the next one (for any worker)
+        try:
+          identity, request = front.recv_multipart()
+          replay_req = topic_pb2.ReplayReq()
+          replay_req.ParseFromString(request)
+          if is_pattern(replay_req.topic):
+            targets = dealers
+            pending[identity] = [len(dealers), topic_pb2.ReplayEnd(topic=replay_req.topic)]
+          else: targets = [dealers[partition(replay_req.topic, self.count)]]
+          for dealer in targets: dealer.send_multipart([identity, request])
+        except Exception as e:
+          self.logger.info(f"Ignoring a bad replay request ({type(e).__name__}: {e})")
+      for dealer in dealers:
+        if dealer not in events: continue
+        frames = dealer.recv_multipart(copy=False)
+        identity = frames[0].bytes
+        try:
+          # replays of a single topic (and all the replayed messages) pass straight through
+          if frames[1].bytes == b"R" or identity not in pending:
+            front.send_multipart(frames, copy=False)
+            continue
+          replay_end = topic_pb2.ReplayEnd()
+          replay_end.ParseFromString(frames[2].bytes)
+          waiting = pending[identity]
+          waiting[0] -= 1
+          waiting[1].count += replay_end.count
+          if waiting[0] == 0:
+            del pending[identity]
+            front.send_multipart([identity, b"E", waiting[1].SerializeToString()])
+        except zmq.ZMQError as e:
+          self.logger.info(f"Replay to {identity} stopped: {e}")
+          pending.pop(identity, None)
+        except Exception as e:
+          self.logger.info(f"Ignoring a bad replay from a worker ({type(e).__name__}: {e})")
+          pending.pop(identity, None)
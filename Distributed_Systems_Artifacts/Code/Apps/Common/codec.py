@@ -0,0 +1,119 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Optional compression of publication payloads
+# Semester: Spring 2023
+###############################################
+#
+# History windows go out as a stringified list on every publication, so they
+# are by far the largest messages we send. When the [Compression] section of
+# the config file names a codec, publishers compress every payload of at
+# least MinBytes and the envelope of the message becomes:
+#   frame 0: the plain part ("topic:" or "topic:hs-<n>-hw-" for histories)
+#   frame 1: the header, with "codec" (and "dict" if a dictionary was used)
+#   frame 2: the compressed rest of the message
+# Frame 0 stays readable so ZMQ subscriptions and the broker (which adds its
+# address to histories) keep working on it, and the broker forwards frame 2
+# untouched. It only decodes a value when a filter or the aggregation stage
+# needs it. Subscribers decode by the codec named in the header, so the
+# publishers of a system do not all have to agree on one.
+#
+# Short sensor values barely compress on their own, so a shared dictionary
+# (trained on topic samples, see Testing/train_dictionary.py) can be given
+# with Dictionary. Everyone that decodes must then load the same file.
+#
+# import statements
+import json, zlib
+zstandard = None # only imported once Codec=zstd is used (see check)
+lz4 = None       # only imported once Codec=lz4 is used (see check)
+
+CODECS = ["none", "zlib", "zstd", "lz4"]
+
+"""Codec class"""
+class Codec():
+
+  """constructor"""
+  def __init__(self, logger, config):
+    self.logger = logger      # internal logger for print statements
+    self.name = "none"        # the codec we compress with (none, zlib, zstd or lz4)
+    self.level = 3            # compression level
+    self.min_bytes = 256      # payloads shorter than this go out uncompressed
+    self.dictionary = None    # raw bytes of the shared dictionary (if any)
+    self.dict_id = None       # short id of the dictionary, carried in the header
+    self.compressors = {}     # codec -> compressor (built on first use)
+    self.decompressors = {}   # codec -> decompressor (built on first use)
+    if config is not None and config.has_section("Compression"):
+      settings = config["Compression"]
+      self.name = settings.get("Codec", "none").lower()
+      self.level = int(settings.get("Level", "3"))
+      self.min_bytes = int(settings.get("MinBytes", "256"))
+      path = settings.get("Dictionary", "").strip()
+      if path:
+        with open(path, "rb") as f: self.dictionary = f.read()
+        self.dict_id = f"{zlib.crc32(self.dictionary):08x}"
+    if self.name not in CODECS: raise Exception(f"Unknown codec: {self.name} (expected one of {CODECS})")
+    if self.name != "none": self.check(self.name)
+    if self.name == "lz4" and self.dictionary:
+      self.logger.info("Codec - lz4 does not take a dictionary, compressing without it")
+
+  """make sure the library of the codec is imported (and installed)"""
+  def check(self, name):
+    global zstandard, lz4
+    if name == "zstd" and zstandard is None:
+      try: import zstandard
+      except ImportError: raise Exception("Codec=zstd needs zstandard (pip install zstandard)")
+    if name == "lz4" and lz4 is None:
+      try: import lz4.frame
+      except ImportError: raise Exception("Codec=lz4 needs lz4 (pip install lz4)")
+
+  """return the frames of the data, compressing everything after its first plain characters"""
+  def encode(self, data, plain, header):
+    body = data[plain:].encode()
+    if self.name == "none" or header is None or len(body) < self.min_bytes:
+      frames = [data.encode()]
+      if header is not None: frames.append(json.dumps(header).encode())
+      return frames
+    header["codec"] = self.name
+    if self.dict_id and self.name != "lz4": header["dict"] = self.dict_id
+    return [data[:plain].encode(), json.dumps(header).encode(), self.compress(body)]
+
+  """tells if the message with the given header carries a compressed body"""
+  def compressed(self, header):
+    return bool(header) and header.get("codec", "none") != "none"
+
+  """return the whole message as a string (decompressing its body if needed)"""
+  def decode(self, frames, header):
+    if not self.compressed(header): return str(frames[0], 'UTF-8')
+    if header.get("dict") and header["dict"] != self.dict_id:
+      raise Exception(f"Message compressed with dictionary {header['dict']}, we have {self.dict_id}")
+    return str(frames[0], 'UTF-8') + str(self.decompress(header["codec"], frames[2]), 'UTF-8')
+
+  """compress the bytes with our codec"""
+  def compress(self, data):
+    if self.name == "zlib":
+      # a compressobj holding a dictionary cannot be reused, so we copy a primed one
+      if "zlib" not in self.compressors:
+        self.compressors["zlib"] = zlib.compressobj(self.level, zdict=self.dictionary) \
+          if self.dictionary else zlib.compressobj(self.level)
+      compressor = self.compressors["zlib"].copy()
+      return compressor.compress(data) + compressor.flush()
+    if self.name == "zstd":
+      if "zstd" not in self.compressors:
+        zdict = zstandard.ZstdCompressionDict(self.dictionary) if self.dictionary else None
+        self.compressors["zstd"] = zstandard.ZstdCompressor(level=self.level, dict_data=zdict)
+      return self.compressors["zstd"].compress(data)
+    return lz4.frame.compress(data, compression_level=self.level)
+
+  """decompress the bytes with the given codec"""
+  def decompress(self, name, data):
+    if name == "zlib":
+      decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+      return decompressor.decompress(data) + decompressor.flush()
+    self.check(name)
+    if name == "zstd":
+      if "zstd" not in self.decompressors:
+        zdict = zstandard.ZstdCompressionDict(self.dictionary) if self.dictionary else None
+        self.decompressors["zstd"] = zstandard.ZstdDecompressor(dict_data=zdict)
+      return self.decompressors["zstd"].decompress(data)
+    if name == "lz4": return lz4.frame.decompress(data)
+    raise Exception(f"Unknown codec: {name}")
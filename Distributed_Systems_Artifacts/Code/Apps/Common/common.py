@@ -9,8 +9,13 @@
 # This file contains any declarations that are common to all middleware entities
 #
 # import statements
-import json
+import os, json, time
 from Apps.Common import discovery_pb2
+from Apps.Common.transport import best_endpoint
+
+# when our process started (ms), so that a restarted publisher is told apart
+# from the process that used its name (and sequence numbers) before
+RUN = int(time.time() * 1000)
 
 """handle the given exception"""
 def handle_exception(e):
@@ -19,7 +24,7 @@ def handle_exception(e):
 
 """dump the contents of the object"""
 def dump(logger, app, ip, port, name=None, iters=None,
-         topiclist=None, numpubs=None, numsubs=None):
+         topiclist=None, numpubs=None, numsubs=None, count=None):
   try:
     logger.debug("**********************************")
     logger.debug(f"     {app}::dump")
@@ -31,18 +36,24 @@ def dump(logger, app, ip, port, name=None, iters=None,
       logger.debug(f"     TopicList: {topiclist}")
       logger.info(f"App: {name} - {ip}:{port}; Topiclist: {topiclist}")
     if iters: logger.debug(f"     Iterations: {iters}")
+    if count: 
+      logger.debug(f"     Logical Publishers: {count}")
+      logger.info(f"App: {name} - {ip}:{port}; Logical publishers: {count}")
     if numpubs: logger.debug(f"     Pubs Expected: {numpubs}")
     if numsubs: logger.debug(f"     Subs Expected: {numsubs}")
     logger.debug("**********************************")
   except Exception as e: handle_exception(e)
 
 """format and return the given array of publishers"""
-def format_pubs(pubs):
+def format_pubs(pubs, host=None, pid=None):
     try:
       formatted_pubs = []; pub_names = []
       for pub in pubs:
-          try: publisher = {"name": pub.id.name, "ip": pub.id.ip, "port": pub.id.port}
-          except: publisher = {"name": pub.name, "ip": pub.ip, "port": pub.port}
+          id = pub.id if hasattr(pub, "id") else pub
+          publisher = {"name": id.name, "ip": id.ip, "port": id.port}
+          # hand out the best transport for the requester (if we know where it is)
+          publisher["endpoint"] = best_endpoint(id, host, pid)
+          if id.replay: publisher["replay"] = id.replay
           if publisher["name"] not in pub_names:
               formatted_pubs.append(json.dumps(publisher))
               pub_names.append(publisher["name"])
@@ -57,44 +68,112 @@ def send_message(logger, socket, message):
       socket.send(buf2send)
     except Exception as e: handle_exception(e)
 
-"""register with the discovery service"""
-def register(logger, role, name, addr, port, req, topiclist=None):
+"""return the ZooKeeper ensemble to connect to (host:port list)"""
+def zk_hosts(config):
+    if config.has_section("ZooKeeper"): return config["ZooKeeper"].get("Hosts", "10.0.0.1:2181")
+    return "10.0.0.1:2181"
+
+"""build a register request message"""
+def build_register_req(role, name, addr, port, topiclist=None, 
+                       host=None, endpoints=None, replay=None):
   try:
-    logger.debug("Common::register")
-    # build the request message
-    disc_req = discovery_pb2.DiscoveryReq()
     register_req = discovery_pb2.RegisterReq() 
     register_req.role = role
     if topiclist: register_req.topiclist.extend(topiclist)
     register_req.id.name = name
     register_req.id.ip = addr
     register_req.id.port = port
+    register_req.id.pid = os.getpid()
+    if host: register_req.id.host = host
+    if endpoints: register_req.id.endpoints.extend(endpoints)
+    if replay: register_req.id.replay = replay
+    return register_req
+  except Exception as e: handle_exception(e)
+
+"""build a deregister request message"""
+def build_deregister_req(role, name, addr, port, topiclist=None):
+  try:
+    deregister_req = discovery_pb2.DeregisterReq() 
+    deregister_req.role = role
+    if topiclist: deregister_req.topiclist.extend(topiclist)
+    deregister_req.id.name = name
+    deregister_req.id.ip = addr
+    deregister_req.id.port = port
+    return deregister_req
+  except Exception as e: handle_exception(e)
+
+"""register with the discovery service"""
+def register(logger, role, name, addr, port, req, topiclist=None, 
+             host=None, endpoints=None, replay=None):
+  try:
+    logger.debug("Common::register")
+    # build the request message
+    disc_req = discovery_pb2.DiscoveryReq()
+    register_req = build_register_req(role, name, addr, port, topiclist, host, endpoints, replay)
     disc_req.msg_type = discovery_pb2.REGISTER
     disc_req.register_req.CopyFrom(register_req)
     # send the message
     send_message(logger, req, disc_req)
   except Exception as e: handle_exception(e)
 
+"""register a batch of built register requests with the discovery service"""
+def register_batch(logger, register_reqs, req):
+  try:
+    logger.debug("Common::register_batch")
+    # build the request message
+    disc_req = discovery_pb2.DiscoveryReq()
+    disc_req.register_batch.registrations.extend(register_reqs)
+    disc_req.msg_type = discovery_pb2.REGISTER_BATCH
+    # send the message
+    send_message(logger, req, disc_req)
+  except Exception as e: handle_exception(e)
+
 """deregister with the discovery service"""
 def deregister(logger, role, name, addr, port, req, topiclist=None):
   try:
     logger.debug("Common::register")
     # build the request message
     disc_req = discovery_pb2.DiscoveryReq()
-    deregister_req = discovery_pb2.DeregisterReq() 
-    deregister_req.role = role
-    if topiclist: deregister_req.topiclist.extend(topiclist)
-    deregister_req.id.name = name
-    deregister_req.id.ip = addr
-    deregister_req.id.port = port
+    deregister_req = build_deregister_req(role, name, addr, port, topiclist)
     disc_req.msg_type = discovery_pb2.DEREGISTER
     disc_req.deregister_req.CopyFrom(deregister_req)
     # send the message
     send_message(logger, req, disc_req)
   except Exception as e: handle_exception(e)
 
-"""disseminate the data on our pub socket"""
-def disseminate(logger, pub, data):
+"""deregister a batch of built deregister requests with the discovery service"""
+def deregister_batch(logger, deregister_reqs, req):
+  try:
+    logger.debug("Common::deregister_batch")
+    # build the request message
+    disc_req = discovery_pb2.DiscoveryReq()
+    disc_req.deregister_batch.deregistrations.extend(deregister_reqs)
+    disc_req.msg_type = discovery_pb2.DEREGISTER_BATCH
+    # send the message
+    send_message(logger, req, disc_req)
+  except Exception as e: handle_exception(e)
+
+"""build the header that goes in the second frame of every publication"""
+def make_header(pub, seq):
+    return {"pub": pub, "seq": seq, "ts": time.time(), "run": RUN}
+
+"""return the header of a received publication (None if it has none)"""
+def parse_header(frames):
+    try:
+      if len(frames) < 2: return None
+      return json.loads(frames[1])
+    except Exception as e: handle_exception(e)
+
+"""disseminate the data (and its header and trace) on our pub socket, compressing all but its first plain characters"""
+def disseminate(logger, pub, data, header=None, flow=None, codec=None, plain=None, trace=None):
     logger.debug(f"Common::disseminate - {data}")
-    try: pub.send_string(data)
+    try: 
+      if codec: frames = codec.encode(data, plain, header)
+      else:
+        frames = [data.encode()]
+        if header is not None: frames.append(json.dumps(header).encode())
+      # the trace frame (if the message is traced) always goes last
+      if trace is not None: frames.append(trace)
+      if flow: flow.send(pub, frames)
+      else: pub.send_multipart(frames)
     except Exception as e: handle_exception(e)
@@ -0,0 +1,163 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Content based subscription filters
+# Semester: Spring 2023
+###############################################
+#
+# A plain ZMQ subscription only matches on the topic, so a subscriber that
+# only cares about "temperature > 90" gets every temperature and throws most
+# of them away. A subscriber can instead give filters such as:
+#   temperature>90   pressure<=900   weather in {icy,foggy}   light!=450
+# (one filter per topic). Each filter has a canonical key ("?temperature>90:")
+# that the subscriber subscribes to instead of the topic. The broker reads
+# those subscriptions on its XPUB socket, keeps the filters in a FilterIndex
+# and sends every message once per matching key as [key, message frames...],
+# so ZMQ only hands the message to the subscribers whose filter matched.
+# Subscribers that share a filter share its key, so XPUB already does the
+# reference counting for us.
+#
+# The index keeps the thresholds of every topic sorted per operator, so the
+# matching filters of a value are found with a binary search instead of
+# evaluating every filter, and equality/set filters are a dict lookup.
+#
+# import statements
+import re, bisect
+
+# marks a subscription (and the first frame of a message) as a filter key
+KEY_PREFIX = "?"
+# ends a filter key so that no key is a (ZMQ subscription) prefix of another
+KEY_SUFFIX = ":"
+# the operators we support (longest first so that >= is not read as >)
+OPERATORS = [">=", "<=", "!=", "==", ">", "<", " in "]
+
+"""Filter class"""
+class Filter():
+
+  """constructor"""
+  def __init__(self, topic, op, operand):
+    self.topic = topic      # the topic this filter applies to
+    self.op = op            # one of our operators (stripped)
+    self.operand = operand  # a float for comparisons, a string or a set of strings otherwise
+    self.key = KEY_PREFIX + topic + (" in " if op == "in" else op) + self.format_operand() + KEY_SUFFIX
+
+  """format our operand the same way for every equal filter"""
+  def format_operand(self):
+    if self.op == "in": return "{" + ",".join(sorted(self.operand)) + "}"
+    if isinstance(self.operand, float): return f"{self.operand:g}"
+    return self.operand
+
+  """tells if the value of a publication on our topic matches this filter"""
+  def matches(self, value):
+    if self.op == "in": return value in self.operand
+    if self.op == "==": return value == self.operand
+    if self.op == "!=": return value != self.operand
+    number = to_number(value)
+    if number is None: return False
+    if self.op == ">": return number > self.operand
+    if self.op == ">=": return number >= self.operand
+    if self.op == "<": return number < self.operand
+    return number <= self.operand
+
+"""return the value as a float (None if it is not a number)"""
+def to_number(value):
+  try: return float(value)
+  except ValueError: return None
+
+"""parse a filter such as 'temperature>90' or 'weather in {icy, foggy}' (or its key)"""
+def parse_filter(text):
+  text = text.strip()
+  if text.startswith(KEY_PREFIX): text = text[len(KEY_PREFIX):-len(KEY_SUFFIX)]
+  for op in OPERATORS:
+    if op in text:
+      topic, operand = [part.strip() for part in text.split(op, 1)]
+      op = op.strip()
+      if not topic or not operand: break
+      if op == "in":
+        members = re.fullmatch(r"\{(.*)\}", operand)
+        if not members: raise ValueError(f"Expected a set such as {{a,b}} in filter: {text}")
+        return Filter(topic, op, frozenset(m.strip() for m in members.group(1).split(",") if m.strip()))
+      if op in ("==", "!="): return Filter(topic, op, operand)
+      number = to_number(operand)
+      if number is None: raise ValueError(f"Expected a number in filter: {text}")
+      return Filter(topic, op, number)
+  raise ValueError(f"Unrecognized filter: {text}")
+
+"""sort key of a (threshold, key) index entry"""
+def threshold(entry):
+  return entry[0]
+
+"""tells if the subscription (or first frame) is a filter key"""
+def is_filter_key(data):
+  if isinstance(data, (bytes, bytearray, memoryview)): return bytes(data[:1]) == KEY_PREFIX.encode()
+  return data.startswith(KEY_PREFIX)
+
+"""FilterIndex class"""
+class FilterIndex():
+
+  """constructor"""
+  def __init__(self):
+    self.filters = {}     # key -> Filter
+    self.thresholds = {}  # topic -> operator -> sorted list of (threshold, key)
+    self.values = {}      # topic -> value -> keys (== and in filters)
+    self.others = {}      # topic -> filters checked one by one (!= filters)
+
+  """add the filter with the given key (returns False if it does not parse)"""
+  def add(self, key):
+    if key in self.filters: return True
+    try: f = parse_filter(key)
+    except ValueError: return False
+    self.filters[key] = f
+    if isinstance(f.operand, float):
+      bisect.insort(self.thresholds.setdefault(f.topic, {}).setdefault(f.op, []), (f.operand, key))
+    elif f.op in ("==", "in"):
+      for value in (f.operand if f.op == "in" else [f.operand]):
+        self.values.setdefault(f.topic, {}).setdefault(value, set()).add(key)
+    else: self.others.setdefault(f.topic, []).append(f)
+    return True
+
+  """remove the filter with the given key"""
+  def remove(self, key):
+    f = self.filters.pop(key, None)
+    if f is None: return
+    # a topic without filters left must leave the index, or has_filters keeps saying it has some
+    if isinstance(f.operand, float):
+      self.thresholds[f.topic][f.op].remove((f.operand, key))
+      if not self.thresholds[f.topic][f.op]: del self.thresholds[f.topic][f.op]
+      if not self.thresholds[f.topic]: del self.thresholds[f.topic]
+    elif f.op in ("==", "in"):
+      for value in (f.operand if f.op == "in" else [f.operand]):
+        self.values[f.topic][value].discard(key)
+        if not self.values[f.topic][value]: del self.values[f.topic][value]
+      if not self.values[f.topic]: del self.values[f.topic]
+    else:
+      self.others[f.topic].remove(f)
+      if not self.others[f.topic]: del self.others[f.topic]
+
+  """tells if any filter may be on the topic"""
+  def has_filters(self, topic):
+    return topic in self.thresholds or topic in self.values or topic in self.others
+
+  """return the keys of every filter on the topic"""
+  def keys(self, topic):
+    return [key for key, f in self.filters.items() if f.topic == topic]
+
+  """return the keys of the filters that the value of a publication on the topic matches"""
+  def match(self, topic, value):
+    keys = []
+    thresholds = self.thresholds.get(topic)
+    if thresholds:
+      number = to_number(value)
+      if number is not None:
+        # every threshold below (or above) the value matches
+        for op, entries in thresholds.items():
+          below = bisect.bisect_left(entries, number, key=threshold)   # thresholds < value
+          upto = bisect.bisect_right(entries, number, key=threshold)   # thresholds <= value
+          if op == ">": keys.extend(k for _, k in entries[:below])
+          elif op == ">=": keys.extend(k for _, k in entries[:upto])
+          elif op == "<": keys.extend(k for _, k in entries[upto:])
+          elif op == "<=": keys.extend(k for _, k in entries[below:])
+    if topic in self.values: keys.extend(self.values[topic].get(value, ()))
+    for f in self.others.get(topic, ()):
+      if f.matches(value): keys.append(f.key)
+    return keys
@@ -0,0 +1,88 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Python file for the zookeeper coordination functions
+# Semester: Spring 2023
+###############################################
+#
+# Joining zookeeper used to be a string of round trips (exists in a sleep
+# loop, ensure_path, get_children, exists, create) and taking over a lead
+# was an exists/delete/create sequence behind a random sleep that only made
+# two nodes racing for the same znode less likely. These functions do the
+# same in as few round trips as possible:
+# (1) waiting for a znode is done with a watch instead of polling
+# (2) independent requests are sent with the async kazoo calls, so they
+#     are all in flight at once (zookeeper answers a session in order)
+# (3) moving a node from one znode to another (backup -> lead and back) is
+#     one multi-op transaction, so it either fully happens or not at all,
+#     and of two nodes racing for a znode exactly one gets it
+#
+# import statements
+import threading
+from kazoo.exceptions import NoNodeError, NodeExistsError, RolledBackError
+
+"""block until the znode exists (woken up by a watch, not by polling)"""
+def wait_for_node(zkc, path):
+  while True:
+    changed = threading.Event()
+    if zkc.exists(path, watch=lambda event: changed.set()): return
+    changed.wait()
+
+"""make sure all of the paths exist (all requests in flight at once)"""
+def ensure_paths(zkc, *paths):
+  for pending in [zkc.ensure_path_async(path) for path in paths]: pending.get()
+
+"""create the ephemeral znode unless it exists (returns False if another node holds it)"""
+def claim(zkc, path, data):
+  try: zkc.create(path, data, ephemeral=True, makepath=True)
+  except NodeExistsError: return False
+  return True
+
+"""create our ephemeral znode under the parent and return its other children (the ones before us)"""
+def join_group(zkc, parent, child, data):
+  # the listing is answered before the create since zookeeper keeps the order of a session
+  listing = zkc.get_children_async(parent)
+  created = zkc.create_async(f"{parent}/{child}", data, ephemeral=True)
+  try: created.get()
+  except NodeExistsError: pass  # still there from an earlier registration of ours
+  except NoNodeError:
+    zkc.ensure_path(parent)
+    return join_group(zkc, parent, child, data)
+  return [name for name in listing.get() if name != child]
+
+"""return the error that failed a transaction (None if it was committed)"""
+def failure(results):
+  for result in results:
+    if isinstance(result, Exception) and not isinstance(result, RolledBackError): return result
+  return None
+
+"""atomically replace the znode old (if it exists) with the ephemeral znode new (returns False if new is held)"""
+def swap(zkc, old, new, data):
+  transaction = zkc.transaction()
+  transaction.delete(old)
+  transaction.create(new, data, ephemeral=True)
+  results = transaction.commit()
+  error = failure(results)
+  if error is None: return True
+  if isinstance(results[0], NoNodeError): return claim(zkc, new, data) # we did not hold old
+  if isinstance(error, NodeExistsError): return False
+  raise error
+
+"""return the paths that exist (all requests in flight at once)"""
+def existing(zkc, paths):
+  pending = [(path, zkc.exists_async(path)) for path in paths]
+  return [path for path, stat in pending if stat.get()]
+
+"""create (or delete, with data None) the znodes path -> data in transactions of size, all in flight at once"""
+def commit_batches(zkc, nodes, size, ephemeral=True):
+  pending = []
+  paths = list(nodes)
+  for i in range(0, len(paths), size):
+    transaction = zkc.transaction()
+    for path in paths[i:i + size]:
+      if nodes[path] is None: transaction.delete(path)
+      else: transaction.create(path, nodes[path], ephemeral=ephemeral)
+    pending.append(transaction.commit_async())
+  for results in [p.get() for p in pending]:
+    error = failure(results)
+    if error is not None: raise error
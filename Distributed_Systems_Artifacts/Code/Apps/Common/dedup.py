@@ -0,0 +1,72 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Duplicate suppression for subscribers on redundant paths
+# Semester: Spring 2023
+###############################################
+#
+# With [Pairing] Replicas > 1 every publisher is relayed by several lead
+# brokers and a subscriber (connected to all of them) gets every message
+# once per path. That is on purpose: whichever copy arrives first is
+# delivered, which cuts the tail latency and hides the failure of a broker.
+# The other copies are dropped here, by the (publisher, topic, seq) of their
+# header (sequence numbers are kept per publisher and topic).
+#
+# Every stream keeps a sliding bitmap of the last DedupWindow sequence
+# numbers (a Python int, so a 1024 wide window is 128 bytes). Copies of a
+# message older than the window are dropped as well: a path that far behind
+# brings nothing new.
+#
+# A restarted publisher keeps its name but numbers its messages from 1
+# again, so every header carries the start time of the publisher process
+# (run): a newer run starts the window over and copies of an older run are
+# dropped. A sequence number more than a window below the window starts it
+# over as well (for headers without a run).
+
+"""SeqWindow class"""
+class SeqWindow():
+  __slots__ = ("base", "bits", "width", "run")
+
+  """constructor"""
+  def __init__(self, width):
+    self.base = None    # lowest sequence number in the window
+    self.bits = 0       # bit i set = base + i was seen
+    self.width = width  # number of sequence numbers in the window
+    self.run = None     # start time of the publisher process the window is of
+
+  """mark the sequence number (of the publisher process started at run) as seen (returns False if it already was)"""
+  def first(self, seq, run=None):
+    if run is not None and self.run is not None:
+      if run < self.run: return False  # a copy from before the publisher restarted
+      if run > self.run: self.base = None
+    if run is not None: self.run = run
+    # the publisher restarted (and its header does not tell us)
+    if self.base is not None and seq + self.width < self.base: self.base = None
+    if self.base is None: self.base, self.bits = max(0, seq - self.width + 1), 0
+    if seq < self.base: return False
+    if seq >= self.base + self.width:
+      # slide the window so that seq is its newest number
+      shift = seq - self.width + 1 - self.base
+      self.bits >>= shift
+      self.base += shift
+    bit = 1 << (seq - self.base)
+    if self.bits & bit: return False
+    self.bits |= bit
+    return True
+
+"""Deduplicator class"""
+class Deduplicator():
+
+  """constructor"""
+  def __init__(self, config):
+    self.width = 1024     # sequence numbers remembered per stream (0 = no dedup)
+    self.windows = {}     # (publisher, topic) -> SeqWindow
+    if config.has_section("Dissemination"):
+      self.width = int(config["Dissemination"].get("DedupWindow", "1024"))
+
+  """tells if this is the first copy of the message (always True without dedup)"""
+  def first_copy(self, pub, topic, seq, run=None):
+    if not self.width: return True
+    window = self.windows.get((pub, topic))
+    if window is None: window = self.windows[(pub, topic)] = SeqWindow(self.width)
+    return window.first(seq, run)
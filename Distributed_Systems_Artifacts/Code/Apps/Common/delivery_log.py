@@ -0,0 +1,82 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Records of the messages we sent or received, for verification
+# Semester: Spring 2023
+###############################################
+#
+# With a record directory given (--record_dir), every publisher writes a
+# line per message it sends and every subscriber a line per message it
+# receives, both keyed by the (publisher, topic, seq) of the message header:
+#   <name>.sent.csv: pub, topic, seq, kind, ts, value
+#   <name>.recv.csv: pub, topic, seq, sent_ts, recv_ts, source
+# kind is d (data) or h (history), source is live or replay. A subscriber
+# starts its file with comment lines holding its topics and filters.
+# Testing/verify_delivery.py joins the files of a run and reports losses,
+# duplicates and reordering (and the outages around injected failures).
+#
+# Writes go through a buffered file that is flushed every FLUSH_INTERVAL
+# seconds (and on exit), so recording stays out of the way of the hot path.
+# Test runners stop clients with SIGTERM, which ends a process without its
+# exit handlers, so the file is also closed on SIGTERM before whatever
+# handled it before us (the profiler, or the default of ending the process).
+#
+# import statements
+import os, csv, json, time, atexit, signal, threading
+
+# seconds between two flushes of a record file
+FLUSH_INTERVAL = 1
+
+"""DeliveryLog class"""
+class DeliveryLog():
+
+  """constructor (records nothing unless a directory is given)"""
+  def __init__(self, directory, name, kind):
+    self.enabled = bool(directory)  # whether we record at all
+    self.file = None                # the open record file
+    self.writer = None              # csv writer on our file
+    self.last_flush = 0             # when we last flushed our file
+    self.previous = None            # the SIGTERM handler before ours
+    if self.enabled:
+      os.makedirs(directory, exist_ok=True)
+      self.file = open(os.path.join(directory, f"{name}.{kind}.csv"), "w", newline="")
+      self.writer = csv.writer(self.file)
+      self.last_flush = time.time()
+      atexit.register(self.close)
+      # signal handlers can only be set from the main thread
+      if threading.current_thread() is threading.main_thread():
+        self.previous = signal.signal(signal.SIGTERM, self.terminate)
+
+  """write a comment line describing the recording client (topics, filters...)"""
+  def describe(self, key, value):
+    if not self.enabled: return
+    self.file.write(f"# {key}={json.dumps(value)}\n")
+
+  """record a message we sent"""
+  def sent(self, header, topic, kind, value=""):
+    if not self.enabled or not header: return
+    self.write([header["pub"], topic, header["seq"], kind, f"{header['ts']:.6f}", value])
+
+  """record a message we received"""
+  def received(self, header, topic, source):
+    if not self.enabled or not header: return
+    self.write([header["pub"], topic, header["seq"], f"{header['ts']:.6f}", f"{time.time():.6f}", source])
+
+  """write a row, flushing the file once in a while"""
+  def write(self, row):
+    self.writer.writerow(row)
+    if time.time() - self.last_flush >= FLUSH_INTERVAL:
+      self.last_flush = time.time()
+      self.file.flush()
+
+  """flush and close our file"""
+  def close(self):
+    if self.file and not self.file.closed: self.file.close()
+
+  """close our file on SIGTERM, then hand the signal on to the handler before ours"""
+  def terminate(self, signum, frame):
+    self.close()
+    if callable(self.previous): return self.previous(signum, frame)
+    if self.previous == signal.SIG_IGN: return
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
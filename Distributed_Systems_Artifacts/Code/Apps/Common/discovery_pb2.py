@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64iscovery.proto\"=\n\x02ID\x12\x0f\n\x07node_id\x18\x01 \x01(\x03\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\n\n\x02ip\x18\x03 \x01(\t\x12\x0c\n\x04port\x18\x04 \x01(\t\"\x93\x01\n\x0bRegisterReq\x12\x1f\n\x04role\x18\x01 \x01(\x0e\x32\x11.RegisterReq.Role\x12\x11\n\ttopiclist\x18\x02 \x03(\t\x12\x0f\n\x02id\x18\x03 \x01(\x0b\x32\x03.ID\"?\n\x04Role\x12\r\n\tPUBLISHER\x10\x00\x12\x0e\n\nSUBSCRIBER\x10\x01\x12\n\n\x06\x42ROKER\x10\x02\x12\x0c\n\x08\x44HT_NODE\x10\x03\"}\n\rDeregisterReq\x12!\n\x04role\x18\x01 \x01(\x0e\x32\x13.DeregisterReq.Role\x12\x11\n\ttopiclist\x18\x02 \x03(\t\x12\x0f\n\x02id\x18\x03 \x01(\x0b\x32\x03.ID\"%\n\x04Role\x12\r\n\tPUBLISHER\x10\x00\x12\x0e\n\nSUBSCRIBER\x10\x01\"\xdb\x01\n\x0cRegisterResp\x12$\n\x06result\x18\x01 \x01(\x0e\x32\x14.RegisterResp.Result\x12\x13\n\x0b\x66\x61il_reason\x18\x02 \x01(\t\x12\x33\n\x0eneighbor_nodes\x18\x03 \x01(\x0b\x32\x1b.RegisterResp.NeighborNodes\x1a\x37\n\rNeighborNodes\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"\"\n\x06Result\x12\x0b\n\x07SUCCESS\x10\x00\x12\x0b\n\x07\x46\x41ILURE\x10\x01\"\xe1\x01\n\x0e\x44\x65registerResp\x12&\n\x06result\x18\x01 \x01(\x0e\x32\x16.DeregisterResp.Result\x12\x13\n\x0b\x66\x61il_reason\x18\x02 \x01(\t\x12\x35\n\x0eneighbor_nodes\x18\x03 \x01(\x0b\x32\x1d.DeregisterResp.NeighborNodes\x1a\x37\n\rNeighborNodes\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"\"\n\x06Result\x12\x0b\n\x07SUCCESS\x10\x00\x12\x0b\n\x07\x46\x41ILURE\x10\x01\"\xab\x01\n\tLocateReq\x12\x15\n\x08new_node\x18\x01 \x01(\x0b\x32\x03.ID\x12(\n\ntopic_info\x18\x02 \x01(\x0b\x32\x14.LocateReq.TopicInfo\x12\x15\n\rstart_node_id\x18\x03 \x01(\x03\x1a\x46\n\tTopicInfo\x12\x12\n\ntopic_hash\x18\x01 \x01(\x03\x12\x13\n\x06\x61pp_id\x18\x02 \x01(\x0b\x32\x03.ID\x12\x10\n\x08\x61pp_type\x18\x03 \x01(\t\"\x9f\x01\n\nLocateResp\x12/\n\rlocation_info\x18\x01 \x01(\x0b\x32\x18.LocateResp.LocationInfo\x12\x17\n\npublishers\x18\x02 \x03(\x0b\x32\x03.ID\x12\x0f\n\x07success\x18\x03 \x01(\x08\x1a\x36\n\x0cLocationInfo\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"Q\n\tUpdateReq\x12\x15\n\x08new_node\x18\x01 \x01(\x0b\x32\x03.ID\x12\x16\n\x0ewhich_neighbor\x18\x02 \x01(\t\x12\x15\n\rstart_node_id\x18\x03 \x01(\x03\"\x0c\n\nIsReadyReq\"\x1c\n\x0bIsReadyResp\x12\r\n\x05reply\x18\x01 \x01(\x08\"(\n\x13LookupPubByTopicReq\x12\x11\n\ttopiclist\x18\x01 \x03(\t\"*\n\x14LookupPubByTopicResp\x12\x12\n\npublishers\x18\x01 \x03(\t\"\x12\n\x10LookupAllPubsReq\"\'\n\x11LookupAllPubsResp\x12\x12\n\npublishers\x18\x01 \x03(\t\"\xba\x02\n\x0c\x44iscoveryReq\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12$\n\x0cregister_req\x18\x02 \x01(\x0b\x32\x0c.RegisterReqH\x00\x12(\n\x0e\x64\x65register_req\x18\x03 \x01(\x0b\x32\x0e.DeregisterReqH\x00\x12\x1f\n\x08is_ready\x18\x04 \x01(\x0b\x32\x0b.IsReadyReqH\x00\x12&\n\x06topics\x18\x05 \x01(\x0b\x32\x14.LookupPubByTopicReqH\x00\x12%\n\x08pubs_req\x18\x06 \x01(\x0b\x32\x11.LookupAllPubsReqH\x00\x12 \n\nlocate_req\x18\x07 \x01(\x0b\x32\n.LocateReqH\x00\x12 \n\nupdate_req\x18\x08 \x01(\x0b\x32\n.UpdateReqH\x00\x42\t\n\x07\x43ontent\"\xa1\x02\n\rDiscoveryResp\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12&\n\rregister_resp\x18\x02 \x01(\x0b\x32\r.RegisterRespH\x00\x12*\n\x0f\x64\x65register_resp\x18\x03 \x01(\x0b\x32\x0f.DeregisterRespH\x00\x12 \n\x08is_ready\x18\x04 \x01(\x0b\x32\x0c.IsReadyRespH\x00\x12%\n\x04resp\x18\x05 \x01(\x0b\x32\x15.LookupPubByTopicRespH\x00\x12\'\n\tpubs_resp\x18\x06 \x01(\x0b\x32\x12.LookupAllPubsRespH\x00\x12\"\n\x0blocate_resp\x18\x07 \x01(\x0b\x32\x0b.LocateRespH\x00\x42\t\n\x07\x43ontent*\xe0\x01\n\x08MsgTypes\x12\x0b\n\x07UNKNOWN\x10\x00\x12\x0c\n\x08REGISTER\x10\x01\x12\x0e\n\nDEREGISTER\x10\x02\x12\x0b\n\x07ISREADY\x10\x03\x12\x17\n\x13LOOKUP_PUB_BY_TOPIC\x10\x04\x12\x13\n\x0fLOOKUP_ALL_PUBS\x10\x05\x12\x13\n\x0fLOCATE_NEW_NODE\x10\x06\x12\x15\n\x11LOCATE_HASH_TABLE\x10\x07\x12\x1c\n\x18LOCATE_PUB_BY_TOPIC_HASH\x10\x08\x12\x13\n\x0fLOCATE_ALL_PUBS\x10\t\x12\x0f\n\x0bUPDATE_NODE\x10\nb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64iscovery.proto\"{\n\x02ID\x12\x0f\n\x07node_id\x18\x01 \x01(\x03\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\n\n\x02ip\x18\x03 \x01(\t\x12\x0c\n\x04port\x18\x04 \x01(\t\x12\x0c\n\x04host\x18\x05 \x01(\t\x12\x0b\n\x03pid\x18\x06 \x01(\x03\x12\x11\n\tendpoints\x18\x07 \x03(\t\x12\x0e\n\x06replay\x18\x08 \x01(\t\"\x93\x01\n\x0bRegisterReq\x12\x1f\n\x04role\x18\x01 \x01(\x0e\x32\x11.RegisterReq.Role\x12\x11\n\ttopiclist\x18\x02 \x03(\t\x12\x0f\n\x02id\x18\x03 \x01(\x0b\x32\x03.ID\"?\n\x04Role\x12\r\n\tPUBLISHER\x10\x00\x12\x0e\n\nSUBSCRIBER\x10\x01\x12\n\n\x06\x42ROKER\x10\x02\x12\x0c\n\x08\x44HT_NODE\x10\x03\"}\n\rDeregisterReq\x12!\n\x04role\x18\x01 \x01(\x0e\x32\x13.DeregisterReq.Role\x12\x11\n\ttopiclist\x18\x02 \x03(\t\x12\x0f\n\x02id\x18\x03 \x01(\x0b\x32\x03.ID\"%\n\x04Role\x12\r\n\tPUBLISHER\x10\x00\x12\x0e\n\nSUBSCRIBER\x10\x01\"7\n\x10RegisterBatchReq\x12#\n\rregistrations\x18\x01 \x03(\x0b\x32\x0c.RegisterReq\"=\n\x12\x44\x65registerBatchReq\x12\'\n\x0f\x64\x65registrations\x18\x01 \x03(\x0b\x32\x0e.DeregisterReq\"\xdb\x01\n\x0cRegisterResp\x12$\n\x06result\x18\x01 \x01(\x0e\x32\x14.RegisterResp.Result\x12\x13\n\x0b\x66\x61il_reason\x18\x02 \x01(\t\x12\x33\n\x0eneighbor_nodes\x18\x03 \x01(\x0b\x32\x1b.RegisterResp.NeighborNodes\x1a\x37\n\rNeighborNodes\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"\"\n\x06Result\x12\x0b\n\x07SUCCESS\x10\x00\x12\x0b\n\x07\x46\x41ILURE\x10\x01\"\xe1\x01\n\x0e\x44\x65registerResp\x12&\n\x06result\x18\x01 \x01(\x0e\x32\x16.DeregisterResp.Result\x12\x13\n\x0b\x66\x61il_reason\x18\x02 \x01(\t\x12\x35\n\x0eneighbor_nodes\x18\x03 \x01(\x0b\x32\x1d.DeregisterResp.NeighborNodes\x1a\x37\n\rNeighborNodes\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"\"\n\x06Result\x12\x0b\n\x07SUCCESS\x10\x00\x12\x0b\n\x07\x46\x41ILURE\x10\x01\"\xab\x01\n\tLocateReq\x12\x15\n\x08new_node\x18\x01 \x01(\x0b\x32\x03.ID\x12(\n\ntopic_info\x18\x02 \x01(\x0b\x32\x14.LocateReq.TopicInfo\x12\x15\n\rstart_node_id\x18\x03 \x01(\x03\x1a\x46\n\tTopicInfo\x12\x12\n\ntopic_hash\x18\x01 \x01(\x03\x12\x13\n\x06\x61pp_id\x18\x02 \x01(\x0b\x32\x03.ID\x12\x10\n\x08\x61pp_type\x18\x03 \x01(\t\"\x9f\x01\n\nLocateResp\x12/\n\rlocation_info\x18\x01 \x01(\x0b\x32\x18.LocateResp.LocationInfo\x12\x17\n\npublishers\x18\x02 \x03(\x0b\x32\x03.ID\x12\x0f\n\x07success\x18\x03 \x01(\x08\x1a\x36\n\x0cLocationInfo\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"Q\n\tUpdateReq\x12\x15\n\x08new_node\x18\x01 \x01(\x0b\x32\x03.ID\x12\x16\n\x0ewhich_neighbor\x18\x02 \x01(\t\x12\x15\n\rstart_node_id\x18\x03 \x01(\x03\"\x0c\n\nIsReadyReq\"\x1c\n\x0bIsReadyResp\x12\r\n\x05reply\x18\x01 \x01(\x08\"R\n\x13LookupPubByTopicReq\x12\x11\n\ttopiclist\x18\x01 \x03(\t\x12\r\n\x05\x65poch\x18\x02 \x01(\x03\x12\x0c\n\x04host\x18\x03 \x01(\t\x12\x0b\n\x03pid\x18\x04 \x01(\x03\"O\n\x14LookupPubByTopicResp\x12\x12\n\npublishers\x18\x01 \x03(\t\x12\r\n\x05\x65poch\x18\x02 \x01(\x03\x12\x14\n\x0cnot_modified\x18\x03 \x01(\x08\"L\n\x10LookupAllPubsReq\x12\r\n\x05\x65poch\x18\x01 \x01(\x03\x12\x0c\n\x04host\x18\x02 \x01(\t\x12\x0b\n\x03pid\x18\x03 \x01(\x03\x12\x0e\n\x06\x62roker\x18\x04 \x01(\t\"L\n\x11LookupAllPubsResp\x12\x12\n\npublishers\x18\x01 \x03(\t\x12\r\n\x05\x65poch\x18\x02 \x01(\x03\x12\x14\n\x0cnot_modified\x18\x03 \x01(\x08\"\x98\x03\n\x0c\x44iscoveryReq\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12$\n\x0cregister_req\x18\x02 \x01(\x0b\x32\x0c.RegisterReqH\x00\x12(\n\x0e\x64\x65register_req\x18\x03 \x01(\x0b\x32\x0e.DeregisterReqH\x00\x12\x1f\n\x08is_ready\x18\x04 \x01(\x0b\x32\x0b.IsReadyReqH\x00\x12&\n\x06topics\x18\x05 \x01(\x0b\x32\x14.LookupPubByTopicReqH\x00\x12%\n\x08pubs_req\x18\x06 \x01(\x0b\x32\x11.LookupAllPubsReqH\x00\x12 \n\nlocate_req\x18\x07 \x01(\x0b\x32\n.LocateReqH\x00\x12 \n\nupdate_req\x18\x08 \x01(\x0b\x32\n.UpdateReqH\x00\x12+\n\x0eregister_batch\x18\t \x01(\x0b\x32\x11.RegisterBatchReqH\x00\x12/\n\x10\x64\x65register_batch\x18\n \x01(\x0b\x32\x13.DeregisterBatchReqH\x00\x42\t\n\x07\x43ontent\"\xa1\x02\n\rDiscoveryResp\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12&\n\rregister_resp\x18\x02 \x01(\x0b\x32\r.RegisterRespH\x00\x12*\n\x0f\x64\x65register_resp\x18\x03 \x01(\x0b\x32\x0f.DeregisterRespH\x00\x12 \n\x08is_ready\x18\x04 \x01(\x0b\x32\x0c.IsReadyRespH\x00\x12%\n\x04resp\x18\x05 \x01(\x0b\x32\x15.LookupPubByTopicRespH\x00\x12\'\n\tpubs_resp\x18\x06 \x01(\x0b\x32\x12.LookupAllPubsRespH\x00\x12\"\n\x0blocate_resp\x18\x07 \x01(\x0b\x32\x0b.LocateRespH\x00\x42\t\n\x07\x43ontent*\x8a\x02\n\x08MsgTypes\x12\x0b\n\x07UNKNOWN\x10\x00\x12\x0c\n\x08REGISTER\x10\x01\x12\x0e\n\nDEREGISTER\x10\x02\x12\x0b\n\x07ISREADY\x10\x03\x12\x17\n\x13LOOKUP_PUB_BY_TOPIC\x10\x04\x12\x13\n\x0fLOOKUP_ALL_PUBS\x10\x05\x12\x13\n\x0fLOCATE_NEW_NODE\x10\x06\x12\x15\n\x11LOCATE_HASH_TABLE\x10\x07\x12\x1c\n\x18LOCATE_PUB_BY_TOPIC_HASH\x10\x08\x12\x13\n\x0fLOCATE_ALL_PUBS\x10\t\x12\x0f\n\x0bUPDATE_NODE\x10\n\x12\x12\n\x0eREGISTER_BATCH\x10\x0b\x12\x14\n\x10\x44\x45REGISTER_BATCH\x10\x0c\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -21,54 +21,58 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'discovery_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
-  _globals['_MSGTYPES']._serialized_start=2029
-  _globals['_MSGTYPES']._serialized_end=2253
+  _globals['_MSGTYPES']._serialized_start=2479
+  _globals['_MSGTYPES']._serialized_end=2745
   _globals['_ID']._serialized_start=19
-  _globals['_ID']._serialized_end=80
-  _globals['_REGISTERREQ']._serialized_start=83
-  _globals['_REGISTERREQ']._serialized_end=230
-  _globals['_REGISTERREQ_ROLE']._serialized_start=167
-  _globals['_REGISTERREQ_ROLE']._serialized_end=230
-  _globals['_DEREGISTERREQ']._serialized_start=232
-  _globals['_DEREGISTERREQ']._serialized_end=357
-  _globals['_DEREGISTERREQ_ROLE']._serialized_start=167
-  _globals['_DEREGISTERREQ_ROLE']._serialized_end=204
-  _globals['_REGISTERRESP']._serialized_start=360
-  _globals['_REGISTERRESP']._serialized_end=579
-  _globals['_REGISTERRESP_NEIGHBORNODES']._serialized_start=488
-  _globals['_REGISTERRESP_NEIGHBORNODES']._serialized_end=543
-  _globals['_REGISTERRESP_RESULT']._serialized_start=545
-  _globals['_REGISTERRESP_RESULT']._serialized_end=579
-  _globals['_DEREGISTERRESP']._serialized_start=582
-  _globals['_DEREGISTERRESP']._serialized_end=807
-  _globals['_DEREGISTERRESP_NEIGHBORNODES']._serialized_start=488
-  _globals['_DEREGISTERRESP_NEIGHBORNODES']._serialized_end=543
-  _globals['_DEREGISTERRESP_RESULT']._serialized_start=545
-  _globals['_DEREGISTERRESP_RESULT']._serialized_end=579
-  _globals['_LOCATEREQ']._serialized_start=810
-  _globals['_LOCATEREQ']._serialized_end=981
-  _globals['_LOCATEREQ_TOPICINFO']._serialized_start=911
-  _globals['_LOCATEREQ_TOPICINFO']._serialized_end=981
-  _globals['_LOCATERESP']._serialized_start=984
-  _globals['_LOCATERESP']._serialized_end=1143
-  _globals['_LOCATERESP_LOCATIONINFO']._serialized_start=1089
-  _globals['_LOCATERESP_LOCATIONINFO']._serialized_end=1143
-  _globals['_UPDATEREQ']._serialized_start=1145
-  _globals['_UPDATEREQ']._serialized_end=1226
-  _globals['_ISREADYREQ']._serialized_start=1228
-  _globals['_ISREADYREQ']._serialized_end=1240
-  _globals['_ISREADYRESP']._serialized_start=1242
-  _globals['_ISREADYRESP']._serialized_end=1270
-  _globals['_LOOKUPPUBBYTOPICREQ']._serialized_start=1272
-  _globals['_LOOKUPPUBBYTOPICREQ']._serialized_end=1312
-  _globals['_LOOKUPPUBBYTOPICRESP']._serialized_start=1314
-  _globals['_LOOKUPPUBBYTOPICRESP']._serialized_end=1356
-  _globals['_LOOKUPALLPUBSREQ']._serialized_start=1358
-  _globals['_LOOKUPALLPUBSREQ']._serialized_end=1376
-  _globals['_LOOKUPALLPUBSRESP']._serialized_start=1378
-  _globals['_LOOKUPALLPUBSRESP']._serialized_end=1417
-  _globals['_DISCOVERYREQ']._serialized_start=1420
-  _globals['_DISCOVERYREQ']._serialized_end=1734
-  _globals['_DISCOVERYRESP']._serialized_start=1737
-  _globals['_DISCOVERYRESP']._serialized_end=2026
+  _globals['_ID']._serialized_end=142
+  _globals['_REGISTERREQ']._serialized_start=145
+  _globals['_REGISTERREQ']._serialized_end=292
+  _globals['_REGISTERREQ_ROLE']._serialized_start=229
+  _globals['_REGISTERREQ_ROLE']._serialized_end=292
+  _globals['_DEREGISTERREQ']._serialized_start=294
+  _globals['_DEREGISTERREQ']._serialized_end=419
+  _globals['_DEREGISTERREQ_ROLE']._serialized_start=229
+  _globals['_DEREGISTERREQ_ROLE']._serialized_end=266
+  _globals['_REGISTERBATCHREQ']._serialized_start=421
+  _globals['_REGISTERBATCHREQ']._serialized_end=476
+  _globals['_DEREGISTERBATCHREQ']._serialized_start=478
+  _globals['_DEREGISTERBATCHREQ']._serialized_end=539
+  _globals['_REGISTERRESP']._serialized_start=542
+  _globals['_REGISTERRESP']._serialized_end=761
+  _globals['_REGISTERRESP_NEIGHBORNODES']._serialized_start=670
+  _globals['_REGISTERRESP_NEIGHBORNODES']._serialized_end=725
+  _globals['_REGISTERRESP_RESULT']._serialized_start=727
+  _globals['_REGISTERRESP_RESULT']._serialized_end=761
+  _globals['_DEREGISTERRESP']._serialized_start=764
+  _globals['_DEREGISTERRESP']._serialized_end=989
+  _globals['_DEREGISTERRESP_NEIGHBORNODES']._serialized_start=670
+  _globals['_DEREGISTERRESP_NEIGHBORNODES']._serialized_end=725
+  _globals['_DEREGISTERRESP_RESULT']._serialized_start=727
+  _globals['_DEREGISTERRESP_RESULT']._serialized_end=761
+  _globals['_LOCATEREQ']._serialized_start=992
+  _globals['_LOCATEREQ']._serialized_end=1163
+  _globals['_LOCATEREQ_TOPICINFO']._serialized_start=1093
+  _globals['_LOCATEREQ_TOPICINFO']._serialized_end=1163
+  _globals['_LOCATERESP']._serialized_start=1166
+  _globals['_LOCATERESP']._serialized_end=1325
+  _globals['_LOCATERESP_LOCATIONINFO']._serialized_start=1271
+  _globals['_LOCATERESP_LOCATIONINFO']._serialized_end=1325
+  _globals['_UPDATEREQ']._serialized_start=1327
+  _globals['_UPDATEREQ']._serialized_end=1408
+  _globals['_ISREADYREQ']._serialized_start=1410
+  _globals['_ISREADYREQ']._serialized_end=1422
+  _globals['_ISREADYRESP']._serialized_start=1424
+  _globals['_ISREADYRESP']._serialized_end=1452
+  _globals['_LOOKUPPUBBYTOPICREQ']._serialized_start=1454
+  _globals['_LOOKUPPUBBYTOPICREQ']._serialized_end=1536
+  _globals['_LOOKUPPUBBYTOPICRESP']._serialized_start=1538
+  _globals['_LOOKUPPUBBYTOPICRESP']._serialized_end=1617
+  _globals['_LOOKUPALLPUBSREQ']._serialized_start=1619
+  _globals['_LOOKUPALLPUBSREQ']._serialized_end=1695
+  _globals['_LOOKUPALLPUBSRESP']._serialized_start=1697
+  _globals['_LOOKUPALLPUBSRESP']._serialized_end=1773
+  _globals['_DISCOVERYREQ']._serialized_start=1776
+  _globals['_DISCOVERYREQ']._serialized_end=2184
+  _globals['_DISCOVERYRESP']._serialized_start=2187
+  _globals['_DISCOVERYRESP']._serialized_end=2476
 # @@protoc_insertion_point(module_scope)
@@ -0,0 +1,147 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Heartbeats and phi accrual failure detection
+# Semester: Spring 2023
+###############################################
+#
+# Zookeeper only tells us that a node died once its session has expired,
+# which takes seconds. When the [Heartbeat] section of the config file is
+# enabled, publishers and lead brokers send a heartbeat every Interval
+# seconds on their PUB socket: a single frame "__hb:<addr>:<port>" that no
+# subscription of a topic ever matches. The lead discovery node subscribes
+# to the heartbeats of every publisher and broker it has registered.
+#
+# Instead of a fixed timeout, every source gets a phi accrual detector
+# (Hayashibara et al.): it keeps the last Window intervals between the
+# heartbeats of the source and turns the time since its last heartbeat into
+#   phi = -log10(P(a heartbeat comes even later than that))
+# under a normal distribution of the intervals (with at least MinStd of
+# deviation). A source is suspected once phi goes over Threshold, so the
+# detector adapts to the jitter of every source on its own. With the
+# defaults (10 ms heartbeats) a dead source is suspected after about 40 ms.
+# A suspected source that sends a heartbeat again is no longer suspected.
+# Zookeeper stays the authority on membership: suspicion only takes a
+# source out of the lookups and the pairings until it is heard from again.
+#
+# import statements
+import math, time
+from collections import deque
+
+# prefix of every heartbeat message
+HEARTBEAT = b"__hb:"
+
+"""read the [Heartbeat] section of the config file"""
+def heartbeat_settings(config):
+  settings = {"enabled": False, "interval": 0.01, "threshold": 8.0, "min_std": 0.005, "window": 100}
+  if config.has_section("Heartbeat"):
+    section = config["Heartbeat"]
+    settings["enabled"] = section.getboolean("Enabled", False)
+    settings["interval"] = float(section.get("Interval", "0.01"))
+    settings["threshold"] = float(section.get("Threshold", "8"))
+    settings["min_std"] = float(section.get("MinStd", "0.005"))
+    settings["window"] = int(section.get("Window", "100"))
+  return settings
+
+"""Heartbeat class"""
+class Heartbeat():
+
+  """constructor (source is the addr:port we are known by)"""
+  def __init__(self, config, source):
+    settings = heartbeat_settings(config)
+    self.enabled = settings["enabled"]    # whether we send heartbeats at all
+    self.interval = settings["interval"]  # seconds between two heartbeats
+    self.frame = HEARTBEAT + source.encode() # the heartbeat message itself
+    self.next = 0                         # when the next heartbeat is due
+
+  """seconds until the next heartbeat is due (None if we do not send any)"""
+  def left(self):
+    if not self.enabled: return None
+    return max(0.0, self.next - time.time())
+
+  """milliseconds until the next heartbeat is due, as a poll timeout (None if we do not send any)"""
+  def timeout(self):
+    left = self.left()
+    return None if left is None else int(left * 1000) + 1
+
+  """send a heartbeat on the socket if one is due"""
+  def beat(self, sock):
+    if not self.enabled: return
+    now = time.time()
+    if now < self.next: return
+    sock.send(self.frame)
+    self.next = now + self.interval
+
+"""PhiAccrual class"""
+class PhiAccrual():
+  __slots__ = ("intervals", "last", "min_std")
+
+  """constructor (the first interval is a guess until real ones come in)"""
+  def __init__(self, window, min_std, first_interval, now):
+    self.intervals = deque([first_interval], maxlen=window) # the last intervals between heartbeats
+    self.last = now                       # when we last heard from the source
+    self.min_std = min_std                # lower bound of the deviation of the intervals
+
+  """record a heartbeat of the source"""
+  def heartbeat(self, now):
+    self.intervals.append(now - self.last)
+    self.last = now
+
+  """return the suspicion level of the source at the given time"""
+  def phi(self, now):
+    mean = sum(self.intervals) / len(self.intervals)
+    variance = sum((i - mean) ** 2 for i in self.intervals) / len(self.intervals)
+    y = (now - self.last - mean) / max(math.sqrt(variance), self.min_std)
+    if y < -10: return 0.0  # we heard from it just now
+    # logistic approximation of the normal distribution
+    e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+    if y > 0: return -math.log10(e / (1 + e)) if e > 0 else math.inf
+    return -math.log10(1 - 1 / (1 + e))
+
+"""FailureDetector class"""
+class FailureDetector():
+
+  """constructor"""
+  def __init__(self, config):
+    settings = heartbeat_settings(config)
+    self.enabled = settings["enabled"]      # whether we detect failures at all
+    self.interval = settings["interval"]    # seconds between two heartbeats of a source
+    self.threshold = settings["threshold"]  # phi above which a source is suspected
+    self.min_std = settings["min_std"]      # lower bound of the deviation of the intervals
+    self.window = settings["window"]        # intervals kept per source
+    self.sources = {}     # source -> PhiAccrual (None until its first heartbeat)
+    self.suspected = set() # sources we currently suspect
+
+  """milliseconds between two checks of our sources, as a poll timeout (None if we do not detect)"""
+  def timeout(self):
+    return int(self.interval * 1000) if self.enabled else None
+
+  """start watching the source (it is only judged once its first heartbeat came in)"""
+  def watch(self, source):
+    if source not in self.sources: self.sources[source] = None
+
+  """stop watching the source"""
+  def forget(self, source):
+    self.sources.pop(source, None)
+    self.suspected.discard(source)
+
+  """record a heartbeat of a watched source (returns True if it was suspected until now)"""
+  def heartbeat(self, source, now):
+    if source not in self.sources: return False
+    detector = self.sources[source]
+    if detector is None:
+      self.sources[source] = PhiAccrual(self.window, self.min_std, self.interval, now)
+    elif source in self.suspected:
+      # the outage tells nothing about the usual intervals of the source
+      detector.last = now
+      self.suspected.discard(source)
+      return True
+    else: detector.heartbeat(now)
+    return False
+
+  """return the sources that are suspected from now on"""
+  def check(self, now):
+    suspected = [source for source, detector in self.sources.items() if detector is not None
+                 and source not in self.suspected and detector.phi(now) > self.threshold]
+    self.suspected.update(suspected)
+    return suspected
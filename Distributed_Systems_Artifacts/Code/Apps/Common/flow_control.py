@@ -0,0 +1,106 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Flow control and drop accounting for the PUB/SUB paths
+# Semester: Spring 2023
+###############################################
+#
+# ZMQ PUB sockets silently discard messages once the queue of a slow
+# subscriber reaches its high-water mark. This file lets every role set its
+# high-water marks from the [FlowControl] section of the config file and
+# keeps count of the messages that were lost along the way:
+# (1) drops: messages we could not send ourselves (credit mode only, since
+#     a plain PUB socket never tells us about a drop)
+# (2) gaps: messages that never reached us, found from the per publisher
+#     and per topic sequence numbers carried in the message header
+#
+# In credit mode the topics listed in CreditTopics must not be dropped. The
+# high-water mark of our sending socket then acts as the credit window:
+# the socket is told to refuse (instead of drop) messages once a peer queue
+# is full, and a publication on a credit topic waits up to CreditTimeout ms
+# for a credit to free up. Publications on other topics never wait and are
+# counted as drops instead.
+#
+# import statements
+import time, zmq
+
+"""FlowControl class"""
+class FlowControl():
+
+  """constructor"""
+  def __init__(self, logger, config, role):
+    self.logger = logger      # internal logger for print statements
+    self.role = role          # Publisher, Broker or Subscriber (config key prefix)
+    self.mode = "none"        # none or credit
+    self.credit_topics = []   # topics that must not be dropped in credit mode
+    self.credit_timeout = 0   # ms a credit topic waits for room in the queue
+    self.report_interval = 0  # seconds between two drop reports (0 = never)
+    self.last_report = 0      # when we last reported our counters
+    self.settings = {}        # the [FlowControl] config section
+    self.drops = {}           # topic -> messages we dropped on send
+    self.gaps = {}            # publisher -> messages lost before they reached us
+    self.last_seqs = {}       # (publisher, topic) -> last sequence number seen
+    self.metrics = None       # metrics of our middleware (if it keeps any)
+    if config.has_section("FlowControl"):
+      self.settings = config["FlowControl"]
+      self.mode = self.settings.get("Mode", "none").lower()
+      self.credit_topics = [t.strip() for t in self.settings.get("CreditTopics", "").split(",") if t.strip()]
+      self.credit_timeout = int(self.settings.get("CreditTimeout", "1000"))
+      self.report_interval = int(self.settings.get("ReportInterval", "10"))
+    self.last_report = time.time()
+
+  """apply our configured high-water marks to a sending socket"""
+  def configure_sender(self, sock):
+    hwm = int(self.settings.get(f"{self.role}SndHwm", "1000"))
+    sock.setsockopt(zmq.SNDHWM, hwm)
+    if self.mode == "credit":
+      # refuse instead of drop so that we find out when the queue is full
+      sock.setsockopt(zmq.XPUB_NODROP, 1)
+      sock.setsockopt(zmq.SNDTIMEO, self.credit_timeout)
+    self.logger.debug(f"FlowControl::configure_sender - {self.role} SNDHWM: {hwm}, mode: {self.mode}")
+
+  """apply our configured high-water marks to a receiving socket"""
+  def configure_receiver(self, sock):
+    hwm = int(self.settings.get(f"{self.role}RcvHwm", "1000"))
+    sock.setsockopt(zmq.RCVHWM, hwm)
+    self.logger.debug(f"FlowControl::configure_receiver - {self.role} RCVHWM: {hwm}")
+
+  """send the frames of a message, counting it if it has to be dropped"""
+  def send(self, sock, frames, topic=None):
+    if topic is None: topic = frames[0].split(b":", 1)[0].decode()
+    try:
+      if self.mode == "credit" and topic in self.credit_topics:
+        # wait (up to the socket send timeout) for a credit to free up
+        sock.send_multipart(frames)
+      else: sock.send_multipart(frames, flags=zmq.DONTWAIT)
+      if self.metrics:
+        self.metrics.inc("messages_out_total", topic=topic)
+        self.metrics.inc("bytes_out_total", sum(len(frame) for frame in frames))
+      return True
+    except zmq.Again:
+      self.drops[topic] = self.drops.get(topic, 0) + 1
+      if self.metrics: self.metrics.inc("messages_dropped_total", topic=topic)
+      return False
+
+  """check the sequence number of a received message for lost messages"""
+  def observe(self, pub, topic, seq):
+    last = self.last_seqs.get((pub, topic))
+    if last is None or seq > last:
+      self.last_seqs[(pub, topic)] = seq
+      if last is not None and seq > last + 1:
+        self.gaps[pub] = self.gaps.get(pub, 0) + seq - last - 1
+        if self.metrics: self.metrics.inc("messages_lost_total", seq - last - 1, publisher=pub)
+        return seq - last - 1
+    return 0
+
+  """log our drop counters if it is time to do so"""
+  def maybe_report(self):
+    if self.report_interval and time.time() - self.last_report >= self.report_interval:
+      self.report()
+
+  """log our drop counters"""
+  def report(self):
+    self.last_report = time.time()
+    if self.drops or self.gaps:
+      self.logger.info(f"{self.role} drops - sent: {sum(self.drops.values())} {self.drops}, " +
+                       f"lost upstream: {sum(self.gaps.values())} {self.gaps}")
@@ -0,0 +1,48 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Client side cache of discovery lookups
+# Semester: Spring 2023
+###############################################
+#
+# Subscribers and brokers ask discovery who they should connect to every
+# time the membership in zookeeper changes. Most of those changes do not
+# affect the answer they already have, so we keep the last answer per topic
+# set together with the registry epoch it was valid for. Discovery bumps the
+# epoch (the version of the /discovery/epoch znode) whenever its registry
+# changes, and clients watch that znode. As long as our cached epoch is the
+# newest one announced we do not need to ask discovery at all. Otherwise we
+# send the cached epoch along with the lookup and discovery only sends the
+# full list back if something has changed since then.
+
+"""LookupCache class"""
+class LookupCache():
+
+  """constructor"""
+  def __init__(self):
+    self.entries = {}       # topic set -> (epoch, publishers) of the last answer
+    self.latest_epoch = 0   # newest registry epoch announced through zookeeper
+
+  """build the cache key for the given topic list (None means all pubs)"""
+  def key(self, topiclist):
+    if topiclist is None: return None
+    return frozenset(topiclist)
+
+  """return the cached (epoch, publishers) for the topic list"""
+  def get(self, topiclist):
+    return self.entries.get(self.key(topiclist), (0, None))
+
+  """record the epoch that discovery has announced through zookeeper"""
+  def observe(self, epoch):
+    if epoch > self.latest_epoch: self.latest_epoch = epoch
+
+  """tells if the cached answer for the topic list is known to be current"""
+  def is_fresh(self, topiclist):
+    epoch, publishers = self.get(topiclist)
+    return publishers is not None and epoch >= self.latest_epoch
+
+  """store the answer (or the revalidated cached answer) for the topic list"""
+  def store(self, topiclist, epoch, publishers):
+    self.entries[self.key(topiclist)] = (epoch, list(publishers))
+    self.observe(epoch)
+    return self.entries[self.key(topiclist)][1]
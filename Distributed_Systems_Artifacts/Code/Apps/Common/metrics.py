@@ -0,0 +1,167 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Runtime metrics shared by all middleware roles
+# Semester: Spring 2023
+###############################################
+#
+# Every middleware object keeps a Metrics object that holds its counters,
+# gauges and histograms. When the application is started with a metrics
+# port, the metrics are served over HTTP at http://<addr>:<port>/metrics in
+# the Prometheus text format so that the hot paths can be watched under
+# load without parsing the logs.
+#
+# The histograms are HDR style: the buckets grow by powers of two and every
+# power of two is split into a fixed number of linear sub buckets. That
+# keeps the relative error of every recorded value the same from micro
+# seconds up to minutes while recording a value stays a couple of math ops.
+#
+# Every role also records startup_seconds: the time from the start of its
+# process until it was registered (or serving), Testing/bench_startup.py
+# tracks it. http.server is only imported once the metrics are served since
+# importing it takes about as long as the rest of a role put together.
+#
+# import statements
+import os, math, time, threading
+
+# when this module was imported (our process start where /proc is not there)
+IMPORTED = time.time()
+
+# prefix of every metric name we export
+PREFIX = "cs6381"
+
+"""return the seconds since our process started (since this module was imported without /proc)"""
+def process_uptime():
+  try:
+    # the start time of a process (in clock ticks since boot) is the 22nd field of its stat
+    with open("/proc/self/stat") as f: ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+    with open("/proc/uptime") as f: uptime = float(f.read().split()[0])
+    return uptime - ticks / os.sysconf("SC_CLK_TCK")
+  except (OSError, ValueError, IndexError): return time.time() - IMPORTED
+
+"""Histogram class"""
+class Histogram():
+
+  # the smallest and largest power of two we keep buckets for (~1us to ~128s)
+  MIN_EXP = -20
+  MAX_EXP = 7
+  # the number of linear sub buckets in every power of two
+  SUB_BUCKETS = 4
+
+  """constructor"""
+  def __init__(self):
+    self.bounds = []    # upper bound of every bucket (in increasing order)
+    for exp in range(self.MIN_EXP, self.MAX_EXP):
+      for sub in range(1, self.SUB_BUCKETS + 1):
+        self.bounds.append(2.0 ** exp * (1 + sub / self.SUB_BUCKETS))
+    self.counts = [0] * (len(self.bounds) + 1)  # the last bucket is +Inf
+    self.count = 0      # number of values recorded
+    self.sum = 0.0      # sum of the values recorded
+
+  """find the bucket of the given value"""
+  def bucket(self, value):
+    if value <= self.bounds[0]: return 0
+    mantissa, exp = math.frexp(value) # value = mantissa * 2^exp with 0.5 <= mantissa < 1
+    exp -= 1; mantissa *= 2           # so that value = mantissa * 2^exp with 1 <= mantissa < 2
+    if exp >= self.MAX_EXP: return len(self.bounds)
+    sub = math.ceil((mantissa - 1) * self.SUB_BUCKETS)
+    if sub == 0: return (exp - self.MIN_EXP) * self.SUB_BUCKETS - 1
+    return (exp - self.MIN_EXP) * self.SUB_BUCKETS + sub - 1
+
+  """record a value"""
+  def record(self, value):
+    self.counts[self.bucket(value)] += 1
+    self.count += 1
+    self.sum += value
+
+  """return the upper bound of the bucket that holds the given quantile"""
+  def quantile(self, q):
+    if self.count == 0: return 0.0
+    seen = 0
+    for i, count in enumerate(self.counts):
+      seen += count
+      if seen >= q * self.count: return self.bounds[i] if i < len(self.bounds) else math.inf
+    return math.inf
+
+"""Metrics class"""
+class Metrics():
+
+  """constructor"""
+  def __init__(self, role, name):
+    self.role = role          # the role of the entity we are part of
+    self.name = name          # the name of the entity we are part of
+    self.lock = threading.Lock() # watch callbacks update us from kazoo threads
+    self.counters = {}        # metric name -> {labels: value}
+    self.gauges = {}          # metric name -> {labels: value}
+    self.histograms = {}      # metric name -> {labels: Histogram}
+    self.server = None        # our HTTP server (if we serve our metrics)
+
+  """increment a counter"""
+  def inc(self, metric, value=1, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      series = self.counters.setdefault(metric, {})
+      series[key] = series.get(key, 0) + value
+
+  """set a gauge"""
+  def set(self, metric, value, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock: self.gauges.setdefault(metric, {})[key] = value
+
+  """record a value (e.g. a latency in seconds) in a histogram"""
+  def observe(self, metric, value, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      series = self.histograms.setdefault(metric, {})
+      if key not in series: series[key] = Histogram()
+      series[key].record(value)
+
+  """format the labels of a sample in the prometheus text format"""
+  def labels(self, key, extra=None):
+    pairs = [("role", self.role), ("name", self.name)] + list(key)
+    if extra: pairs.append(extra)
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+  """render all of our metrics in the prometheus text format"""
+  def render(self):
+    lines = []
+    with self.lock:
+      for metric, series in sorted(self.counters.items()):
+        lines.append(f"# TYPE {PREFIX}_{metric} counter")
+        for key, value in series.items(): lines.append(f"{PREFIX}_{metric}{self.labels(key)} {value}")
+      for metric, series in sorted(self.gauges.items()):
+        lines.append(f"# TYPE {PREFIX}_{metric} gauge")
+        for key, value in series.items(): lines.append(f"{PREFIX}_{metric}{self.labels(key)} {value}")
+      for metric, series in sorted(self.histograms.items()):
+        lines.append(f"# TYPE {PREFIX}_{metric} histogram")
+        for key, hist in series.items():
+          cumulative = 0
+          for bound, count in zip(hist.bounds + ["+Inf"], hist.counts):
+            cumulative += count
+            le = bound if bound == "+Inf" else f"{bound:.9g}"
+            lines.append(f"{PREFIX}_{metric}_bucket{self.labels(key, ('le', le))} {cumulative}")
+          lines.append(f"{PREFIX}_{metric}_sum{self.labels(key)} {hist.sum}")
+          lines.append(f"{PREFIX}_{metric}_count{self.labels(key)} {hist.count}")
+    return "\n".join(lines) + "\n"
+
+  """record (and return) the seconds from the start of our process until now, once we are registered"""
+  def startup(self):
+    seconds = process_uptime()
+    self.set("startup_seconds", seconds)
+    return seconds
+
+  """serve our metrics over HTTP on the given address and port"""
+  def serve(self, addr, port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    metrics = self
+    class MetricsHandler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+      def log_message(self, format, *args): pass # keep the scrapes out of our logs
+    self.server = ThreadingHTTPServer((addr, int(port)), MetricsHandler)
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
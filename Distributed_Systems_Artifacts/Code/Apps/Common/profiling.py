@@ -0,0 +1,120 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Profiling of a running publisher, subscriber, broker or discovery node
+# Semester: Spring 2023
+###############################################
+#
+# Every application takes --profile to profile it from the start, and any
+# of them starts (or stops) profiling when it gets SIGUSR1, so a live
+# cluster can be profiled without editing or restarting anything:
+#   kill -USR1 <pid>   # start
+#   kill -USR1 <pid>   # stop, the profile is written out
+# Two profilers can be chosen with --profile (SIGUSR1 alone uses sample):
+# (1) sample: a thread takes the stacks of every other thread every
+#     SAMPLE_INTERVAL seconds and counts them as collapsed stacks (one
+#     "thread;outer;...;inner count" line per stack, what flamegraph.pl and
+#     speedscope read). Cheap enough for a loaded broker, and it sees every
+#     thread, but it samples wall clock time: threads waiting in a poll
+#     show up as well
+# (2) cprofile: the deterministic profiler of the standard library, exact
+#     call counts and times in pstats format, but only of the main thread
+#     and at a cost on every call
+# Profiles are written to --profile_dir as <role>-<name>-<pid>-<n>.collapsed
+# (or .pstats) whenever profiling stops, also at exit and on SIGTERM.
+# Testing/merge_profiles.py merges the profiles of every role after a run.
+#
+# import statements
+import os, sys, signal, atexit, cProfile, threading
+
+# seconds between two samples of the stacks
+SAMPLE_INTERVAL = 0.005
+
+"""return the label of a frame in a collapsed stack"""
+def frame_label(frame):
+  code = frame.f_code
+  return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+"""Profiler class"""
+class Profiler():
+
+  """constructor"""
+  def __init__(self, logger, role, name, mode, directory):
+    self.logger = logger        # internal logger for print statements
+    self.prefix = os.path.join(directory, f"{role}-{name}-{os.getpid()}")  # path of our profiles, without n
+    self.mode = mode or "sample" # sample or cprofile
+    self.directory = directory  # where our profiles go
+    self.running = False        # whether we profile right now
+    self.dumps = 0              # profiles written so far
+    self.profile = None         # the cProfile.Profile (cprofile)
+    self.stacks = {}            # collapsed stack -> samples (sample)
+    self.stopping = None        # set to stop the sampling thread (sample)
+    self.sampler = None         # the sampling thread (sample)
+
+  """start profiling"""
+  def start(self):
+    if self.running: return
+    self.running = True
+    if self.mode == "cprofile":
+      self.profile = cProfile.Profile()
+      self.profile.enable()
+    else:
+      self.stacks = {}
+      self.stopping = threading.Event()
+      self.sampler = threading.Thread(target=self.sample, daemon=True)
+      self.sampler.start()
+    self.logger.info(f"Profiling started ({self.mode})")
+
+  """stop profiling and write the profile out"""
+  def stop(self):
+    if not self.running: return
+    self.running = False
+    os.makedirs(self.directory, exist_ok=True)
+    self.dumps += 1
+    if self.mode == "cprofile":
+      self.profile.disable()
+      path = f"{self.prefix}-{self.dumps}.pstats"
+      self.profile.dump_stats(path)
+    else:
+      self.stopping.set()
+      self.sampler.join()
+      path = f"{self.prefix}-{self.dumps}.collapsed"
+      with open(path, "w") as f:
+        for stack, count in self.stacks.items(): f.write(f"{stack} {count}\n")
+    self.logger.info(f"Profiling stopped, profile written to {path}")
+
+  """start or stop profiling (our SIGUSR1 handler)"""
+  def toggle(self, signum=None, frame=None):
+    if self.running: self.stop()
+    else: self.start()
+
+  """write the profile out before going away on SIGTERM (which then ends us as usual)"""
+  def terminate(self, signum, frame):
+    self.stop()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+  """take the stacks of every other thread until stopped (the sampling thread)"""
+  def sample(self):
+    own = threading.get_ident()
+    while not self.stopping.wait(SAMPLE_INTERVAL):
+      names = {thread.ident: thread.name for thread in threading.enumerate()}
+      for ident, frame in sys._current_frames().items():
+        if ident == own: continue
+        labels = []
+        while frame is not None:
+          labels.append(frame_label(frame))
+          frame = frame.f_back
+        stack = ";".join([names.get(ident, str(ident))] + labels[::-1])
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+"""set up the profiling of our process (from the start with --profile, on SIGUSR1 either way)"""
+def install_profiler(logger, role, args, name=None):
+  profiler = Profiler(logger, role, name or args.name, args.profile, args.profile_dir)
+  # signal handlers can only be set from the main thread
+  if threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGUSR1, profiler.toggle)
+    signal.signal(signal.SIGTERM, profiler.terminate)
+  atexit.register(profiler.stop)
+  if args.profile: profiler.start()
+  return profiler
@@ -12,7 +12,7 @@
 #
 # since we are going to publish or subscribe to a random sampling of topics,
 # we need this package
-import random
+import random, json
 
 # define a helper class to hold all the topics that we support in our system
 class TopicSelector():
@@ -25,18 +25,60 @@ class TopicSelector():
   topiclist = ["weather", "humidity", "airquality", "light", "pressure", \
                "temperature", "sound", "altitude", "location"]
 
+  # with the Sites of the [Topics] config section every topic above exists
+  # once per site as a hierarchical topic: sensors/<site>/<topic>
+  #
+  # with a workload spec (see Testing/gen_workload.py) the topics, the interest
+  # of every named client, the publication rates and the payloads all come
+  # from the spec instead, so that benchmark runs can be reproduced
+  def __init__(self, config=None, workload=None):
+    self.workload = None  # the loaded workload spec (if any)
+    self.cursors = {}     # topic -> index of the next precomputed payload
+    if config is not None and config.has_section("Topics"):
+      sites = [s.strip() for s in config["Topics"].get("Sites", "").split(",") if s.strip()]
+      if sites: self.topiclist = [f"sensors/{site}/{topic}" for site in sites for topic in TopicSelector.topiclist]
+    if workload:
+      with open(workload) as f: self.workload = json.load(f)
+      self.topiclist = list(self.workload["topics"].keys())
+
   # return a random subset of topics from this list, which becomes our interest
   # A publisher or subscriber application logic will invoke this method to get their
   # interest. 
-  def interest(self):
+  def interest(self, name=None):
+    if self.workload: return self.workload_interest(name)
     DEBUG = False
     # if debugging and need repeatable output, use this
     if DEBUG: return [self.topiclist[0]]
     # here we just randomly create a subset from this list and return it
     else: return random.sample(self.topiclist, random.randint(1, len(self.topiclist)))
 
+  # the interest of the named client in the workload spec. Clients the spec does
+  # not name draw their topics by popularity from a generator seeded by their name
+  def workload_interest(self, name):
+    for role in ("publishers", "subscribers"):
+      if name in self.workload[role]: return list(self.workload[role][name])
+    rng = random.Random(f"{self.workload['seed']}:{name}")
+    topics = self.workload["topics"]
+    # weighted sampling without replacement (the largest u^(1/w) keys win)
+    keys = sorted(topics, key=lambda t: rng.random() ** (1 / topics[t]["weight"]), reverse=True)
+    return keys[:self.workload.get("interest", 3)]
+
+  # seconds between two publications on the topic (the default without a workload)
+  def interval(self, topic, default):
+    if not self.workload or topic not in self.workload["topics"]: return default
+    rate = self.workload["topics"][topic]["rate"]
+    return 1 / rate if rate > 0 else default
+
   # generate a publication on a given topic
   def gen_publication(self, topic):
+    # with a workload the precomputed payloads of the topic are cycled through
+    if self.workload and topic in self.workload["topics"]:
+      payloads = self.workload["topics"][topic]["payloads"]
+      cursor = self.cursors.get(topic, 0)
+      self.cursors[topic] = (cursor + 1) % len(payloads)
+      return payloads[cursor]
+    # the values of a hierarchical topic depend on its last level
+    topic = topic.split("/")[-1]
     if(topic == "weather"):
       return random.choice(["sunny", "cloudy", "rainy", "foggy", "icy"])
     elif(topic == "humidity"):
@@ -0,0 +1,142 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Hierarchical topics, wildcards and the topic trie
+# Semester: Spring 2023
+###############################################
+#
+# Topics can be hierarchical ("sensors/roof/temperature") and subscriptions
+# can use MQTT style wildcards at any level:
+#   +  matches exactly one level     ("sensors/+/temperature")
+#   #  matches any number of levels  ("sensors/roof/#"), must come last
+#
+# A TopicTrie stores one node per topic level, so matching never looks at
+# topics that do not share the levels being matched. It is used both ways:
+# (1) match(topic): the trie holds patterns (the broker's subscriptions) and
+#     we want the patterns that a published topic matches
+# (2) search(pattern): the trie holds topics (the publishers known to
+#     discovery) and we want the topics that a subscription pattern matches
+#
+# ZMQ subscriptions only match by prefix, so a subscriber subscribes to an
+# exact topic as "topic:" (so "light" does not also get "lightning") and to
+# a pattern through its key ("*sensors/+/temperature:"). The broker sends a
+# message once more as [key, message frames...] for every pattern it matches.
+
+# marks a subscription (and the first frame of a message) as a pattern key
+KEY_PREFIX = "*"
+# ends every subscription so that none is a (ZMQ) prefix of another
+KEY_SUFFIX = ":"
+SEPARATOR = "/"
+SINGLE = "+"
+MULTI = "#"
+
+"""tells if the topic contains wildcards"""
+def is_pattern(topic):
+  return any(level in (SINGLE, MULTI) for level in topic.split(SEPARATOR))
+
+"""return the subscription key of the pattern"""
+def pattern_key(pattern):
+  return KEY_PREFIX + pattern + KEY_SUFFIX
+
+"""tells if the subscription (or first frame) is a pattern key"""
+def is_pattern_key(data):
+  if isinstance(data, (bytes, bytearray, memoryview)): return bytes(data[:1]) == KEY_PREFIX.encode()
+  return data.startswith(KEY_PREFIX)
+
+"""return the pattern of a pattern key"""
+def key_pattern(key):
+  return key[len(KEY_PREFIX):-len(KEY_SUFFIX)]
+
+"""return the ZMQ subscription for the topic or pattern (when nobody matches patterns for us)"""
+def subscription(topic):
+  if not is_pattern(topic): return topic + KEY_SUFFIX
+  # subscribe to everything under the levels before the first wildcard
+  prefix = []
+  for level in topic.split(SEPARATOR):
+    if level in (SINGLE, MULTI): break
+    prefix.append(level)
+  return SEPARATOR.join(prefix + [""]) if prefix else ""
+
+"""tells if the topic matches the pattern"""
+def topic_matches(pattern, topic):
+  levels = topic.split(SEPARATOR)
+  for i, level in enumerate(pattern.split(SEPARATOR)):
+    if level == MULTI: return True
+    if i >= len(levels) or (level != SINGLE and level != levels[i]): return False
+  return len(levels) == len(pattern.split(SEPARATOR))
+
+"""TrieNode class"""
+class TrieNode():
+  __slots__ = ("children", "values")
+
+  """constructor"""
+  def __init__(self):
+    self.children = {}  # level -> TrieNode
+    self.values = set() # values stored at the topic (or pattern) ending here
+
+"""TopicTrie class"""
+class TopicTrie():
+
+  """constructor"""
+  def __init__(self):
+    self.root = TrieNode()  # the node of the empty topic
+
+  """store the value under the topic (or pattern)"""
+  def insert(self, topic, value):
+    node = self.root
+    for level in topic.split(SEPARATOR):
+      node = node.children.setdefault(level, TrieNode())
+    node.values.add(value)
+
+  """remove the value from the topic (or pattern), pruning nodes that become empty"""
+  def remove(self, topic, value):
+    path = [self.root]
+    for level in topic.split(SEPARATOR):
+      node = path[-1].children.get(level)
+      if node is None: return
+      path.append(node)
+    path[-1].values.discard(value)
+    levels = topic.split(SEPARATOR)
+    for i in range(len(levels), 0, -1):
+      if path[i].values or path[i].children: break
+      del path[i - 1].children[levels[i - 1]]
+
+  """return the values of every stored pattern that the topic matches"""
+  def match(self, topic):
+    found = set()
+    nodes = [self.root]
+    for level in topic.split(SEPARATOR):
+      next_nodes = []
+      for node in nodes:
+        if MULTI in node.children: found |= node.children[MULTI].values
+        if level in node.children: next_nodes.append(node.children[level])
+        if SINGLE in node.children: next_nodes.append(node.children[SINGLE])
+      nodes = next_nodes
+      if not nodes: return found
+    for node in nodes:
+      found |= node.values
+      # "a/#" also matches "a" itself
+      if MULTI in node.children: found |= node.children[MULTI].values
+    return found
+
+  """return the values of every stored topic that the pattern matches"""
+  def search(self, pattern):
+    found = set()
+    nodes = [self.root]
+    for level in pattern.split(SEPARATOR):
+      if level == MULTI:
+        for node in nodes: self.collect(node, found)
+        return found
+      if level == SINGLE: nodes = [child for node in nodes for child in node.children.values()]
+      else: nodes = [node.children[level] for node in nodes if level in node.children]
+      if not nodes: return found
+    for node in nodes: found |= node.values
+    return found
+
+  """add the values of the node and of everything under it"""
+  def collect(self, node, found):
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      found |= node.values
+      stack.extend(node.children.values())
@@ -0,0 +1,134 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Sampled tracing of publications from publisher to subscriber
+# Semester: Spring 2023
+###############################################
+#
+# The latency metrics tell that a message was slow, not which hop made it
+# slow. When the [Tracing] section of the config file is enabled, publishers
+# trace a SampleRate share of their publications: the message gets one more
+# frame (always the last one) holding a trace id and a timestamp per hop
+#   __tr:<trace id>|<pub>:send=<ts>|<broker>:in=<ts>|<broker>:out=<ts>
+# Every broker on the way appends its in and out timestamps to the bytes of
+# that frame, so the other frames (header and compressed body) are passed on
+# untouched and untraced messages cost nothing. A broker keeps no trace in
+# its topic log or last value cache, so replays and snapshots are untraced.
+# The subscriber adds its receive timestamp and pushes the finished trace
+# (as JSON) to the Collector endpoint, without ever blocking on it: traces
+# are dropped when no collector keeps up. Testing/trace_collector.py binds
+# that endpoint and reports the per-hop latencies of the slowest paths.
+#
+# The hops are timed by different hosts, so the per-hop latencies are only
+# as good as the clocks of the hosts are synchronized (one clock in mininet).
+#
+# import statements
+import os, time, random
+import zmq
+
+# prefix of the trace frame of a publication
+TRACE = b"__tr:"
+
+"""read the [Tracing] section of the config file"""
+def tracing_settings(config):
+  settings = {"enabled": False, "sample_rate": 0.01, "collector": "tcp://127.0.0.1:5580"}
+  if config.has_section("Tracing"):
+    section = config["Tracing"]
+    settings["enabled"] = section.getboolean("Enabled", False)
+    settings["sample_rate"] = float(section.get("SampleRate", "0.01"))
+    settings["collector"] = section.get("Collector", settings["collector"])
+  return settings
+
+"""append the timestamp of a hop to a trace frame (without looking into the rest of it)"""
+def stamp(frame, hop, event, ts=None):
+  return frame + f"|{hop}:{event}={time.time() if ts is None else ts:.6f}".encode()
+
+"""take the trace frame off the frames of a message (returns None if it has none)"""
+def pop_trace(frames):
+  if len(frames) > 1 and frames[-1].startswith(TRACE): return frames.pop()
+  return None
+
+"""return the trace id and the (hop, event, ts) stamps of a trace frame"""
+def parse_trace(frame):
+  trace_id, *stamps = frame[len(TRACE):].decode().split("|")
+  hops = []
+  for entry in stamps:
+    name, ts = entry.rsplit("=", 1)
+    hop, event = name.rsplit(":", 1)
+    hops.append((hop, event, float(ts)))
+  return trace_id, hops
+
+"""Tracer class"""
+class Tracer():
+
+  """constructor (name is the hop we stamp as)"""
+  def __init__(self, config, name):
+    settings = tracing_settings(config)
+    self.enabled = settings["enabled"]          # whether we trace at all
+    self.sample_rate = settings["sample_rate"]  # share of the publications we trace
+    self.collector = settings["collector"]      # endpoint of the trace collector
+    self.name = name                            # the hop we stamp as
+    self.push = None                            # PUSH socket to the collector (once we need one)
+
+  """return the trace frame of a new publication of the given publisher (None if it is not sampled)"""
+  def start(self, pub):
+    if not self.enabled or random.random() >= self.sample_rate: return None
+    return stamp(TRACE + os.urandom(8).hex().encode(), pub, "send")
+
+  """stamp our receive time on a trace frame and push the trace to the collector"""
+  def finish(self, frame, topic):
+    if not self.enabled or frame is None: return
+    trace_id, hops = parse_trace(stamp(frame, self.name, "recv"))
+    if self.push is None:
+      self.push = zmq.Context.instance().socket(zmq.PUSH)
+      self.push.setsockopt(zmq.SNDHWM, 1000)
+      self.push.setsockopt(zmq.LINGER, 0)
+      self.push.connect(self.collector)
+    try: self.push.send_json({"trace": trace_id, "topic": topic, "hops": hops}, flags=zmq.DONTWAIT)
+    except zmq.Again: pass  # no collector (or a slow one), the trace is not worth waiting for
+
+"""return the hops a trace went through, in order (pub -> brokers -> sub)"""
+def trace_path(hops):
+  path = []
+  for hop, _, _ in hops:
+    if not path or path[-1] != hop: path.append(hop)
+  return tuple(path)
+
+"""return the latency (seconds) of every segment of a trace: between two consecutive stamps"""
+def breakdown(hops):
+  return [(f"{a[0]}:{a[1]} -> {b[0]}:{b[1]}", b[2] - a[2]) for a, b in zip(hops, hops[1:])]
+
+"""TraceCollector class"""
+class TraceCollector():
+
+  """constructor"""
+  def __init__(self, keep=10000):
+    self.traces = []      # the last traces received: (total seconds, trace)
+    self.keep = keep      # traces we keep at most
+    self.paths = {}       # path -> segment -> list of seconds
+
+  """add a finished trace (as pushed by a subscriber)"""
+  def add(self, trace):
+    hops = [tuple(hop) for hop in trace["hops"]]
+    if len(hops) < 2: return
+    trace["hops"] = hops
+    segments = self.paths.setdefault(trace_path(hops), {})
+    for segment, seconds in breakdown(hops): segments.setdefault(segment, []).append(seconds)
+    self.traces.append((hops[-1][2] - hops[0][2], trace))
+    if len(self.traces) > 2 * self.keep: self.traces = self.traces[-self.keep:]
+
+  """return the n slowest traces (end to end) as (seconds, trace)"""
+  def slowest(self, n):
+    return sorted(self.traces, key=lambda entry: entry[0], reverse=True)[:n]
+
+  """return every path with its trace count and the mean and p99 seconds of each of its segments"""
+  def summary(self):
+    result = []
+    for path, segments in self.paths.items():
+      stats = []
+      for segment, samples in segments.items():
+        ordered = sorted(samples)
+        stats.append((segment, sum(ordered) / len(ordered), ordered[int(0.99 * (len(ordered) - 1))]))
+      result.append((path, len(next(iter(segments.values()))), stats))
+    # the paths that are slowest end to end (by the mean) come first
+    return sorted(result, key=lambda entry: sum(mean for _, mean, _ in entry[2]), reverse=True)
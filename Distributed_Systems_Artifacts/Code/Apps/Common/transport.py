@@ -0,0 +1,53 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Python file for transport/endpoint functions
+# Semester: Spring 2023
+###############################################
+#
+# Every PUB socket is always bound on TCP so that peers on other hosts can
+# reach it. Depending on the [Transport] section of the config file it is
+# also bound on a local transport (ipc or inproc). All the endpoints we are
+# bound on, along with our host id and pid, are sent to discovery when we
+# register. Discovery then hands out the best endpoint for the peer that is
+# asking: inproc if it lives in the same process, ipc if it lives on the same
+# host, and tcp otherwise.
+#
+# import statements
+import os, json, socket
+
+"""return the id used to tell if two entities are on the same host"""
+def host_id(config):
+  if config.has_option("Transport", "HostId"): return config["Transport"]["HostId"]
+  return socket.gethostname()
+
+"""bind the socket on tcp and on the configured local transport"""
+def bind_endpoints(logger, sock, config, name, addr, port):
+  endpoints = [f"tcp://{addr}:{port}"]
+  local = "none"
+  if config.has_section("Transport"): local = config["Transport"].get("Local", "none")
+  if local == "ipc":
+    ipc_dir = config["Transport"].get("IpcDir", "/tmp/cs6381")
+    os.makedirs(ipc_dir, exist_ok=True)
+    endpoints.append(f"ipc://{ipc_dir}/{name}-{port}.ipc")
+  elif local == "inproc": endpoints.append(f"inproc://{name}-{port}")
+  for endpoint in endpoints:
+    logger.debug(f"Transport::bind_endpoints - bound to: {endpoint}")
+    sock.bind(endpoint)
+  return endpoints
+
+"""pick the best endpoint of the given registered id for the given requester"""
+def best_endpoint(id, host=None, pid=None):
+  tcp = f"tcp://{id.ip}:{id.port}"
+  if not host or id.host != host: return tcp
+  for endpoint in id.endpoints:
+    # inproc only works inside of the process that bound it
+    if endpoint.startswith("inproc://") and pid and id.pid == pid: return endpoint
+  for endpoint in id.endpoints:
+    if endpoint.startswith("ipc://"): return endpoint
+  return tcp
+
+"""return the endpoint to connect to for the given formatted publisher"""
+def endpoint_of(pub):
+  p = json.loads(pub) if isinstance(pub, str) else pub
+  return p.get("endpoint", f"tcp://{p['ip']}:{p['port']}")
@@ -29,6 +29,7 @@
 import sys, os, argparse, logging
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, dump
+from Apps.Common.profiling import install_profiler
 from Apps.Discovery.middleware import DiscoveryMW
 
 """DiscoveryAppln class"""
@@ -62,13 +63,15 @@ class DiscoveryAppln():
       self.mw_obj = DiscoveryMW(self.logger)
       self.is_lead = self.mw_obj.configure(args)
       self.logger.info("Discovery app configured.")
-      dump(self.logger, "DiscoveryAppln", self.name, self.addr, self.port)
+      dump(self.logger, "DiscoveryAppln", self.addr, self.port, name=self.name,
+           numpubs=args.numpubs, numsubs=args.numsubs)
     except Exception as e: handle_exception(e)
 
   """driver program"""
   def driver(self):
     try:
       self.logger.debug("DiscoveryAppln::driver")
+      self.logger.info(f"Joined zookeeper {self.mw_obj.metrics.startup():.3f}s after our process started.")
       # Ask our middleware to listen for publishers and subscribers
       if self.is_lead: 
         self.logger.info("Listening for registration requests...")
@@ -96,10 +99,30 @@ def parseCmdLineArgs():
     "-n", "--name", default="disc", 
     help="The name of this discovery service node. default=localhost:5555"
   )
+  parser.add_argument(
+    "-P", "--numpubs", type=int, default=0, 
+    help="Number of publishers that have to register before we are ready, default=0 (no barrier)"
+  )
+  parser.add_argument(
+    "-S", "--numsubs", type=int, default=0, 
+    help="Number of subscribers that have to register before we are ready, default=0 (no barrier)"
+  )
   parser.add_argument(
     "-c", "--config", default="Apps/Common/config.ini", 
     help="configuration file (default: Apps/Common/config.ini)"
   )
+  parser.add_argument(
+    "-mp", "--metrics_port", type=int, default=0, 
+    help="Port on which our metrics are served over HTTP, default=0 (not served)"
+  )
+  parser.add_argument(
+    "-pf", "--profile", default="", choices=["", "sample", "cprofile"], 
+    help="Profile us from the start with this profiler, default='' (only on SIGUSR1, with sample)"
+  )
+  parser.add_argument(
+    "-pd", "--profile_dir", default="Logs/profiles", 
+    help="Directory our profiles are written to, default=Logs/profiles"
+  )
   parser.add_argument(
     "-l", "--loglevel", type=int, default=logging.INFO, 
     choices=[
@@ -123,6 +146,8 @@ def main():
     logger.debug("Main: resetting log level to {}".format(args.loglevel))
     logger.setLevel(args.loglevel)
     logger.debug("Main: effective log level is {}".format(logger.getEffectiveLevel()))
+    # profile us from the start (with --profile) or whenever we get SIGUSR1
+    install_profiler(logger, "discovery", args)
     # Obtain a discovery application
     logger.debug("Main: obtain the object")
     disc_app = DiscoveryAppln(logger) # get the object
@@ -6,14 +6,21 @@
 ###############################################
 #
 # Import statements
-import zmq, json, sys, os, time, random, configparser
+import zmq, json, sys, os, time, configparser
 sys.path.append(os.getcwd())
 from Apps.Common.common import \
-  handle_exception, format_pubs, send_message
+  handle_exception, format_pubs, send_message, zk_hosts
 from Apps.Common import discovery_pb2
+from Apps.Common.metrics import Metrics
+from Apps.Common.topic_trie import TopicTrie
+from Apps.Discovery.pairing import PairingTable
+from Apps.Discovery.registry_store import RegistryStore
+from Apps.Common.coordination import ensure_paths, claim, swap
+from Apps.Common.failure_detector import FailureDetector, HEARTBEAT
 from kazoo.client import KazooClient
 from kazoo.recipe.watchers import DataWatch
 from kazoo.recipe.watchers import ChildrenWatch
+from kazoo.exceptions import NoNodeError
 
 """Discovery Middleware class"""
 class DiscoveryMW():
@@ -28,11 +35,24 @@ class DiscoveryMW():
         self.port = None          # port num where we listen for pubs/subs
         self.name = None          # the name of this discovery node
         self.pubs = None          # the array of publishers that are registering
-        self.paired_pubs = None   # the array of publisher that are paired to brokers
         self.subs = None          # the array of subscribers that are registering
         self.brokers = None       # the brokers to use if we are using that approach
         self.ready_sent = 0       # number of ready replys sent (will match pubs/subs)
+        self.epoch = 0            # registry epoch (version of the /discovery/epoch znode)
+        self.leading = False      # whether we are the lead discovery node (cached, see is_leader)
         self.zkc = None           # kazoo client instance used to interact with zookeeper
+        self.metrics = None       # our runtime counters and histograms
+        self.topics = None        # trie of the topics (-> publisher names) we know publishers of
+        self.pairing = None       # which lead brokers relay which publishers
+        self.live_brokers = []    # addr:port of every lead broker (from its leader znode)
+        self.expected_pubs = 0    # publishers that have to register before we are ready
+        self.expected_subs = 0    # subscribers that have to register before we are ready
+        self.ready = False        # whether everyone expected has registered (see check_ready)
+        self.detector = None      # phi accrual detector on the heartbeats of pubs and brokers
+        self.heartbeats = None    # will be a ZMQ SUB socket for the heartbeats (if enabled)
+        self.watched = set()      # addr:port of every source our heartbeat socket is connected to
+        self.watched_epoch = None # registry epoch the watched sources were last updated at
+        self.store = None         # our registry on local disk (if kept there)
 
     """configure/initialize"""
     def configure(self, args):
@@ -46,8 +66,13 @@ class DiscoveryMW():
             self.port = args.port
             self.addr = args.addr
             self.name = args.name
+            self.expected_pubs = args.numpubs
+            self.expected_subs = args.numsubs
             self.brokers = []
-            self.paired_pubs = []
+            self.topics = TopicTrie()
+            self.metrics = Metrics("discovery", self.name)
+            self.store = RegistryStore(self.logger, config)
+            if args.metrics_port: self.metrics.serve(self.addr, args.metrics_port)
             # now set up ZMQ
             context = zmq.Context()  # Next get the ZMQ context (singleton object)
             self.poller = zmq.Poller()  # get the ZMQ poller object
@@ -57,9 +82,16 @@ class DiscoveryMW():
             bind_string = f"tcp://{self.addr}:{self.port}"
             self.logger.debug(f"DiscoveryMW::configure - bound to: {bind_string}")
             self.rep.bind(bind_string)  # bind to the REP socket
+            # set up the SUB socket for the heartbeats of our publishers and brokers
+            self.detector = FailureDetector(config)
+            if self.detector.enabled:
+                self.heartbeats = context.socket(zmq.SUB)
+                self.heartbeats.subscribe(HEARTBEAT)
+                self.poller.register(self.heartbeats, zmq.POLLIN)
             # Now setup the zookeeper kazoo client
-            self.zkc = KazooClient(hosts='10.0.0.1:2181')
+            self.zkc = KazooClient(hosts=zk_hosts(config))
             self.zkc.start()
+            self.pairing = PairingTable(self.logger, self.zkc, config)
             return self.join_zookeeper()
         except Exception as e: handle_exception(e)
 
@@ -67,9 +99,11 @@ class DiscoveryMW():
     def join_zookeeper(self):
         try:
             self.logger.debug("DiscoveryMW::join_zookeeper")
-            self.zkc.ensure_path('/discovery')
-            if not self.zkc.exists('/discovery/leader'):
-                self.zkc.create('/discovery/leader', f'{self.addr}:{self.port}'.encode(), ephemeral=True)
+            ensure_paths(self.zkc, '/discovery', '/discovery/epoch')
+            if claim(self.zkc, '/discovery/leader', f'{self.addr}:{self.port}'.encode()):
+                # a ready barrier left behind by a previous run must not start this one
+                try: self.zkc.delete('/discovery/ready')
+                except NoNodeError: pass
                 return True
             else:
                 self.zkc.create(f'/discovery/backup-{self.addr}:{self.port}', b'discovery-backup', ephemeral=True)
@@ -88,13 +122,19 @@ class DiscoveryMW():
     def leader_left(self, data, stat):
         try:
             self.logger.debug("DiscoveryMW::leader_left")
+            self.metrics.inc("zk_events_total", watch="discovery_leader")
             if data == None and stat == None:
                 self.logger.info("The lead discovery node has left.")
-                time.sleep(random.uniform(0, 1)) # random wait so there is no leader overlap
-                if not self.zkc.exists('/discovery/leader'):
-                    self.logger.info("Setting self as the new lead node.")
-                    self.zkc.delete(f'/discovery/backup-{self.addr}:{self.port}')
-                    self.zkc.create('/discovery/leader', f'{self.addr}:{self.port}'.encode(), ephemeral=True)
+                # of the backups racing for the lead exactly one commits this transaction
+                if swap(self.zkc, f'/discovery/backup-{self.addr}:{self.port}',
+                        '/discovery/leader', f'{self.addr}:{self.port}'.encode()):
+                    self.logger.info("Set self as the new lead node.")
+                    self.leading = True
+                    self.pairing.load() # keep the pairings the old lead made
+                    self.restore()
+                    self.ready = self.zkc.exists('/discovery/ready') is not None
+                    self.rebalance()
+                    self.bump_epoch() # our registry is not the one clients have cached
                     self.logger.info("Listening for registration requests...")
                 else: self.logger.info("Another node has been elected the new lead.")
         except Exception as e: handle_exception(e)
@@ -104,34 +144,159 @@ class DiscoveryMW():
         try:
             self.logger.debug("DiscoveryMW::listen")
             self.pubs = pubs; self.subs = subs
+            self.leading = self.is_leader()
+            if self.leading:
+                self.pairing.load()
+                self.restore()
+            self.bump_epoch()
             self.listen_for_broker_failures()
             self.listen_for_pub_sub_failures()
             
             while True:
-                # poll for events. We give it an infinite timeout.
-                # The return value is a socket to event mask mapping
-                events = dict(self.poller.poll())
+                # poll for events. We give it an infinite timeout (unless we check heartbeats
+                # or have registry changes to fsync). The return value is a socket to event mask mapping
+                timeouts = [t for t in (self.detector.timeout(), self.store.timeout()) if t is not None]
+                events = dict(self.poller.poll(min(timeouts) if timeouts else None))
                 if self.rep in events: self.handle_message()
+                # only the leader watches heartbeats (and acts on suspicions), a backup starts once it takes over
+                if self.detector.enabled and self.leading: self.check_heartbeats(events)
+                self.sync_registry()
         except Exception as e: handle_exception(e)
 
-    """Watches the lead broker nodes to handle if any die"""
+    """Reloads the registry we kept on disk, keeping what zookeeper still has alive"""
+    def restore(self):
+        try:
+            if not self.store.enabled: return
+            start = time.time()
+            registrations = self.store.load()
+            role = discovery_pb2.RegisterReq().Role
+            ensure_paths(self.zkc, '/discovery/pubs', '/discovery/subs', '/broker/leaders')
+            alive = {role.PUBLISHER: {tuple(c.split(':')[:3]) for c in self.zkc.get_children('/discovery/pubs')},
+                     role.SUBSCRIBER: {tuple(c.split(':')[:3]) for c in self.zkc.get_children('/discovery/subs')}}
+            brokers = set(self.lead_brokers(self.zkc.get_children('/broker/leaders')))
+            registry = {role.PUBLISHER: self.pubs, role.SUBSCRIBER: self.subs, role.BROKER: self.brokers}
+            kept = 0
+            for reg in registrations:
+                id = reg.id
+                if reg.role == role.BROKER: live = f"{id.ip}:{id.port}" in brokers
+                else: live = (id.name, id.ip, str(id.port)) in alive.get(reg.role, ())
+                # anyone that registered with us in the meantime is more recent than our disk
+                if not live or any(r.id.name == id.name for r in registry[reg.role]): continue
+                registry[reg.role].append(reg)
+                if reg.role == role.PUBLISHER: self.index_pub(reg)
+                kept += 1
+            # what we kept is our registry from now on
+            self.store.snapshot(self.pubs + self.subs + self.brokers)
+            self.metrics.set("registry_restored", kept)
+            self.logger.info(f"Restored {kept} of {len(registrations)} registrations from disk " +
+                             f"in {(time.time() - start) * 1000:.1f} ms.")
+        except Exception as e: handle_exception(e)
+
+    """Fsyncs the registry changes on disk (batched) and snapshots the registry once they add up"""
+    def sync_registry(self):
+        try:
+            if self.store.due(): self.store.snapshot(self.pubs + self.subs + self.brokers)
+            else: self.store.flush()
+        except Exception as e: handle_exception(e)
+
+    """Takes in heartbeats and routes around the sources we suspect (or no longer suspect)"""
+    def check_heartbeats(self, events):
+        try:
+            self.watch_heartbeats()
+            now = time.time(); changed = False
+            if self.heartbeats in events:
+                while self.heartbeats.poll(0):
+                    source = self.heartbeats.recv_multipart()[0][len(HEARTBEAT):].decode()
+                    if self.detector.heartbeat(source, now):
+                        self.logger.info(f"Heard from suspected {source} again.")
+                        changed = True
+            for source in self.detector.check(now):
+                self.logger.info(f"No heartbeat from {source}. Suspecting it has failed.")
+                self.metrics.inc("suspicions_total")
+                changed = True
+            # zookeeper has the last word, until then lookups and pairings leave out the suspects
+            if changed:
+                self.rebalance()
+                self.bump_epoch()
+        except Exception as e: handle_exception(e)
+
+    """Connects to the heartbeats of every registered publisher and broker (and drops the ones gone)"""
+    def watch_heartbeats(self):
+        try:
+            if self.watched_epoch == self.epoch: return
+            self.watched_epoch = self.epoch
+            sources = {f"{reg.id.ip}:{reg.id.port}" for reg in self.pubs + self.brokers}
+            for source in sources - self.watched:
+                self.heartbeats.connect(f"tcp://{source}")
+                self.detector.watch(source)
+            for source in self.watched - sources:
+                self.heartbeats.disconnect(f"tcp://{source}")
+                self.detector.forget(source)
+            self.watched = sources
+        except Exception as e: handle_exception(e)
+
+    """Tells if we suspect the registered entity of having failed"""
+    def is_suspected(self, id):
+        return f"{id.ip}:{id.port}" in self.detector.suspected
+
+    """Watches every lead broker node (lead-0 ... lead-N) to handle if any die or join"""
     def listen_for_broker_failures(self):
         try:
             self.logger.debug("DiscoveryMW::listen_for_broker_failures")
-            DataWatch(self.zkc, '/broker/leaders/lead-0', self.handle_broker_change)
+            self.zkc.ensure_path('/broker/leaders')
+            ChildrenWatch(self.zkc, '/broker/leaders', self.handle_broker_change)
         except Exception as e: handle_exception(e)
 
-    """Handles event when a lead broker node dies or leaves"""
-    def handle_broker_change(self, data, stat):
+    """Handles event when a lead broker node dies, leaves or joins"""
+    def handle_broker_change(self, children):
         try:
-            self.logger.debug("DiscoveryMW::handle_broker_change")
-            # only continue if a lead has died
-            if data == None and stat == None:
-                self.logger.info("A lead broker node has failed.")
-                if len(self.paired_pubs) > 0: 
-                    self.pubs.append(self.paired_pubs.pop(0))
+            self.logger.debug(f"DiscoveryMW::handle_broker_change - children: {children}")
+            self.metrics.inc("zk_events_total", watch="broker_leaders")
+            live = self.lead_brokers(children)
+            gone = set(self.live_brokers) - set(live)
+            if gone: self.logger.info(f"Lead broker(s) failed: {', '.join(sorted(gone))}")
+            self.live_brokers = live
+            # subscribers should not be sent to brokers that are gone
+            for broker in [b for b in self.brokers if f"{b.id.ip}:{b.id.port}" not in live]:
+                self.store.removed(broker)
+            self.brokers = [b for b in self.brokers if f"{b.id.ip}:{b.id.port}" in live]
+            if self.rebalance() or gone: self.bump_epoch()
+            self.check_ready()
+        except Exception as e: handle_exception(e)
+
+    """Returns the addr:port of the lead brokers (from the data of their znodes)"""
+    def lead_brokers(self, children):
+        try:
+            live = []
+            for child in children:
+                try: live.append(self.zkc.get(f'/broker/leaders/{child}')[0].decode())
+                except NoNodeError: pass # it left while we were looking
+            return live
+        except Exception as e: handle_exception(e)
+
+    """Rebalances the broker/publisher pairings (returns True if they changed)"""
+    def rebalance(self):
+        try:
+            # only the lead discovery node owns the pairing table
+            if not self.is_leader(): return False
+            known = {pub.id.name: list(pub.topiclist) for pub in self.pubs}
+            # live publishers that have not (re)registered with us yet keep their pairings
+            pubs = {}
+            for child in self.zkc.get_children('/discovery/pubs'):
+                name, ip, port = child.split(':')[:3]
+                if f"{ip}:{port}" in self.detector.suspected: continue
+                pubs[name] = known.get(name, self.pairing.topics_of(name))
+            brokers = [broker for broker in self.live_brokers if broker not in self.detector.suspected]
+            return self.pairing.rebalance(brokers, pubs)
         except Exception as e: handle_exception(e)
 
+    """Tells if we are the lead discovery node"""
+    def is_leader(self):
+        try:
+            data, _ = self.zkc.get('/discovery/leader')
+            return data.decode() == f'{self.addr}:{self.port}'
+        except NoNodeError: return False
+
     """listen to zookeeper for alerts about publishers/subscribers dying"""
     def listen_for_pub_sub_failures(self):
         try:
@@ -146,26 +311,28 @@ class DiscoveryMW():
     def handle_pubs_change(self, children):
         try:
             self.logger.debug(f"DiscoveryMW::handle_pubs_change - children: {children}")
+            self.metrics.inc("zk_events_total", watch="pubs")
             if (len(children) < len(self.pubs)): 
                 self.logger.info("Publisher failed. Removing from list.")
-                pub_index = 0
-                for pub1 in self.pubs:
-                    remove = True
-                    for pub2 in children:
-                        pub_id = pub2.split(':')
-                        if pub1.id.name == pub_id[0] and pub1.id.ip == pub_id[1] and \
-                            pub1.id.port == pub_id[2]: remove = False
-                    if remove: self.pubs.pop(pub_index)
-                    pub_index += 1
+                alive = [tuple(child.split(':')[:3]) for child in children]
+                for pub in [p for p in self.pubs if (p.id.name, p.id.ip, str(p.id.port)) not in alive]:
+                    self.index_pub(pub, False)
+                    self.pubs.remove(pub)
+                    self.store.removed(pub)
+                self.rebalance()
+                self.bump_epoch()
             if (len(children) == 0): 
                 self.logger.info("No publishers present.")
-                self.pubs = []
+                self.pubs.clear()
+                self.topics = TopicTrie()
+                self.rebalance()
         except Exception as e: handle_exception(e)
 
     """Handles the event where there are changes to the subs in zookeeper"""
     def handle_subs_change(self, children):
         try:
             self.logger.debug(f"DiscoveryMW::handle_subs_change - children: {children}")
+            self.metrics.inc("zk_events_total", watch="subs")
             if (len(children) < len(self.subs)): 
                 self.logger.info("Subscriber failed. Removing from list.")
                 sub_index = 0
@@ -175,10 +342,11 @@ class DiscoveryMW():
                         sub_id = sub2.split(':')
                         if sub1.id.name == sub_id[0] and sub1.id.ip == sub_id[1] and \
                             sub1.id.port == sub_id[2]: remove = False
-                    if remove: self.subs.pop(sub_index)
+                    if remove: self.store.removed(self.subs.pop(sub_index))
                     sub_index += 1
             if (len(children) == 0): 
                 self.logger.info("No Subscribers present.")
+                for sub in self.subs: self.store.removed(sub)
                 self.subs = []
         except Exception as e: handle_exception(e)
 
@@ -188,55 +356,171 @@ class DiscoveryMW():
             self.logger.debug("DiscoveryMW::handle_message")
             # let us first receive all the bytes
             bytesRcvd = self.rep.recv()
+            start = time.time()
             # now use protobuf to deserialize the bytes
             disc_req = discovery_pb2.DiscoveryReq()
             disc_req.ParseFromString(bytesRcvd)
             # Depending on the message type, the contents of the msg will differ
             if (disc_req.msg_type == discovery_pb2.REGISTER): self.handle_register(disc_req.register_req)
             elif (disc_req.msg_type == discovery_pb2.DEREGISTER): self.handle_deregister(disc_req.deregister_req)
-            elif (disc_req.msg_type == discovery_pb2.LOOKUP_ALL_PUBS): self.handle_pub_lookup(return_all_pubs=True)
-            elif (disc_req.msg_type == discovery_pb2.LOOKUP_PUB_BY_TOPIC): self.handle_pub_lookup(return_all_pubs=False)
+            elif (disc_req.msg_type == discovery_pb2.REGISTER_BATCH): 
+                self.handle_register_batch(disc_req.register_batch)
+            elif (disc_req.msg_type == discovery_pb2.DEREGISTER_BATCH): 
+                self.handle_deregister_batch(disc_req.deregister_batch)
+            elif (disc_req.msg_type == discovery_pb2.LOOKUP_ALL_PUBS): 
+                self.handle_pub_lookup(True, disc_req.pubs_req)
+            elif (disc_req.msg_type == discovery_pb2.LOOKUP_PUB_BY_TOPIC): 
+                self.handle_pub_lookup(False, disc_req.topics)
+            elif (disc_req.msg_type == discovery_pb2.ISREADY): self.handle_is_ready()
             else: raise Exception("Unrecognized response message")
+            self.record_request(disc_req.msg_type, time.time() - start)
+        except Exception as e: handle_exception(e)
+
+    """record the handled request and the size of our registry in our metrics"""
+    def record_request(self, msg_type, seconds):
+        try:
+            msg_type = discovery_pb2.MsgTypes.Name(msg_type).lower()
+            self.metrics.inc("requests_total", type=msg_type)
+            self.metrics.observe("request_seconds", seconds, type=msg_type)
+            self.metrics.set("registered", len(self.pubs), kind="publisher")
+            self.metrics.set("registered", len(self.subs), kind="subscriber")
+            self.metrics.set("registered", len(self.brokers), kind="broker")
+            self.metrics.set("registry_epoch", self.epoch)
         except Exception as e: handle_exception(e)
 
     """handle a registration with the discovery service"""
     def handle_register(self, register_req):
         try:
             self.logger.debug("DiscoveryMW::handle_register")
+            # subscribers do not show up in any lookup answer
+            if self.add_registration(register_req):
+                self.rebalance()
+                self.bump_epoch()
+            self.check_ready()
+            self.send_register_resp(discovery_pb2.REGISTER)
+            self.logger.info(f"Registration request handled successfully.")
+        except Exception as e: handle_exception(e)
+
+    """handle a batch of registrations from a multi-publisher process"""
+    def handle_register_batch(self, register_batch):
+        try:
+            self.logger.debug("DiscoveryMW::handle_register_batch")
+            self.logger.info(f"New batch of {len(register_batch.registrations)} registrations.")
+            changed = False
+            for register_req in register_batch.registrations:
+                if self.add_registration(register_req): changed = True
+            # the whole batch is announced to clients as a single registry change
+            if changed:
+                self.rebalance()
+                self.bump_epoch()
+            self.check_ready()
+            self.send_register_resp(discovery_pb2.REGISTER_BATCH)
+            self.logger.info(f"Registration batch handled successfully.")
+        except Exception as e: handle_exception(e)
+
+    """add the registration to our registry (returns True if lookups are affected)"""
+    def add_registration(self, register_req):
+        try:
             id = register_req.id; req_id = f"{id.name} - {id.ip}:{id.port}"
             self.logger.info(f"New registration request from: {req_id}")
 
+            # registering again replaces the earlier registration (say one restored from disk)
             if (register_req.role == discovery_pb2.RegisterReq().Role.PUBLISHER):
                 self.logger.debug("DiscoveryMW::handle_message - handle pub register")
+                for pub in self.pubs:
+                    if pub.id.name == register_req.id.name: self.index_pub(pub, False)
+                self.del_from_arr(register_req, self.pubs)
                 self.pubs.append(register_req)
+                self.index_pub(register_req)
             elif (register_req.role == discovery_pb2.RegisterReq().Role.SUBSCRIBER):
                 self.logger.debug("DiscoveryMW::handle_message - handle sub register")
+                self.del_from_arr(register_req, self.subs)
                 self.subs.append(register_req)
             elif (register_req.role == discovery_pb2.RegisterReq().Role.BROKER):
                 self.logger.debug("DiscoveryMW::handle_message - handle broker register")
+                self.del_from_arr(register_req, self.brokers)
                 self.brokers.append(register_req)
             else: raise Exception("Unrecognized result message")
+            self.store.added(register_req)
+            return register_req.role != discovery_pb2.RegisterReq().Role.SUBSCRIBER
+        except Exception as e: handle_exception(e)
 
+    """send a successful register response of the given message type"""
+    def send_register_resp(self, msg_type):
+        try:
             # build the response message
             disc_resp = discovery_pb2.DiscoveryResp()
             register_resp = discovery_pb2.RegisterResp()
             register_resp.result = register_resp.Result.SUCCESS
-            disc_resp.msg_type = discovery_pb2.REGISTER
+            disc_resp.msg_type = msg_type
             disc_resp.register_resp.CopyFrom(register_resp)
             # send the message
             send_message(self.logger, self.rep, disc_resp)
-            self.logger.info(f"Registration request handled successfully.")
         except Exception as e: handle_exception(e)
     
+    """Marks us ready (in the /discovery/ready znode) once everyone expected has registered"""
+    def check_ready(self):
+        try:
+            if self.ready or not self.is_leader(): return
+            if len(self.pubs) < self.expected_pubs or len(self.subs) < self.expected_subs: return
+            # publishing before a lead broker is up would only lose messages
+            if self.dissemination == "Broker" and not self.live_brokers: return
+            self.ready = True
+            # every publisher watches the znode, so they all hear about it at once
+            data = json.dumps({"pubs": len(self.pubs), "subs": len(self.subs), "ts": time.time()}).encode()
+            if self.zkc.exists('/discovery/ready'): self.zkc.set('/discovery/ready', data)
+            else: self.zkc.create('/discovery/ready', data)
+            self.logger.info(f"Ready: {len(self.pubs)} publishers and {len(self.subs)} subscribers registered.")
+        except Exception as e: handle_exception(e)
+
+    """handle an is ready request (the /discovery/ready znode tells the same without asking)"""
+    def handle_is_ready(self):
+        try:
+            self.logger.debug("DiscoveryMW::handle_is_ready")
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.msg_type = discovery_pb2.ISREADY
+            disc_resp.is_ready.reply = self.ready
+            if self.ready: self.ready_sent += 1
+            send_message(self.logger, self.rep, disc_resp)
+        except Exception as e: handle_exception(e)
+
     """handle a deregistration with the discovery service"""
     def handle_deregister(self, deregister_req):
         try:
             self.logger.debug("DiscoveryMW::handle_deregister")
+            # subscribers do not show up in any lookup answer
+            if self.remove_registration(deregister_req):
+                self.rebalance()
+                self.bump_epoch()
+            self.send_deregister_resp(discovery_pb2.DEREGISTER)
+            self.logger.info(f"Deregistration request handled successfully.")
+        except Exception as e: handle_exception(e)
+
+    """handle a batch of deregistrations from a multi-publisher process"""
+    def handle_deregister_batch(self, deregister_batch):
+        try:
+            self.logger.debug("DiscoveryMW::handle_deregister_batch")
+            self.logger.info(f"New batch of {len(deregister_batch.deregistrations)} deregistrations.")
+            changed = False
+            for deregister_req in deregister_batch.deregistrations:
+                if self.remove_registration(deregister_req): changed = True
+            if changed:
+                self.rebalance()
+                self.bump_epoch()
+            self.send_deregister_resp(discovery_pb2.DEREGISTER_BATCH)
+            self.logger.info(f"Deregistration batch handled successfully.")
+        except Exception as e: handle_exception(e)
+
+    """remove the registration from our registry (returns True if lookups are affected)"""
+    def remove_registration(self, deregister_req):
+        try:
             id = deregister_req.id; req_id = f"{id.name} - {id.ip}:{id.port}"
             self.logger.info(f"New deregistration request from: {req_id}")
 
             if (deregister_req.role == discovery_pb2.RegisterReq().Role.PUBLISHER):
                 self.logger.debug("DiscoveryMW::handle_message - handle pub deregister")
+                for pub in self.pubs:
+                    if pub.id.name == deregister_req.id.name: self.index_pub(pub, False)
                 self.del_from_arr(deregister_req, self.pubs)
             elif (deregister_req.role == discovery_pb2.RegisterReq().Role.SUBSCRIBER):
                 self.logger.debug("DiscoveryMW::handle_message - handle sub deregister")
@@ -245,40 +529,85 @@ class DiscoveryMW():
                 self.logger.debug("DiscoveryMW::handle_message - handle broker deregister")
                 self.del_from_arr(deregister_req, self.brokers)
             else: raise Exception("Unrecognized result message")
+            self.store.removed(deregister_req)
+            return deregister_req.role != discovery_pb2.RegisterReq().Role.SUBSCRIBER
+        except Exception as e: handle_exception(e)
 
+    """send a successful deregister response of the given message type"""
+    def send_deregister_resp(self, msg_type):
+        try:
             # build the response message
             disc_resp = discovery_pb2.DiscoveryResp()
             deregister_resp = discovery_pb2.DeregisterResp()
             deregister_resp.result = deregister_resp.Result.SUCCESS
-            disc_resp.msg_type = discovery_pb2.DEREGISTER
+            disc_resp.msg_type = msg_type
             disc_resp.deregister_resp.CopyFrom(deregister_resp)
             # send the message
             send_message(self.logger, self.rep, disc_resp)
-            self.logger.info(f"Deregistration request handled successfully.")
         except Exception as e: handle_exception(e)
 
     """responds with all of the requested pubs"""
-    def handle_pub_lookup(self, return_all_pubs):
+    def handle_pub_lookup(self, return_all_pubs, lookup_req):
         try:
             self.logger.debug("DiscoveryMW::handle_pub_lookup")
+            # the client already holds the current answer if it was cached at our epoch
+            epoch = lookup_req.epoch
+            not_modified = epoch != 0 and epoch == self.epoch
+            self.logger.debug(f"DiscoveryMW::handle_pub_lookup - epoch: {epoch}, not_modified: {not_modified}")
             # build the response message
             disc_resp = discovery_pb2.DiscoveryResp()
             if return_all_pubs:
-                # we should pair the broker to the pub and make sure no other broker gets paired to this pub
                 pubs_msg = discovery_pb2.LookupAllPubsResp()
-                pubs_msg.publishers.extend(format_pubs(self.pubs))
-                if len(self.pubs) > 0: self.paired_pubs.append(self.pubs.pop())
+                pubs_msg.epoch = self.epoch
+                pubs_msg.not_modified = not_modified
+                if not not_modified:
+                    # a broker only gets the publishers it is paired with
+                    paired = self.pairing.pubs_of(lookup_req.broker)
+                    pubs_msg.publishers.extend(format_pubs(
+                        [pub for pub in self.pubs if pub.id.name in paired], lookup_req.host, lookup_req.pid))
                 disc_resp.msg_type = discovery_pb2.LOOKUP_ALL_PUBS
                 disc_resp.pubs_resp.CopyFrom(pubs_msg)
             else:
                 matching_pubs_msg = discovery_pb2.LookupPubByTopicResp()
-                matching_pubs_msg.publishers.extend(format_pubs(self.brokers))
+                matching_pubs_msg.epoch = self.epoch
+                matching_pubs_msg.not_modified = not_modified
+                if not not_modified: matching_pubs_msg.publishers.extend(
+                    format_pubs(self.matching_pubs(lookup_req.topiclist), lookup_req.host, lookup_req.pid))
                 disc_resp.msg_type = discovery_pb2.LOOKUP_PUB_BY_TOPIC
                 disc_resp.resp.CopyFrom(matching_pubs_msg)
             # send the message
             send_message(self.logger, self.rep, disc_resp)
         except Exception as e: handle_exception(e)
 
+    """Returns the publishers (or the brokers) subscribers of the topics should connect to"""
+    def matching_pubs(self, topiclist):
+        try:
+            if self.dissemination != "Direct": return [b for b in self.brokers if not self.is_suspected(b.id)]
+            # topics may be patterns (sensors/+/temperature) so we match them through our trie
+            names = set()
+            for topic in topiclist: names |= self.topics.search(topic)
+            return [pub for pub in self.pubs if pub.id.name in names and not self.is_suspected(pub.id)]
+        except Exception as e: handle_exception(e)
+
+    """Adds (or removes) the topics of the publisher to (or from) our topic trie"""
+    def index_pub(self, pub, add=True):
+        try:
+            for topic in pub.topiclist:
+                if add: self.topics.insert(topic, pub.id.name)
+                else: self.topics.remove(topic, pub.id.name)
+        except Exception as e: handle_exception(e)
+
+    """Bumps the registry epoch so clients know their cached lookups are stale"""
+    def bump_epoch(self):
+        try:
+            self.logger.debug("DiscoveryMW::bump_epoch")
+            # only the leader moves the epoch, else the version runs past the one it answers lookups with
+            if not self.leading: return
+            # the znode version is kept by zookeeper so it keeps growing across leaders
+            stat = self.zkc.set('/discovery/epoch', f'{self.addr}:{self.port}'.encode())
+            self.epoch = stat.version
+        except Exception as e: handle_exception(e)
+
     """Removes the given object from the given array"""
     def del_from_arr(self, obj, arr):
         # Find the index of the object to remove
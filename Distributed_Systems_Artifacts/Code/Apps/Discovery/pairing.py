@@ -0,0 +1,101 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Broker to publisher pairing table of the discovery service
+# Semester: Spring 2023
+###############################################
+#
+# Every lead broker (lead-0 ... lead-N) relays the publishers it is paired
+# with. The pairing table maps every broker (by its "addr:port", the data of
+# its leader znode) to its publishers and their topics:
+#   {"replicas": 1, "brokers": {"10.0.0.3:5581": {"pub1": ["humidity", ...]}}}
+# It lives in the /discovery/pairing znode so that a discovery node taking
+# over the lead starts from the pairings already in place.
+#
+# Whenever brokers or publishers come or go the table is rebalanced with as
+# few moves as possible: pairings of live brokers with live publishers stay
+# where they are, only the publishers of a failed broker (and new ones) get
+# placed, and a broker that joins only takes over as many publishers as it
+# needs to even out the load. A single failure thus only moves the
+# publishers of the failed broker. With Replicas > 1 (the [Pairing] section
+# of the config file) every publisher is paired with that many brokers, so
+# subscribers can take its topics over redundant paths.
+#
+# import statements
+import json, math
+from kazoo.exceptions import NoNodeError
+
+PATH = '/discovery/pairing'
+
+"""return the new pairing of the publishers (name -> topics) with the brokers, moving as few as possible"""
+def assign(current, brokers, pubs, replicas):
+    # keep what is still valid (live broker, live publisher)
+    pairing = {broker: {name: pubs[name] for name in current.get(broker, {}) if name in pubs}
+               for broker in brokers}
+    if not brokers: return pairing, 0
+    copies = min(replicas, len(brokers))
+    moves = 0
+    # place every publisher that has fewer copies than it should on the least loaded brokers
+    for name in sorted(pubs):
+        holders = [b for b in brokers if name in pairing[b]]
+        for _ in range(copies - len(holders)):
+            target = min((b for b in brokers if name not in pairing[b]), key=lambda b: (len(pairing[b]), b))
+            pairing[target][name] = pubs[name]
+            moves += 1
+    # even out the load: move one publisher at a time from the most to the least loaded broker
+    ceiling = math.ceil(len(pubs) * copies / len(brokers))
+    floor = len(pubs) * copies // len(brokers)
+    while True:
+        most = max(brokers, key=lambda b: (len(pairing[b]), b))
+        least = min(brokers, key=lambda b: (len(pairing[b]), b))
+        if len(pairing[most]) <= ceiling and len(pairing[least]) >= floor: break
+        movable = [name for name in sorted(pairing[most]) if name not in pairing[least]]
+        if not movable or len(pairing[most]) - len(pairing[least]) < 2: break
+        pairing[least][movable[0]] = pairing[most].pop(movable[0])
+        moves += 1
+    return pairing, moves
+
+"""PairingTable class"""
+class PairingTable():
+
+    """constructor"""
+    def __init__(self, logger, zkc, config):
+        self.logger = logger    # internal logger for print statements
+        self.zkc = zkc          # our zookeeper client
+        self.replicas = 1       # number of brokers every publisher is paired with
+        self.brokers = {}       # broker "addr:port" -> publisher name -> topics
+        if config.has_section("Pairing"):
+            self.replicas = int(config["Pairing"].get("Replicas", "1"))
+
+    """load the table kept in zookeeper (by a previous lead discovery node)"""
+    def load(self):
+        try:
+            data, _ = self.zkc.get(PATH)
+            if data: self.brokers = json.loads(data).get("brokers", {})
+        except NoNodeError: self.brokers = {}
+        self.logger.info(f"Loaded pairings of {len(self.brokers)} brokers.")
+
+    """write the table to zookeeper"""
+    def save(self):
+        data = json.dumps({"replicas": self.replicas, "brokers": self.brokers}).encode()
+        if self.zkc.exists(PATH): self.zkc.set(PATH, data)
+        else: self.zkc.create(PATH, data, makepath=True)
+
+    """rebalance the table over the live brokers and publishers (returns True if it changed)"""
+    def rebalance(self, brokers, pubs):
+        pairing, moves = assign(self.brokers, sorted(brokers), pubs, self.replicas)
+        if pairing == self.brokers: return False
+        self.logger.info(f"Rebalanced pairings: {moves} moves over {len(pairing)} brokers.")
+        self.brokers = pairing
+        self.save()
+        return True
+
+    """return the topics the table holds for the publisher (empty if it is not paired)"""
+    def topics_of(self, name):
+        for pubs in self.brokers.values():
+            if name in pubs: return pubs[name]
+        return []
+
+    """return the names of the publishers paired with the broker"""
+    def pubs_of(self, broker):
+        return set(self.brokers.get(broker, {}))
@@ -0,0 +1,159 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Python file for the on disk copy of the discovery registry
+# Semester: Spring 2023
+###############################################
+#
+# The registry of the lead discovery node (its publishers, subscribers and
+# brokers) only lived in its memory, so once every discovery node had
+# restarted nothing was known until every client registered again. When the
+# [Registry] section of the config file is enabled the lead node keeps it
+# on local disk, under Dir:
+# (1) registry.log: every change is appended as a record
+#       op (u8) | length (u32) | crc32 (u32) | RegisterReq
+#     where op is ADD or REMOVE (whose RegisterReq only holds a role and
+#     an id, since DeregisterReq has no broker role). The appends go to the
+#     OS right away but are only fsynced every FsyncInterval seconds, so a
+#     burst of registrations costs one fsync and not one each
+# (2) registry.snapshot: every SnapshotEvery changes the whole registry is
+#     written as one RegisterBatchReq (crc32 | bytes) to a temporary file,
+#     fsynced and renamed over the old snapshot, and the log starts over
+# A node that becomes the leader loads the snapshot and replays the log on
+# top of it (a torn record at the end of the log is cut off). Both ops are
+# keyed by role and name, so replaying a log that a crash kept from being
+# cleared after its snapshot ends in the same registry. The lead node then
+# only keeps what zookeeper still has a live znode of (see
+# DiscoveryMW.restore); clients that registered after the last fsync are
+# the only ones that still have to register again.
+#
+# The discovery nodes of a host share Dir, so a backup taking over on the
+# same host (or in mininet, where all hosts share the disk) starts warm too.
+#
+# import statements
+import os, time, zlib, struct, threading
+from Apps.Common import discovery_pb2
+
+ADD = 1
+REMOVE = 2
+RECORD = struct.Struct("<BII")  # op, length of the message, crc32 of the message
+SNAPSHOT = struct.Struct("<I")  # crc32 of the snapshot
+
+"""RegistryStore class"""
+class RegistryStore():
+
+    """constructor"""
+    def __init__(self, logger, config):
+        self.logger = logger        # internal logger for print statements
+        self.enabled = False        # whether we keep the registry on disk at all
+        self.directory = "/tmp/cs6381/registry" # where the snapshot and the log go
+        self.fsync_interval = 0.05  # seconds an appended change may wait for its fsync
+        self.snapshot_every = 1000  # changes logged before the registry is snapshotted again
+        self.log = None             # the open log file (once we write)
+        self.changes = 0            # changes logged since the last snapshot
+        self.unsynced = None        # when the oldest change not yet fsynced was appended
+        self.lock = threading.Lock() # zookeeper watches change the registry from their own thread
+        if config.has_section("Registry"):
+            settings = config["Registry"]
+            self.enabled = settings.getboolean("Enabled", False)
+            self.directory = settings.get("Dir", self.directory)
+            self.fsync_interval = float(settings.get("FsyncInterval", "0.05"))
+            self.snapshot_every = int(settings.get("SnapshotEvery", "1000"))
+        self.log_path = os.path.join(self.directory, "registry.log")
+        self.snapshot_path = os.path.join(self.directory, "registry.snapshot")
+
+    """return the registrations of the snapshot with the log replayed on top of them"""
+    def load(self):
+        registry = {}   # (role, name) -> RegisterReq, in the order they registered
+        if not self.enabled: return []
+        try:
+            with open(self.snapshot_path, "rb") as f: data = f.read()
+            if len(data) >= SNAPSHOT.size and SNAPSHOT.unpack_from(data)[0] == zlib.crc32(data[SNAPSHOT.size:]):
+                snapshot = discovery_pb2.RegisterBatchReq()
+                snapshot.ParseFromString(data[SNAPSHOT.size:])
+                for reg in snapshot.registrations: registry[(reg.role, reg.id.name)] = reg
+            else: self.logger.info("RegistryStore::load - snapshot is corrupt, ignoring it")
+        except FileNotFoundError: pass
+        try:
+            with open(self.log_path, "rb") as f: data = f.read()
+        except FileNotFoundError: data = b""
+        position = 0
+        while position + RECORD.size <= len(data):
+            op, length, crc = RECORD.unpack_from(data, position)
+            body = data[position + RECORD.size:position + RECORD.size + length]
+            if len(body) < length or zlib.crc32(body) != crc: break
+            reg = discovery_pb2.RegisterReq()
+            reg.ParseFromString(body)
+            registry.pop((reg.role, reg.id.name), None)  # so a registration made again goes last
+            if op == ADD: registry[(reg.role, reg.id.name)] = reg
+            position += RECORD.size + length
+        if position < len(data):
+            self.logger.info(f"RegistryStore::load - cutting off a torn log record at {position}")
+            with open(self.log_path, "r+b") as f: f.truncate(position)
+        return list(registry.values())
+
+    """log a registration"""
+    def added(self, register_req):
+        if self.enabled: self.append(ADD, register_req.SerializeToString())
+
+    """log the removal of a registration (anything with the role and id of one)"""
+    def removed(self, reg):
+        if not self.enabled: return
+        removal = discovery_pb2.RegisterReq(role=reg.role)
+        removal.id.CopyFrom(reg.id)
+        self.append(REMOVE, removal.SerializeToString())
+
+    """append a record to the log (fsynced later, see flush)"""
+    def append(self, op, body):
+        with self.lock:
+            if self.log is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self.log = open(self.log_path, "ab")
+            self.log.write(RECORD.pack(op, len(body), zlib.crc32(body)) + body)
+            self.log.flush()
+            self.changes += 1
+            if self.unsynced is None: self.unsynced = time.time()
+
+    """tells if enough changes were logged for a new snapshot"""
+    def due(self):
+        return self.enabled and self.changes >= self.snapshot_every
+
+    """write the snapshot of the given registrations and start the log over"""
+    def snapshot(self, registrations):
+        if not self.enabled: return
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = discovery_pb2.RegisterBatchReq()
+        snapshot.registrations.extend(registrations)
+        data = snapshot.SerializeToString()
+        with self.lock:
+            with open(self.snapshot_path + ".tmp", "wb") as f:
+                f.write(SNAPSHOT.pack(zlib.crc32(data)) + data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+            # the old log is only cleared once the snapshot holding its changes is in place
+            if self.log is not None: self.log.close()
+            self.log = open(self.log_path, "wb")
+            os.fsync(self.log.fileno())
+            self.sync_directory()
+            self.changes = 0
+            self.unsynced = None
+
+    """fsync the log if its oldest unsynced change has waited long enough (or if forced)"""
+    def flush(self, force=False):
+        with self.lock:
+            if self.unsynced is None: return
+            if not force and time.time() - self.unsynced < self.fsync_interval: return
+            os.fsync(self.log.fileno())
+            self.unsynced = None
+
+    """milliseconds until the log has to be fsynced, as a poll timeout (None if nothing waits)"""
+    def timeout(self):
+        if self.unsynced is None: return None
+        return max(0, int((self.unsynced + self.fsync_interval - time.time()) * 1000)) + 1
+
+    """fsync our directory so the renamed snapshot and the new log survive a crash"""
+    def sync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
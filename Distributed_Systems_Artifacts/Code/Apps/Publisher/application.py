@@ -34,8 +34,9 @@
 import sys, os, time, argparse, configparser, logging, random
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, dump
+from Apps.Common.profiling import install_profiler
 from Apps.Common.topic_selector import TopicSelector
-from Apps.Publisher.middleware import PublisherMW
+from Apps.Publisher.middleware import PublisherMW, MultiPublisherMW
 
 """PublisherAppln class"""
 class PublisherAppln():
@@ -48,6 +49,8 @@ class PublisherAppln():
     self.port = None          # port num where we are going to publish our topics
     self.iters = None         # number of iterations of publication
     self.topiclist = None     # the different topics that we publish on
+    self.count = None         # number of logical publishers hosted by this process
+    self.publishers = None    # logical publisher name -> topic list (multi-publisher mode)
     self.lookup = None        # one of the diff ways we do lookup
     self.dissemination = None # direct or via broker
     self.mw_obj = None        # handle to the underlying Middleware object
@@ -61,20 +64,26 @@ class PublisherAppln():
       self.iters = args.iters
       self.port = args.port
       self.addr = args.addr
+      self.count = args.count
       # Get the configuration object
       config = configparser.ConfigParser()
       config.read(args.config)
       self.lookup = config["Discovery"]["Strategy"]
       self.dissemination = config["Dissemination"]["Strategy"]
       # Get our topic list of interest
-      ts = TopicSelector()
-      self.topiclist = ts.interest()
+      ts = TopicSelector(config, args.workload)
+      if self.count > 1:
+        # every logical publisher gets its own name and topic list
+        self.publishers = {f"{self.name}-{i}": ts.interest(f"{self.name}-{i}") for i in range(self.count)}
+        self.mw_obj = MultiPublisherMW(self.logger)
+      else:
+        self.topiclist = ts.interest(self.name)
+        self.mw_obj = PublisherMW(self.logger)
       # Setup up our underlying middleware object
-      self.mw_obj = PublisherMW(self.logger)
       self.mw_obj.configure(args) # pass remainder of args to middleware
       self.logger.info("Publisher app configured.")
-      dump(self.logger, "PublisherAppln", self.addr, self.port, 
-           name=self.name, topiclist=self.topiclist, iters=self.iters)
+      dump(self.logger, "PublisherAppln", self.addr, self.port, name=self.name, 
+           topiclist=self.topiclist, iters=self.iters, count=self.count if self.publishers else None)
     except Exception as e: handle_exception(e)
 
   """driver program"""
@@ -83,13 +92,19 @@ class PublisherAppln():
       self.logger.debug("PublisherAppln::driver")
       # Use middleware to register us with zookeeper and discovery
       self.logger.info("Registering app with zookeeper and discovery.")
-      self.mw_obj.register(self.topiclist)
+      if self.publishers: self.mw_obj.register(self.publishers)
+      else: self.mw_obj.register(self.topiclist)
+      self.logger.info(f"Registered {self.mw_obj.metrics.startup():.3f}s after our process started.")
+      # Wait for everyone to register so that all publishers start at once
+      self.logger.info("Waiting for discovery to be ready.")
+      self.mw_obj.wait_until_ready()
       # Now disseminate on our topics
       self.logger.info("Disseminating info on our topics.")
       self.mw_obj.disseminate(self.iters)
       # Now deregister from zookeeper and discovery since dissemination is done
       self.logger.info("Deregistering app from zookeeper and discovery.")
-      self.mw_obj.deregister(self.name, self.topiclist)
+      if self.publishers: self.mw_obj.deregister(self.publishers)
+      else: self.mw_obj.deregister(self.name, self.topiclist)
     except Exception as e: handle_exception(e)
 
 """Parse command line arguments"""
@@ -127,6 +142,37 @@ def parseCmdLineArgs():
     "-i", "--iters", type=int, default=1000, 
     help="number of publication iterations (default: 1000)"
   )
+  parser.add_argument(
+    "-k", "--count", type=int, default=1, 
+    help="number of logical publishers hosted by this process, sharing one " + 
+      "PUB socket and zookeeper session (default: 1)"
+  )
+  parser.add_argument(
+    "-w", "--workload", default=None,
+    help="workload spec (see Testing/gen_workload.py) giving our topics, rates and " +
+      "payloads, default: random topics and values"
+  )
+  parser.add_argument(
+    "-rd", "--record_dir", default="",
+    help="Directory to record every message we sent in, for Testing/verify_delivery.py " +
+      "(default: not recorded)"
+  )
+  parser.add_argument(
+    "-rt", "--ready_timeout", type=int, default=60, 
+    help="Seconds to wait for discovery to be ready before publishing anyway, default=60 (0 = no limit)"
+  )
+  parser.add_argument(
+    "-mp", "--metrics_port", type=int, default=0, 
+    help="Port on which our metrics are served over HTTP, default=0 (not served)"
+  )
+  parser.add_argument(
+    "-pf", "--profile", default="", choices=["", "sample", "cprofile"], 
+    help="Profile us from the start with this profiler, default='' (only on SIGUSR1, with sample)"
+  )
+  parser.add_argument(
+    "-pd", "--profile_dir", default="Logs/profiles", 
+    help="Directory our profiles are written to, default=Logs/profiles"
+  )
   parser.add_argument(
     "-l", "--loglevel", type=int, default=logging.INFO, 
     choices=[
@@ -150,6 +196,8 @@ def main():
     logger.debug("Main: resetting log level to {}".format(args.loglevel))
     logger.setLevel(args.loglevel)
     logger.debug("Main: effective log level is {}".format(logger.getEffectiveLevel()))
+    # profile us from the start (with --profile) or whenever we get SIGUSR1
+    install_profiler(logger, "publisher", args)
     # Obtain a publisher application
     logger.debug("Main: obtain the object")
     pub_app = PublisherAppln(logger) # get the object
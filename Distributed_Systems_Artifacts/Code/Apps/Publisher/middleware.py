@@ -19,12 +19,20 @@
 #     instructed by the 
 #
 # Import statements
-import sys, os, zmq, time, json
+import sys, os, zmq, time, json, heapq, threading, configparser
 sys.path.append(os.getcwd())
-from Apps.Common.common import handle_exception, \
-  disseminate, register, deregister
+from Apps.Common.common import handle_exception, disseminate, register, make_header, \
+  deregister, build_register_req, build_deregister_req, register_batch, deregister_batch, zk_hosts
+from Apps.Common.coordination import wait_for_node, ensure_paths, join_group, existing, commit_batches
 from Apps.Common import discovery_pb2
 from Apps.Common.topic_selector import TopicSelector
+from Apps.Common.transport import bind_endpoints, host_id
+from Apps.Common.flow_control import FlowControl
+from Apps.Common.codec import Codec
+from Apps.Common.delivery_log import DeliveryLog
+from Apps.Common.tracing import Tracer
+from Apps.Common.failure_detector import Heartbeat
+from Apps.Common.metrics import Metrics
 from kazoo.client import KazooClient
 from kazoo.recipe.watchers import ChildrenWatch
 from kazoo.recipe.watchers import DataWatch
@@ -48,6 +56,18 @@ class PublisherMW():
     self.history_windows = None     # dictionary of sliding windows of prior publications (per topic)
     self.topics_strengths = None    # dictionary of the strength of each of our topics
     self.pre_existing_pubs = None   # the pubs that existed in zookeeper before we joined
+    self.host = None        # id of the host we run on (to find co-located peers)
+    self.endpoints = None   # every endpoint our PUB socket is bound on
+    self.flow = None        # our high-water marks and drop counters
+    self.seqs = None        # (publisher, topic) -> sequence number of the last publication
+    self.metrics = None     # our runtime counters and histograms
+    self.codec = None       # compresses our payloads (if configured)
+    self.record = None      # record of every message we sent (if asked for)
+    self.tracer = None      # starts the traces of the publications we sample
+    self.topic_selector = None # generates our publications (from a workload spec if given)
+    self.ready = None       # set once discovery tells that everyone has registered
+    self.ready_timeout = None # seconds we wait for that before publishing anyway (None = no limit)
+    self.heartbeat = None   # our heartbeats (if they are enabled)
 
   """configure/initialize"""
   def configure(self, args):
@@ -61,18 +81,34 @@ class PublisherMW():
       self.history_windows = {}
       self.topics_strengths = {}
       self.pre_existing_pubs = []
+      # Get the configuration object
+      config = configparser.ConfigParser()
+      config.read(args.config)
+      self.host = host_id(config)
+      self.topic_selector = TopicSelector(config, args.workload)
+      self.flow = FlowControl(self.logger, config, "Publisher")
+      self.metrics = Metrics("publisher", self.name)
+      self.flow.metrics = self.metrics
+      self.codec = Codec(self.logger, config)
+      self.tracer = Tracer(config, self.name)
+      if args.metrics_port: self.metrics.serve(self.addr, args.metrics_port)
+      self.record = DeliveryLog(args.record_dir, self.name, "sent")
+      self.seqs = {}
+      self.ready = threading.Event()
+      self.ready_timeout = args.ready_timeout or None
+      self.heartbeat = Heartbeat(config, f"{self.addr}:{self.port}")
       # Next setup ZMQ
-      context = zmq.Context()  # returns a singleton object
+      context = zmq.Context.instance()  # returns a singleton object
       self.poller = zmq.Poller()
       # Now setup the sockets
       self.req = context.socket(zmq.REQ)
       self.pub = context.socket(zmq.PUB)
       self.poller.register(self.req, zmq.POLLIN)
-      bind_string = f"tcp://{self.addr}:{self.port}"
-      self.pub.bind(bind_string)
-      self.logger.debug(f"PublisherMW::configure - bound to socket: {bind_string}")
+      self.flow.configure_sender(self.pub)
+      self.endpoints = bind_endpoints(self.logger, self.pub, config, self.name, self.addr, self.port)
+      self.logger.debug(f"PublisherMW::configure - bound to sockets: {self.endpoints}")
       # Now setup the zookeeper kazoo client
-      self.zkc = KazooClient(hosts='10.0.0.1:2181')
+      self.zkc = KazooClient(hosts=zk_hosts(config))
       self.zkc.start()
     except Exception as e: handle_exception(e)
 
@@ -84,21 +120,35 @@ class PublisherMW():
       for topic in topiclist: 
         self.topics_strengths[topic] = 0
         self.history_windows[topic] = []
-      # first check to see if discovery is in zookeeper
-      while not self.zkc.exists("/discovery"): time.sleep(1)
-      # now join zookeeper once discovery has joined
+      # first wait for discovery to be in zookeeper
+      wait_for_node(self.zkc, "/discovery")
+      # now join zookeeper (the pubs before us and our node in one round trip)
       pub = f"{self.name}:{self.addr}:{self.port}"
-      self.zkc.ensure_path(f'/discovery/pubs')
-      self.pre_existing_pubs = self.zkc.get_children('/discovery/pubs')
-      if len(self.pre_existing_pubs) == 0: time.sleep(10)
+      self.pre_existing_pubs = join_group(self.zkc, '/discovery/pubs', pub, str(self.topiclist).encode())
       self.logger.debug(f"PublisherMW::register - pre_existing_pubs: {self.pre_existing_pubs}")
-      if not self.zkc.exists(f'/discovery/pubs/{pub}'):
-        self.zkc.create(f'/discovery/pubs/{pub}', str(self.topiclist).encode(), ephemeral=True)
       self.logger.info("Registered with zookeeper.")
       # now register with the lead discovery service
       self.listen_for_new_discovery()
     except Exception as e: handle_exception(e)
 
+  """wait until discovery tells (in the /discovery/ready znode) that everyone has registered"""
+  def wait_until_ready(self):
+    try:
+      self.logger.debug("PublisherMW::wait_until_ready")
+      DataWatch(self.zkc, '/discovery/ready', self.handle_ready)
+      if self.ready.wait(self.ready_timeout): self.logger.info("Discovery is ready.")
+      else: self.logger.warning(f"Discovery is not ready after {self.ready_timeout}s (do its -P/-S " +
+                                "match the clients started, is a lead broker up?), publishing anyway.")
+    except Exception as e: handle_exception(e)
+
+  """Handles the event where the ready znode is set (stops watching it once it is)"""
+  def handle_ready(self, data, stat):
+    try:
+      self.metrics.inc("zk_events_total", watch="ready")
+      if data: self.ready.set()
+      return not self.ready.is_set()
+    except Exception as e: handle_exception(e)
+
   """listen to zookeeper for alerts about new publishers joining"""
   def listen_for_new_discovery(self):
     try:
@@ -109,6 +159,7 @@ class PublisherMW():
   """Handles the event where there are changes to the pubs in zookeeper"""
   def handle_discovery_change(self, data, stat):
     try:
+      self.metrics.inc("zk_events_total", watch="discovery_leader")
       if (data):
         self.logger.debug(f"PublisherMW::handle_discovery_change - data: {data}")
         self.logger.info("Connecting to the lead discovery service.")
@@ -120,7 +171,8 @@ class PublisherMW():
         time.sleep(.1)
         register_req = discovery_pb2.RegisterReq()
         register(self.logger, register_req.PUBLISHER, self.name, 
-               self.addr, self.port, self.req, topiclist=self.topiclist)
+               self.addr, self.port, self.req, topiclist=self.topiclist,
+               host=self.host, endpoints=self.endpoints)
         self.event_loop()
         self.logger.info("Publisher app registered.")
     except Exception as e: handle_exception(e)
@@ -163,11 +215,11 @@ class PublisherMW():
       disc_resp = discovery_pb2.DiscoveryResp()
       disc_resp.ParseFromString(bytesRcvd)
       # Depending on the message type, the contents of the msg will differ
-      if(disc_resp.msg_type == discovery_pb2.REGISTER):
+      if(disc_resp.msg_type in [discovery_pb2.REGISTER, discovery_pb2.REGISTER_BATCH]):
         if disc_resp.register_resp.result == discovery_pb2.RegisterResp().Result.FAILURE:
           raise Exception(disc_resp.register_resp.fail_reason) # return register error
         else: return disc_resp.register_resp.result # return response to register
-      elif(disc_resp.msg_type == discovery_pb2.DEREGISTER):
+      elif(disc_resp.msg_type in [discovery_pb2.DEREGISTER, discovery_pb2.DEREGISTER_BATCH]):
         if disc_resp.deregister_resp.result == discovery_pb2.DeregisterResp().Result.FAILURE:
           raise Exception(disc_resp.deregister_resp.fail_reason) # return deregister error
         else: return disc_resp.deregister_resp.result # return response to deregister
@@ -180,23 +232,80 @@ class PublisherMW():
         self.logger.debug("PublisherMW::disseminate")
         self.evaluate_ownership_strength() # evaluate our ownership strength ASAP
         self.listen_for_pubs_leaving() # listen for pubs leaving (to re-evaluate ownership strength)
-        ts = TopicSelector()
+        ts = self.topic_selector
+        if ts.workload: self.disseminate_at_rates(ts, iters)
+        else: self.disseminate_in_rounds(ts, iters)
+        self.flow.report()
+        self.logger.info("Dissemination finished. Exiting.")
+      except Exception as e: handle_exception(e)
+
+  """publish on all of our topics once per round"""
+  def disseminate_in_rounds(self, ts, iters):
+      try:
         for i in range(iters):
           # Here, we choose to disseminate on all topics that we publish.  
           # Also, we don't care about their values. But in future assignments, this can change.
           for topic in self.topiclist:
-            time.sleep(.01)
+            self.pause(.01)
             owner_strength = self.topics_strengths[topic]
-            if owner_strength == 0:
-              data = topic + ":" + ts.gen_publication(topic)
-              disseminate(self.logger, self.pub, data)
-              self.update_history(topic, data)
-              topic_hist = topic + ":" + "hs-" + str(self.history) + "-hw-" + str(self.history_windows[topic])
-              disseminate(self.logger, self.pub, topic_hist)
+            if owner_strength == 0: self.publish(ts, self.name, topic, self.history_windows)
             else: self.logger.debug(f"PublisherMW::disseminate - Skipping topic. Current strength: {owner_strength}")
-        self.logger.info("Dissemination finished. Exiting.")
       except Exception as e: handle_exception(e)
 
+  """publish iters times on each of our topics at the rates of the workload spec"""
+  def disseminate_at_rates(self, ts, iters):
+      try:
+        # each entry is (time it is due, topic, publications left)
+        start = time.time()
+        schedule = [(start, topic, iters) for topic in self.topiclist]
+        heapq.heapify(schedule)
+        while schedule:
+          due, topic, left = heapq.heappop(schedule)
+          self.pause(due - time.time())
+          if self.topics_strengths[topic] == 0: self.publish(ts, self.name, topic, self.history_windows)
+          if left > 1: heapq.heappush(schedule, (due + ts.interval(topic, .01), topic, left - 1))
+      except Exception as e: handle_exception(e)
+
+  """sleep for the given seconds (if any), sending our heartbeats whenever they are due"""
+  def pause(self, seconds):
+    try:
+      end = time.time() + seconds
+      while True:
+        self.heartbeat.beat(self.pub)
+        left = end - time.time()
+        if left <= 0: return
+        wait = self.heartbeat.left()
+        time.sleep(left if wait is None else min(left, wait))
+    except Exception as e: handle_exception(e)
+
+  """publish a value and our history window on the given topic"""
+  def publish(self, ts, name, topic, history_windows):
+    try:
+      value = ts.gen_publication(topic)
+      data = topic + ":" + value
+      header = self.next_header(name, topic)
+      trace = self.tracer.start(name)
+      disseminate(self.logger, self.pub, data, header, self.flow, self.codec, len(topic) + 1, trace)
+      self.record.sent(header, topic, "d", value)
+      self.update_history(topic, data, history_windows)
+      topic_hist = topic + ":" + "hs-" + str(self.history) + "-hw-" + str(history_windows[topic])
+      # only the window itself gets compressed, the broker still adds its address in front of it
+      plain = topic_hist.index("-hw-") + len("-hw-")
+      header = self.next_header(name, topic)
+      disseminate(self.logger, self.pub, topic_hist, header, self.flow, self.codec, plain)
+      self.record.sent(header, topic, "h")
+      self.flow.maybe_report()
+    except Exception as e: handle_exception(e)
+
+  """build the header of the next publication of the publisher on the topic"""
+  def next_header(self, name, topic):
+    try:
+      # subscribers find lost messages from gaps in the per topic sequence numbers
+      seq = self.seqs.get((name, topic), 0) + 1
+      self.seqs[(name, topic)] = seq
+      return make_header(name, seq)
+    except Exception as e: handle_exception(e)
+
   """listen to zookeeper for alerts about publishers leaving"""
   def listen_for_pubs_leaving(self):
     try:
@@ -209,6 +318,7 @@ class PublisherMW():
   def handle_pubs_change(self, children):
     try:
       self.logger.debug(f"PublisherMW::handle_pubs_change - children: {children}")
+      self.metrics.inc("zk_events_total", watch="pubs")
       # go through our list of pre-existing pubs
       i = 0
       for pub in self.pre_existing_pubs:
@@ -251,11 +361,113 @@ class PublisherMW():
     except Exception as e: handle_exception(e)
 
   """Updates our sliding history window with the current publication"""
-  def update_history(self, topic, publication):
+  def update_history(self, topic, publication, history_windows):
     try:
       self.logger.debug("PublisherMW::update_history")
-      if len(self.history_windows[topic]) == self.history:
-        self.logger.debug(f"PublisherMW::update_history - history: {self.history_windows}")
-        self.history_windows[topic].pop(0)
-      self.history_windows[topic].append(publication)
+      if len(history_windows[topic]) == self.history:
+        self.logger.debug(f"PublisherMW::update_history - history: {history_windows}")
+        history_windows[topic].pop(0)
+      history_windows[topic].append(publication)
+    except Exception as e: handle_exception(e)
+
+
+"""Multi-Publisher Middleware class"""
+# Hosts many logical publishers in one process for high density load generation.
+# They share our PUB socket, our zookeeper session and our discovery connection.
+# Their zookeeper nodes are created in batched transactions, they are registered 
+# with discovery in a single batch, and a single scheduler drives all of their
+# publications. Every logical publisher publishes on all of its topics (ownership
+# strength is not evaluated since we are only generating load).
+class MultiPublisherMW(PublisherMW):
+
+  # the max number of zookeeper operations we put in one transaction
+  ZK_BATCH = 500
+  # the time between two publications of the same logical publisher
+  INTERVAL = 0.01
+
+  """constructor"""
+  def __init__(self, logger):
+    super().__init__(logger)
+    self.publishers = None  # logical publisher name -> its topic list
+
+  """register all of our logical publishers with zookeeper and discovery"""
+  def register(self, publishers):
+    try:
+      self.logger.debug("MultiPublisherMW::register")
+      self.publishers = publishers
+      for name, topiclist in publishers.items():
+        self.history_windows[name] = {topic: [] for topic in topiclist}
+      # first wait for discovery to be in zookeeper
+      wait_for_node(self.zkc, "/discovery")
+      # now join zookeeper in batched transactions (all in flight at once)
+      ensure_paths(self.zkc, '/discovery/pubs')
+      nodes = {f'/discovery/pubs/{name}:{self.addr}:{self.port}': str(topiclist).encode() 
+               for name, topiclist in publishers.items()}
+      commit_batches(self.zkc, nodes, self.ZK_BATCH)
+      self.logger.info(f"Registered {len(nodes)} publishers with zookeeper.")
+      # now register with the lead discovery service
+      self.listen_for_new_discovery()
+    except Exception as e: handle_exception(e)
+
+  """Handles the event where there are changes to the discovery leader in zookeeper"""
+  def handle_discovery_change(self, data, stat):
+    try:
+      self.metrics.inc("zk_events_total", watch="discovery_leader")
+      if (data):
+        self.logger.debug(f"MultiPublisherMW::handle_discovery_change - data: {data}")
+        self.logger.info("Connecting to the lead discovery service.")
+        if self.discovery: self.req.disconnect(self.discovery)
+        self.discovery = "tcp://" + data.decode()
+        self.req.connect(self.discovery)
+        self.logger.info(f"Connected to: {self.discovery}")
+        # now build one batch of register req messages
+        time.sleep(.1)
+        register_reqs = [build_register_req(discovery_pb2.RegisterReq.PUBLISHER, name, 
+                           self.addr, self.port, topiclist, self.host, self.endpoints) 
+                         for name, topiclist in self.publishers.items()]
+        register_batch(self.logger, register_reqs, self.req)
+        self.event_loop()
+        self.logger.info(f"{len(register_reqs)} publishers registered.")
+    except Exception as e: handle_exception(e)
+
+  """deregister all of our logical publishers from zookeeper and discovery"""
+  def deregister(self, publishers):
+    try:
+      self.logger.debug("MultiPublisherMW::deregister")
+      # leave zookeeper in batched transactions (of the nodes still there)
+      paths = existing(self.zkc, [f'/discovery/pubs/{name}:{self.addr}:{self.port}' for name in publishers])
+      commit_batches(self.zkc, {path: None for path in paths}, self.ZK_BATCH)
+      # now build one batch of deregister req messages
+      deregister_reqs = [build_deregister_req(discovery_pb2.DeregisterReq.PUBLISHER, name, 
+                           self.addr, self.port, topiclist) 
+                         for name, topiclist in publishers.items()]
+      deregister_batch(self.logger, deregister_reqs, self.req)
+      # now go to our event loop to receive a response to this request
+      return self.event_loop()
+    except Exception as e: handle_exception(e)
+
+  """drive the publications of all of our logical publishers from one scheduler"""
+  def disseminate(self, iters):
+    try:
+      self.logger.debug("MultiPublisherMW::disseminate")
+      ts = self.topic_selector
+      # each entry is (time it is due, logical publisher, publications left, topic)
+      start = time.time(); schedule = []
+      for i, (name, topiclist) in enumerate(self.publishers.items()):
+        # spread the first publications out so they do not all fire at once
+        due = start + self.INTERVAL * i / len(self.publishers)
+        # with a workload spec every topic keeps its own rate
+        if ts.workload:
+          for topic in topiclist: heapq.heappush(schedule, (due, name, iters, topic))
+        else: heapq.heappush(schedule, (due, name, iters * len(topiclist), None))
+      while schedule:
+        due, name, left, topic = heapq.heappop(schedule)
+        self.pause(due - time.time())
+        # otherwise publish on the next topic of this logical publisher in round robin order
+        topiclist = self.publishers[name]
+        self.publish(ts, name, topic or topiclist[left % len(topiclist)], self.history_windows[name])
+        interval = ts.interval(topic, self.INTERVAL) if topic else self.INTERVAL
+        if left > 1: heapq.heappush(schedule, (due + interval, name, left - 1, topic))
+      self.flow.report()
+      self.logger.info("Dissemination finished. Exiting.")
     except Exception as e: handle_exception(e)
@@ -22,7 +22,9 @@
 import sys, os, time, argparse, configparser, logging, random
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, dump
+from Apps.Common.profiling import install_profiler
 from Apps.Common.topic_selector import TopicSelector
+from Apps.Common.content_filter import parse_filter
 from Apps.Subscriber.middleware import SubscriberMW
 
 """SubscriberAppln class"""
@@ -53,8 +55,12 @@ class SubscriberAppln():
       self.lookup = config["Discovery"]["Strategy"]
       self.dissemination = config["Dissemination"]["Strategy"]
       # Now get our topic list of interest
-      ts = TopicSelector()
-      self.topiclist = ts.interest()
+      ts = TopicSelector(config, args.workload)
+      self.topiclist = list(args.topic) if args.topic else ts.interest(self.name)
+      # we must be interested in the topics we filter on
+      for content_filter in args.filter:
+        topic = parse_filter(content_filter).topic
+        if topic not in self.topiclist: self.topiclist.append(topic)
       # Now setup up our underlying middleware object
       self.mw_obj = SubscriberMW(self.logger)
       self.mw_obj.configure(args)      
@@ -70,12 +76,15 @@ class SubscriberAppln():
       # Use middleware to register us with zookeeper and discovery
       self.logger.info("Registering app with zookeeper and discovery.")
       self.mw_obj.register(self.topiclist)
+      self.logger.info(f"Registered {self.mw_obj.metrics.startup():.3f}s after our process started.")
       # Now, find the publishers that match our topics
       self.logger.info("Locating publishers for our topics.")
       pubs = self.mw_obj.locate_pubs(self.topiclist)
       # Finally, subscribe and listen to the publishers
       if len(pubs) > 0: self.logger.info("Subscribing to relevant publishers.")
       self.mw_obj.sub_to_pubs(pubs, self.topiclist)
+      # Catch up on what our brokers logged before we joined (if asked to)
+      self.mw_obj.replay_logs(pubs, self.topiclist)
       self.mw_obj.listen_for_new_pubs()
       self.logger.info("Listening for new publishers.")
       self.mw_obj.listen_to_pubs()
@@ -107,6 +116,42 @@ def parseCmdLineArgs():
     "-c", "--config", default="Apps/Common/config.ini", 
     help="configuration file (default: Apps/Common/config.ini)"
   )
+  parser.add_argument(
+    "-t", "--topic", action="append", default=[], 
+    help="A topic (or wildcard pattern such as 'sensors/+/temperature' or 'sensors/roof/#') " +
+      "to subscribe to (may be repeated). default: a random set of topics"
+  )
+  parser.add_argument(
+    "-w", "--workload", default=None,
+    help="workload spec (see Testing/gen_workload.py) giving our topics, default: random topics"
+  )
+  parser.add_argument(
+    "-f", "--filter", action="append", default=[], 
+    help="Only receive the publications of a topic that match a filter such as " +
+      "'temperature>90' or 'weather in {icy,foggy}' (one per topic, may be repeated)"
+  )
+  parser.add_argument(
+    "-r", "--replay", default="", 
+    help="Replay the topic logs of our brokers before going live, from an offset " +
+      "(e.g. 0) or from a number of seconds back (e.g. 60s). default: no replay"
+  )
+  parser.add_argument(
+    "-rd", "--record_dir", default="",
+    help="Directory to record every message we received in, for Testing/verify_delivery.py " +
+      "(default: not recorded)"
+  )
+  parser.add_argument(
+    "-mp", "--metrics_port", type=int, default=0, 
+    help="Port on which our metrics are served over HTTP, default=0 (not served)"
+  )
+  parser.add_argument(
+    "-pf", "--profile", default="", choices=["", "sample", "cprofile"], 
+    help="Profile us from the start with this profiler, default='' (only on SIGUSR1, with sample)"
+  )
+  parser.add_argument(
+    "-pd", "--profile_dir", default="Logs/profiles", 
+    help="Directory our profiles are written to, default=Logs/profiles"
+  )
   parser.add_argument(
     "-l", "--loglevel", type=int, default=logging.INFO, 
     choices=[
@@ -130,6 +175,8 @@ def main():
     logger.debug("Main: resetting log level to {}".format(args.loglevel))
     logger.setLevel(args.loglevel)
     logger.debug("Main: effective log level is {}".format(logger.getEffectiveLevel()))
+    # profile us from the start (with --profile) or whenever we get SIGUSR1
+    install_profiler(logger, "subscriber", args)
     # Obtain a subscriber application
     logger.debug("Main: obtain the object")
     sub_app = SubscriberAppln(logger) # get the object
@@ -21,15 +21,33 @@
 # (5) On receipt of a subscription, determine which topic it is and let the 
 #     application level handle the incoming data. To that end, you may need to 
 #     make an upcall to the application-level object.
+# (6) For topics with a content filter we subscribe to the filter key instead
+#     of the topic, so that the broker only sends us matching publications.
+#     Publishers cannot filter, so with direct dissemination we filter here.
+# (7) Exact topics are subscribed to as "topic:" and wildcard patterns through
+#     their pattern key (see Apps/Common/topic_trie.py). Without a broker we
+#     subscribe to the levels before the first wildcard and match here.
 #
 # Import statements
-import sys, os, zmq, json, time
+import sys, os, zmq, json, time, configparser
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, \
-  send_message, register
-from Apps.Common import discovery_pb2
+  send_message, register, parse_header, zk_hosts
+from Apps.Common.coordination import wait_for_node, join_group
+from Apps.Common import discovery_pb2, topic_pb2
+from Apps.Common.lookup_cache import LookupCache
+from Apps.Common.transport import host_id, endpoint_of
+from Apps.Common.flow_control import FlowControl
+from Apps.Common.metrics import Metrics
+from Apps.Common.codec import Codec
+from Apps.Common.delivery_log import DeliveryLog
+from Apps.Common.dedup import Deduplicator
+from Apps.Common.tracing import Tracer, pop_trace
+from Apps.Common.failure_detector import HEARTBEAT
+from Apps.Common.content_filter import parse_filter, is_filter_key
+from Apps.Common.topic_trie import is_pattern, is_pattern_key, pattern_key, \
+  subscription, topic_matches
 from kazoo.client import KazooClient
-from kazoo.recipe.watchers import ChildrenWatch
 from kazoo.recipe.watchers import DataWatch
 
 """Subscriber Middleware class"""
@@ -49,6 +67,18 @@ class SubscriberMW():
     self.discovery = None # the current connect string for discovery
     self.min_hist = None  # the minimum history we need from our pubs
     self.got_hist = None  # used to determine if we have received the pub hist yet or not
+    self.cache = None     # cache of our discovery lookups (revalidated by registry epoch)
+    self.host = None      # id of the host we run on (to find co-located peers)
+    self.connected = None # the endpoint we connected to for each publisher ip:port
+    self.flow = None      # our high-water marks and drop counters
+    self.metrics = None   # our runtime counters and histograms
+    self.codec = None     # decodes compressed payloads
+    self.record = None    # record of every message we received (if asked for)
+    self.dedup = None     # drops the copies of messages that came over another path
+    self.tracer = None    # finishes the traces of traced messages
+    self.replay_from = None # where to start replaying broker logs ("" = no replay)
+    self.filters = None   # topic -> our content filter on that topic
+    self.dissemination = None # direct or via broker
 
   """configure/initialize"""
   def configure(self, args):
@@ -61,15 +91,36 @@ class SubscriberMW():
       self.min_hist = int(args.history)
       self.got_hist = {}
       self.pubs = []
+      self.cache = LookupCache()
+      self.connected = {}
+      self.replay_from = args.replay
+      self.filters = {}
+      for content_filter in args.filter:
+        f = parse_filter(content_filter)
+        self.filters[f.topic] = f
+      # Get the configuration object
+      config = configparser.ConfigParser()
+      config.read(args.config)
+      self.host = host_id(config)
+      self.dissemination = config["Dissemination"]["Strategy"]
+      self.flow = FlowControl(self.logger, config, "Subscriber")
+      self.metrics = Metrics("subscriber", self.name)
+      self.flow.metrics = self.metrics
+      self.codec = Codec(self.logger, config)
+      self.dedup = Deduplicator(config)
+      self.tracer = Tracer(config, self.name)
+      if args.metrics_port: self.metrics.serve(self.addr, args.metrics_port)
+      self.record = DeliveryLog(args.record_dir, self.name, "recv")
       # setup ZMQ
-      context = zmq.Context()
+      context = zmq.Context.instance()
       self.poller = zmq.Poller()
       # Now setup the sockets
       self.req = context.socket(zmq.REQ)
       self.sub = context.socket(zmq.SUB)
+      self.flow.configure_receiver(self.sub)
       self.poller.register(self.req, zmq.POLLIN)
       # Now setup the zookeeper kazoo client
-      self.zkc = KazooClient(hosts='10.0.0.1:2181')
+      self.zkc = KazooClient(hosts=zk_hosts(config))
       self.zkc.start()
     except Exception as e: handle_exception(e)
     
@@ -79,13 +130,15 @@ class SubscriberMW():
       self.logger.debug("SubscriberMW::register")
       self.topiclist = topiclist
       for topic in topiclist: self.got_hist[topic] = False
-      # first check to see if discovery is in zookeeper
-      while not self.zkc.exists("/discovery"): time.sleep(1)
+      # the verifier needs to know what we should have received
+      self.record.describe("topics", topiclist)
+      self.record.describe("filters", [f.key for f in self.filters.values()])
+      self.record.describe("dissemination", self.dissemination)
+      # first wait for discovery to be in zookeeper
+      wait_for_node(self.zkc, "/discovery")
       # now join zookeeper once discovery has joined
       sub = f"{self.name}:{self.addr}:{self.port}"
-      if not self.zkc.exists(f'/discovery/subs/{sub}'):
-        self.zkc.ensure_path(f'/discovery/subs')
-        self.zkc.create(f'/discovery/subs/{sub}', b'subscriber-node', ephemeral=True)
+      join_group(self.zkc, '/discovery/subs', sub, b'subscriber-node')
       self.logger.info("Registered with zookeeper.")
       # now register with the lead discovery service
       self.listen_for_new_discovery()
@@ -101,6 +154,7 @@ class SubscriberMW():
   """Handles the event where there are changes to the pubs in zookeeper"""
   def handle_discovery_change(self, data, stat, event=None):
     try:
+      self.metrics.inc("zk_events_total", watch="discovery_leader")
       if (data):
         self.logger.debug(f"SubscriberMW::handle_discovery_change - data: {data}")
         self.logger.info("Connecting to the lead discovery service.")
@@ -122,33 +176,56 @@ class SubscriberMW():
     try:
       self.logger.debug("SubscriberMW::locate_pubs")
       self.topiclist = topiclist
+      # no need to ask discovery if nothing has changed since our last answer
+      epoch, cached_pubs = self.cache.get(topiclist)
+      if self.cache.is_fresh(topiclist): 
+        self.logger.debug(f"SubscriberMW::locate_pubs - cached answer is current (epoch {epoch})")
+        self.metrics.inc("lookup_cache_hits_total")
+        return cached_pubs
+      start = time.time()
       # build the request message
       disc_req = discovery_pb2.DiscoveryReq()
       getpubs_msg = discovery_pb2.LookupPubByTopicReq()
       getpubs_msg.topiclist.extend(topiclist)
+      getpubs_msg.epoch = epoch
+      getpubs_msg.host = self.host
+      getpubs_msg.pid = os.getpid()
       disc_req.msg_type = discovery_pb2.LOOKUP_PUB_BY_TOPIC
       disc_req.topics.CopyFrom(getpubs_msg)
       # send the message
       send_message(self.logger, self.req, disc_req)
       # now go to our event loop to receive a response to this request
       self.logger.debug("SubscriberMW::locate_pubs - now wait for reply")
-      publishers = self.event_loop()
-      return publishers
+      resp = self.event_loop()
+      self.metrics.observe("lookup_rpc_seconds", time.time() - start)
+      if resp.not_modified: self.logger.debug("SubscriberMW::locate_pubs - cached answer revalidated")
+      else: cached_pubs = resp.publishers
+      return self.cache.store(topiclist, resp.epoch, cached_pubs)
     except Exception as e: handle_exception(e)
 
-  """listen to zookeeper for alerts about new publishers joining"""
+  """listen to zookeeper for alerts about the discovery registry changing"""
   def listen_for_new_pubs(self):
     try:
       self.logger.debug("SubscriberMW::listen_for_new_pubs")
-      self.zkc.ensure_path('/discovery/pubs')
-      ChildrenWatch(self.zkc, '/discovery/pubs', self.handle_pubs_change)
+      DataWatch(self.zkc, '/discovery/epoch', self.handle_epoch_change)
+    except Exception as e: handle_exception(e)
+
+  """Handles the event where discovery announces a new registry epoch"""
+  def handle_epoch_change(self, data, stat):
+    try:
+      self.metrics.inc("zk_events_total", watch="epoch")
+      if stat:
+        self.logger.debug(f"SubscriberMW::handle_epoch_change - epoch: {stat.version}")
+        self.cache.observe(stat.version)
+        self.handle_pubs_change()
     except Exception as e: handle_exception(e)
   
-  """Handles the event where there are changes to the pubs in zookeeper"""
-  def handle_pubs_change(self, children):
+  """Handles the event where there are changes to the pubs known to discovery"""
+  def handle_pubs_change(self):
     try:
-      self.logger.debug(f"SubscriberMW::handle_pubs_change - children: {children}")
-      time.sleep(0.5) # sleep for a moment to not overwhelm
+      self.logger.debug("SubscriberMW::handle_pubs_change")
+      # discovery has already applied the change by the time the epoch moves
+      if self.cache.is_fresh(self.topiclist): return
       pubs = self.locate_pubs(self.topiclist)
       if (len(pubs) < len(self.pubs)): self.logger.info("Publisher left. Removing from list.")
       if (len(pubs) == 0): self.logger.info("No publishers present. Waiting...")
@@ -160,8 +237,9 @@ class SubscriberMW():
             p2 = json.loads(pub2)
             if p1['name'] == p2['name']: included = True
           if not included:
-            pub_addr = f"tcp://{p1['ip']}:{p1['port']}"
+            pub_addr = endpoint_of(p1)
             self.sub.connect(pub_addr)
+            self.connected[f"{p1['ip']}:{p1['port']}"] = pub_addr
             self.logger.info(f"Subscribed to new publisher: {pub_addr}")
           included = False
       self.pubs = pubs
@@ -174,16 +252,86 @@ class SubscriberMW():
       # First, set up the ZMQ socket filters for our desired topics
       for topic in topiclist:
         self.logger.debug(f"SubscriberMW::sub_to_pubs - topic: {topic}")
-        self.sub.setsockopt(zmq.SUBSCRIBE, topic.encode('utf-8'))
+        sub_key = subscription(topic)
+        # only a broker can evaluate our filters and patterns for us
+        if topic in self.filters and self.dissemination == "Broker":
+          sub_key = self.filters[topic].key
+          self.logger.info(f"Filtering {topic} at the broker with: {sub_key}")
+        elif is_pattern(topic) and self.dissemination == "Broker": sub_key = pattern_key(topic)
+        self.sub.setsockopt(zmq.SUBSCRIBE, sub_key.encode('utf-8'))
       # Then subscribe to each publisher we care about
       for pub in pubs:
         p = json.loads(pub)
-        pub_addr = f"tcp://{p['ip']}:{p['port']}"
+        pub_addr = endpoint_of(p)
         self.sub.connect(pub_addr)
+        self.connected[f"{p['ip']}:{p['port']}"] = pub_addr
         self.logger.info(f"Subscribed to publisher: {pub_addr}")
         self.pubs.append(pub)
     except Exception as e: handle_exception(e)
 
+  """replay the logs of our topics from the brokers that keep them"""
+  def replay_logs(self, pubs, topiclist):
+    try:
+      self.logger.debug("SubscriberMW::replay_logs")
+      if not self.replay_from: return
+      # build the request message (from a point in time or from an offset)
+      replay_req = topic_pb2.ReplayReq()
+      if self.replay_from.endswith("s"): replay_req.from_ts = time.time() - float(self.replay_from[:-1])
+      else: replay_req.from_offset = int(self.replay_from)
+      for pub in pubs:
+        p = json.loads(pub)
+        if "replay" not in p: continue # only brokers keep a log
+        dealer = zmq.Context.instance().socket(zmq.DEALER)
+        dealer.connect(p["replay"])
+        for topic in topiclist:
+          replay_req.topic = topic
+          dealer.send(replay_req.SerializeToString())
+          self.receive_replay(dealer, p["replay"])
+        dealer.close(linger=0)
+    except Exception as e: handle_exception(e)
+
+  """receive one replay (up to its end message) on the given socket"""
+  def receive_replay(self, dealer, endpoint):
+    try:
+      while True:
+        # a broker that died mid replay must not keep us from going live
+        if not dealer.poll(timeout=5000):
+          self.logger.info(f"Replay from {endpoint} timed out.")
+          return
+        frames = dealer.recv_multipart()
+        if frames[0] == b"E":
+          replay_end = topic_pb2.ReplayEnd()
+          replay_end.ParseFromString(frames[1])
+          self.logger.info(f"Replayed {replay_end.count} messages on {replay_end.topic} " +
+                           f"(broker holds offsets {replay_end.first_offset} to {replay_end.next_offset})")
+          return
+        header = parse_header(frames[2:])
+        try: message = self.codec.decode(frames[2:], header)
+        except Exception as e:
+          # say compressed with a dictionary we do not have, the rest of the replay still counts
+          self.logger.info(f"Could not decode replayed message {int(frames[1])}: {e}")
+          self.metrics.inc("messages_undecodable_total", path="replay")
+          continue
+        topic, value = message.split(":", 1)
+        # live copies of what we replay (and replays of what we already got) are dropped later on
+        if header and not self.dedup.first_copy(header["pub"], topic, header["seq"], header.get("run")): continue
+        self.record.received(header, topic, "replay")
+        self.metrics.inc("messages_replayed_total", topic=topic)
+        # the log holds every publication, so we apply our own filter to it
+        if topic in self.filters and not self.filters[topic].matches(value): continue
+        self.logger.info(f"Replayed message {int(frames[1])} from broker: {message}")
+    except Exception as e: handle_exception(e)
+
+  """count the messages of the publisher that never reached us (None for a stream the broker filters)"""
+  def count_lost(self, header, topic, filtered=False):
+    try:
+      # the content filter of the broker skips the sequence numbers we did not ask for, those are not lost
+      if filtered or (topic in self.filters and self.dissemination == "Broker"): return None
+      lost = self.flow.observe(header["pub"], topic, header["seq"])
+      if lost: self.logger.debug(f"SubscriberMW::count_lost - lost {lost} from {header['pub']}")
+      return lost
+    except Exception as e: handle_exception(e)
+
   """listen to all of our subscribed publishers"""
   def listen_to_pubs(self):
     try:
@@ -191,13 +339,39 @@ class SubscriberMW():
       while True:
         # receive messages from the publishers
         message_bytes = self.sub.recv_multipart()
-        message = str(message_bytes[0], 'UTF-8')
+        # a subscription to every topic also gets the heartbeats of our sources
+        if message_bytes[0].startswith(HEARTBEAT): continue
+        # messages the broker matched against our filter (or pattern) come under its key
+        filtered = is_filter_key(message_bytes[0])
+        if filtered or is_pattern_key(message_bytes[0]):
+          message_bytes = message_bytes[1:]
+        trace = pop_trace(message_bytes)
+        header = parse_header(message_bytes)
+        try: message = self.codec.decode(message_bytes, header)
+        except Exception as e:
+          # say compressed with a dictionary we do not have, one bad message must not stop us listening
+          self.logger.info(f"Could not decode message from {header.get('pub') if header else 'unknown'}: {e}")
+          self.metrics.inc("messages_undecodable_total", path="live")
+          continue
+        self.metrics.inc("messages_in_total", topic=message.split(":")[0])
+        self.metrics.inc("bytes_in_total", sum(len(frame) for frame in message_bytes))
+        # with redundant paths we deliver whichever copy comes first
+        if header and not self.dedup.first_copy(header["pub"], message.split(":")[0], header["seq"], header.get("run")):
+          self.metrics.inc("messages_duplicate_total", topic=message.split(":")[0])
+          continue
+        self.record.received(header, message.split(":")[0], "live")
+        self.tracer.finish(trace, message.split(":")[0])
+        # count any messages the publisher sent that never reached us
+        if header: 
+          self.metrics.observe("latency_seconds", time.time() - header["ts"])
+          self.count_lost(header, message.split(":")[0], filtered)
+        self.flow.maybe_report()
         # determine if a message is a history message
         if "pi-" in message and "-hs-" in message and "-hw-" in message:
           # if it is a history message, determine if it matches our requirement
           history_size = int(message.split("-hs-")[1].split("-hw-")[0])
           topic = message.split(":")[0]
-          if history_size >= self.min_hist and not self.got_hist[topic]:
+          if history_size >= self.min_hist and not self.got_hist.get(topic, False):
             # if it does match, print out the history (we have received it successfully)
             self.logger.info(f"History received from publisher for topic: {topic}")
             history = eval(message.split("-hw-")[1])
@@ -207,10 +381,29 @@ class SubscriberMW():
           elif history_size < self.min_hist:
             pub_info = message.split("pi-")[1].split("-hs-")[0]
             self.logger.info(f"Publisher doesnt meet minimum history. Unsubscribing.")
-            self.sub.disconnect(f"tcp://{pub_info}")
+            self.sub.disconnect(self.connected.get(pub_info, f"tcp://{pub_info}"))
             self.logger.info(f"Unsubscribed from publisher: {pub_info}")
-        # if it is not a history message, simply print the message
-        else: self.logger.info(f"Message from publisher: {message}")
+        # if it is not a history message, simply print the message (if it matches our filter)
+        elif self.matches_filter(message): self.logger.info(f"Message from publisher: {message}")
+    except Exception as e: handle_exception(e)
+
+  """tells if the message matches our filter on its topic (if we have to filter it ourselves)"""
+  def matches_filter(self, message):
+    try:
+      topic, value = message.split(":", 1)
+      if self.dissemination != "Broker" and not self.wants(topic):
+        self.metrics.inc("messages_filtered_total", topic=topic)
+        return False
+      if topic not in self.filters or self.dissemination == "Broker": return True
+      if self.filters[topic].matches(value): return True
+      self.metrics.inc("messages_filtered_total", topic=topic)
+      return False
+    except Exception as e: handle_exception(e)
+
+  """tells if the topic is one of ours (or matches one of our patterns)"""
+  def wants(self, topic):
+    try:
+      return any(topic == t or (is_pattern(t) and topic_matches(t, topic)) for t in self.topiclist)
     except Exception as e: handle_exception(e)
 
   """run event loop where we expect to receive replies to sent requests"""
@@ -239,6 +432,6 @@ class SubscriberMW():
           raise Exception(disc_resp.register_resp.fail_reason) # return register error
         else: return disc_resp.register_resp.result # return response to register
       elif(disc_resp.msg_type == discovery_pb2.LOOKUP_PUB_BY_TOPIC):
-        return disc_resp.resp.publishers # response to lookup_pub... message
+        return disc_resp.resp # response to lookup_pub... message
       else: raise Exception("Unrecognized response message.")
     except Exception as e: handle_exception(e)
@@ -0,0 +1,117 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: File for benchmarking the forwarding throughput of the broker
+# Semester: Spring 2023
+###############################################
+#
+# Measures how many messages per second a broker forwards with a given
+# number of worker processes (--workers of the broker application, see
+# Apps/Broker/workers.py). No zookeeper or discovery is involved: publisher
+# processes publish to the broker as fast as they can and one subscriber
+# process counts what comes out of the advertised endpoint. The broker runs
+# the same forwarding code (and the stages of the config file) as the real
+# one, so throughput should grow with the workers until the cores (or the
+# routing broker process) run out.
+#
+# Example:
+#   python3 Testing/bench_broker.py --workers 1,2,4 --messages 200000 --topics 64
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import json, time, logging, argparse, configparser, multiprocessing
+import zmq
+from Apps.Broker.middleware import BrokerMW
+from Apps.Broker.workers import WorkerPool
+from Apps.Broker.topic_log import LogStore
+
+def publish(port, index, count, topics):
+    pub = zmq.Context.instance().socket(zmq.PUB)
+    pub.bind(f"tcp://127.0.0.1:{port}")
+    time.sleep(2)  # let the broker connect
+    seqs = {}
+    for i in range(count):
+        topic = topics[i % len(topics)]
+        seqs[topic] = seqs.get(topic, -1) + 1
+        header = {"pub": f"bench{index}", "seq": seqs[topic], "ts": time.time()}
+        pub.send_multipart([f"{topic}:{i}".encode(), json.dumps(header).encode()])
+    time.sleep(1)
+
+def subscribe(port, results, idle):
+    sub = zmq.Context.instance().socket(zmq.SUB)
+    sub.connect(f"tcp://127.0.0.1:{port}")
+    sub.subscribe("")
+    received, first, last = 0, None, None
+    while True:
+        if not sub.poll(idle * 1000 if first else 30000): break
+        sub.recv_multipart()
+        last = time.time()
+        if first is None: first = last
+        received += 1
+    results.put((received, (last - first) if first else 0))
+
+def run_broker(args, workers, port, pub_ports):
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger("BenchBroker")
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    broker_args = argparse.Namespace(name=f"bench{workers}", addr="127.0.0.1", port=str(port),
+                                     config=args.config, workers=workers, metrics_port=0,
+                                     profile="", profile_dir="Logs/profiles", loglevel=logging.WARNING)
+    # the sockets and stages BrokerMW.configure sets up, without zookeeper and discovery
+    mw_obj = BrokerMW(logger)
+    mw_obj.name, mw_obj.addr, mw_obj.port = broker_args.name, broker_args.addr, broker_args.port
+    mw_obj.configure_stages(config)
+    mw_obj.federation.enabled = False  # a lone broker, no other sites to link to
+    context = zmq.Context.instance()
+    mw_obj.pub = context.socket(zmq.XPUB)
+    mw_obj.sub = context.socket(zmq.SUB)
+    mw_obj.flow.configure_sender(mw_obj.pub)
+    mw_obj.flow.configure_receiver(mw_obj.sub)
+    mw_obj.pub.bind(f"tcp://127.0.0.1:{port}")
+    for pub_port in pub_ports: mw_obj.sub.connect(f"tcp://127.0.0.1:{pub_port}")
+    mw_obj.sub.subscribe("")
+    mw_obj.workers = WorkerPool(logger, config, broker_args)
+    if mw_obj.workers.enabled: mw_obj.workers.start(context, mw_obj.pub)
+    else: mw_obj.log = LogStore(logger, config, broker_args.name)
+    mw_obj.listen_to_pubs()
+
+def bench(args, workers, base_port):
+    mp = multiprocessing.get_context("spawn")
+    topics = [f"bench/{i}" for i in range(args.topics)]
+    pub_ports = [base_port + 1 + i for i in range(args.pubs)]
+    results = mp.Queue()
+    broker = mp.Process(target=run_broker, args=(args, workers, base_port, pub_ports))
+    broker.start()
+    time.sleep(1)
+    sub = mp.Process(target=subscribe, args=(base_port, results, args.idle))
+    sub.start()
+    pubs = [mp.Process(target=publish, args=(port, i, args.messages // args.pubs, topics))
+            for i, port in enumerate(pub_ports)]
+    for pub in pubs: pub.start()
+    received, elapsed = results.get()
+    for proc in pubs + [sub]: proc.join()
+    broker.terminate()
+    broker.join()
+    return received, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Broker throughput benchmark")
+    parser.add_argument("-w", "--workers", default="1,2,4", help="comma separated worker counts to run")
+    parser.add_argument("-n", "--messages", type=int, default=200000, help="messages published per run")
+    parser.add_argument("-t", "--topics", type=int, default=64, help="number of topics")
+    parser.add_argument("-p", "--pubs", type=int, default=2, help="number of publisher processes")
+    parser.add_argument("-i", "--idle", type=int, default=3, help="seconds without messages that end a run")
+    parser.add_argument("-c", "--config", default="Apps/Common/config.ini", help="config file of the broker")
+    parser.add_argument("-bp", "--base_port", type=int, default=6100, help="first port used by the runs")
+    args = parser.parse_args()
+    baseline = None
+    for run, workers in enumerate(int(w) for w in args.workers.split(",")):
+        received, elapsed = bench(args, workers, args.base_port + run * 10)
+        rate = received / elapsed if elapsed else 0
+        baseline = baseline or rate
+        print(f"workers={workers}: {received}/{args.messages} messages in {elapsed:.2f}s = " +
+              f"{rate:.0f} msg/s ({rate / baseline if baseline else 0:.2f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: File for benchmarking how fast the applications start
+# Semester: Spring 2023
+###############################################
+#
+# Tests start hundreds of publishers and subscribers, and each of them pays
+# for its imports before it does anything. This benchmark measures:
+# (1) imports: every role is imported --runs times under python -X importtime
+#     and the median total import time is reported with the libraries our
+#     own modules import that took longest (including what they import in
+#     turn) and the protobuf backend in use (upb is the fast one)
+# (2) start to registered: with --spawn N, N publishers (or subscribers,
+#     --role) are started against a running cluster (zookeeper, discovery
+#     and brokers, as set up by the config file) and the startup_seconds
+#     every one of them logs once registered (see Apps/Common/metrics.py)
+#     is reported (min, median, p90 and max)
+# With --out every result is appended as a JSON line, to track it over time.
+#
+# Examples:
+#   python3 Testing/bench_startup.py --runs 5
+#   python3 Testing/bench_startup.py --runs 0 --spawn 50 --role publisher --out Logs/startup.jsonl
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import re, json, time, argparse, statistics, subprocess, threading
+
+ROLES = ["Publisher", "Subscriber", "Broker", "Discovery"]
+REGISTERED = re.compile(r"registered (\d+\.\d+)s after our process started", re.IGNORECASE)
+
+def import_times(role):
+    # returns module -> (cumulative microseconds, module that imported it) of one python -X importtime run
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import Apps.{role}.application"],
+                            capture_output=True, text=True)
+    lines = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"): continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit(): continue  # the header line
+        lines.append((len(module) - len(module.lstrip()), module.strip(), int(cumulative)))
+    # a module is listed after everything it imported, so going backwards its importer comes first
+    times, stack = {}, []
+    for depth, name, cumulative in reversed(lines):
+        while stack and stack[-1][0] >= depth: stack.pop()
+        if name not in times: times[name] = (cumulative, stack[-1][1] if stack else None)
+        stack.append((depth, name))
+    return times
+
+def bench_imports(role, runs, top):
+    totals, modules = [], {}
+    for _ in range(runs):
+        times = import_times(role)
+        totals.append(times[f"Apps.{role}.application"][0])
+        # the libraries our own modules import directly are the ones we can do something about
+        for name, (cumulative, parent) in times.items():
+            if parent and parent.startswith("Apps.") and not name.startswith("Apps."):
+                modules.setdefault(f"{name} (from {parent})", []).append(cumulative)
+    median = statistics.median(totals) / 1000
+    print(f"==== {role}: {median:.1f} ms to import (median of {runs}) ====")
+    direct = [(statistics.median(samples) / 1000, name) for name, samples in modules.items()]
+    for ms, name in sorted(direct, reverse=True)[:top]: print(f"    {ms:8.1f} ms  {name}")
+    return {"role": role, "import_ms": median}
+
+def app_command(args, index):
+    role = args.role.capitalize()
+    name = f"{args.role[:3]}{args.start_index + index}"
+    command = [sys.executable, f"Apps/{role}/application.py", "-n", name, "-c", args.config,
+               "-a", args.addr, "-p", str(args.base_port + index)]
+    return command + args.app_args.split()
+
+def bench_spawn(args):
+    procs, startups, lock = [], [], threading.Lock()
+    def watch(proc):
+        for line in proc.stdout:
+            found = REGISTERED.search(line)
+            if found:
+                with lock: startups.append(float(found.group(1)))
+                break
+        for line in proc.stdout: pass  # keep its pipe from filling up
+    for index in range(args.spawn):
+        proc = subprocess.Popen(app_command(args, index), stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, text=True)
+        threading.Thread(target=watch, args=(proc,), daemon=True).start()
+        procs.append(proc)
+    end = time.time() + args.timeout
+    while time.time() < end and len(startups) < args.spawn: time.sleep(0.1)
+    for proc in procs: proc.terminate()
+    for proc in procs: proc.wait()
+    print(f"==== {args.role}: {len(startups)}/{args.spawn} registered ====")
+    if not startups: return {"role": args.role, "spawned": args.spawn, "registered": 0}
+    ordered = sorted(startups)
+    result = {"role": args.role, "spawned": args.spawn, "registered": len(ordered),
+              "startup_min": ordered[0], "startup_median": statistics.median(ordered),
+              "startup_p90": ordered[int(0.9 * (len(ordered) - 1))], "startup_max": ordered[-1]}
+    print("    start to registered: " + ", ".join(f"{key[8:]} {value:.3f}s"
+                                                for key, value in result.items() if key.startswith("startup_")))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Application startup benchmark")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="imports measured per role (0 = skip the imports)")
+    parser.add_argument("-t", "--top", type=int, default=8, help="number of slowest imports shown per role")
+    parser.add_argument("-s", "--spawn", type=int, default=0, help="applications started against a running cluster")
+    parser.add_argument("--role", default="publisher", choices=["publisher", "subscriber"], help="role of the spawned applications")
+    parser.add_argument("-c", "--config", default="Apps/Common/config.ini", help="config file of the spawned applications")
+    parser.add_argument("-a", "--addr", default="127.0.0.1", help="address of the spawned applications")
+    parser.add_argument("-bp", "--base_port", type=int, default=7000, help="port of the first spawned application")
+    parser.add_argument("-si", "--start_index", type=int, default=1, help="number in the name of the first spawned application")
+    parser.add_argument("--app_args", default="", help="more arguments of the spawned applications (e.g. \"-T 2\")")
+    parser.add_argument("--timeout", type=int, default=60, help="seconds the spawned applications get to register")
+    parser.add_argument("-o", "--out", default="", help="JSON lines file every result is appended to")
+    args = parser.parse_args()
+    results = []
+    if args.runs:
+        from google.protobuf.internal import api_implementation
+        backend = api_implementation.Type()
+        print(f"protobuf backend: {backend}" + ("" if backend == "upb" else " (pip install -U protobuf for upb)"))
+        results += [dict(bench_imports(role, args.runs, args.top), protobuf=backend) for role in ROLES]
+    if args.spawn: results.append(bench_spawn(args))
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "a") as f:
+            for result in results: f.write(json.dumps(dict(result, ts=time.time())) + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,8 @@ import sys, os; sys.path.append(os.getcwd())
 from datetime import datetime
 from kazoo.client import KazooClient
 
-ZKC = KazooClient(hosts='10.0.0.1:2181')
+# the ensemble can be given as the first argument (e.g. 127.0.0.1:2181 for a local run)
+ZKC = KazooClient(hosts=sys.argv[1] if len(sys.argv) > 1 else '10.0.0.1:2181')
     
 def clear_zookeeper():
     ZKC.start() # Connect to ZooKeeper
@@ -0,0 +1,125 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: File for generating reproducible benchmark workloads
+# Semester: Spring 2023
+###############################################
+#
+# Writes a workload spec (JSON) that publishers and subscribers load with
+# --workload instead of picking random topics and values. Everything in it
+# is drawn from one seeded NumPy generator, so the same arguments always give
+# the same file and runs across code versions can be compared:
+# - topics: popularity follows a Zipf law (a few hot topics, a long tail),
+#   rates are either fixed or proportional to popularity
+# - publishers/subscribers: the topics of every client are drawn by popularity
+# - payloads: precomputed in bulk per topic, either sensor values with the
+#   ranges of TopicSelector or opaque strings with a size distribution
+#
+# Example:
+#   python3 Testing/gen_workload.py --seed 7 --topics 90 --zipf 1.2 \
+#     --pubs 10 --subs 20 --size lognormal:5,1 --out Testing/workload.json
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import json, argparse
+import numpy as np
+from Apps.Common.topic_selector import TopicSelector
+
+# how TopicSelector draws the values of each kind of topic
+NUMERIC = {"humidity": ("uniform", 10.0, 100.0), "pressure": ("integers", 870, 1085),
+           "temperature": ("integers", -100, 101), "sound": ("integers", 30, 96),
+           "altitude": ("integers", 0, 40001)}
+CHOICES = {"weather": ["sunny", "cloudy", "rainy", "foggy", "icy"],
+           "airquality": ["good", "smog", "poor"], "light": ["450", "800", "1100", "1600"],
+           "location": ["America", "Europe", "Asia", "Africa", "Australia"]}
+ALPHABET = np.frombuffer(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", dtype=np.uint8)
+
+def topic_names(count):
+    # the first topics are the plain ones, then they repeat per site
+    kinds = TopicSelector.topiclist
+    if count <= len(kinds): return kinds[:count]
+    return [f"sensors/site{i // len(kinds)}/{kinds[i % len(kinds)]}" for i in range(count)]
+
+def zipf_weights(count, s):
+    weights = 1.0 / np.arange(1, count + 1) ** s
+    return weights / weights.sum()
+
+def parse_dist(text):
+    # "fixed:64", "uniform:16,256" or "lognormal:5,1"
+    kind, _, params = text.partition(":")
+    return kind, [float(p) for p in params.split(",") if p]
+
+def draw_sizes(rng, dist, count):
+    kind, params = parse_dist(dist)
+    if kind == "fixed": sizes = np.full(count, params[0])
+    elif kind == "uniform": sizes = rng.uniform(params[0], params[1], count)
+    elif kind == "lognormal": sizes = rng.lognormal(params[0], params[1], count)
+    else: raise ValueError(f"Unknown size distribution: {dist}")
+    return np.clip(sizes.astype(np.int64), 1, None)
+
+def draw_payloads(rng, topic, args):
+    kind = topic.split("/")[-1]
+    if args.payload == "numeric" and kind in NUMERIC:
+        method, low, high = NUMERIC[kind]
+        values = getattr(rng, method)(low, high, args.samples)
+        return [str(v) for v in values.tolist()]
+    if args.payload == "numeric" and kind in CHOICES:
+        return [CHOICES[kind][i] for i in rng.integers(0, len(CHOICES[kind]), args.samples).tolist()]
+    # opaque payloads: one bulk draw of characters split by the drawn sizes
+    sizes = draw_sizes(rng, args.size, args.samples)
+    chars = ALPHABET[rng.integers(0, len(ALPHABET), int(sizes.sum()))].tobytes().decode()
+    ends = np.cumsum(sizes).tolist()
+    return [chars[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+def draw_interest(rng, names, weights, count):
+    count = min(count, len(names))
+    return [names[i] for i in rng.choice(len(names), count, replace=False, p=weights).tolist()]
+
+def generate(args):
+    rng = np.random.default_rng(args.seed)
+    names = topic_names(args.topics)
+    weights = zipf_weights(len(names), args.zipf)
+    # the hottest topic is not always the first one
+    weights = weights[rng.permutation(len(names))]
+    kind, params = parse_dist(args.rate)
+    if kind == "fixed": rates = np.full(len(names), params[0])
+    elif kind == "zipf": rates = weights * params[0]
+    else: raise ValueError(f"Unknown rate distribution: {args.rate}")
+    topics = {}
+    for i, name in enumerate(names):
+        topics[name] = {"weight": float(weights[i]), "rate": float(rates[i]),
+                        "payloads": draw_payloads(rng, name, args)}
+    publishers = {f"{args.pub_prefix}{i + 1}": draw_interest(rng, names, weights, args.pub_topics)
+                  for i in range(args.pubs)}
+    subscribers = {f"{args.sub_prefix}{i + 1}": draw_interest(rng, names, weights, args.sub_topics)
+                   for i in range(args.subs)}
+    return {"seed": args.seed, "zipf": args.zipf, "interest": args.sub_topics,
+            "topics": topics, "publishers": publishers, "subscribers": subscribers}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Workload Generator")
+    parser.add_argument("--seed", type=int, default=1, help="seed of every draw (default: 1)")
+    parser.add_argument("--topics", type=int, default=9, help="number of topics (default: 9)")
+    parser.add_argument("--zipf", type=float, default=1.0, help="Zipf exponent of topic popularity (default: 1.0)")
+    parser.add_argument("--rate", default="fixed:10",
+        help="publications/s per topic: fixed:<hz> or zipf:<total hz> spread by popularity (default: fixed:10)")
+    parser.add_argument("--payload", choices=["numeric", "bytes"], default="numeric",
+        help="sensor values like TopicSelector, or opaque strings of --size (default: numeric)")
+    parser.add_argument("--size", default="fixed:64",
+        help="payload sizes in bytes: fixed:<n>, uniform:<lo>,<hi> or lognormal:<mu>,<sigma> (default: fixed:64)")
+    parser.add_argument("--samples", type=int, default=1000, help="payloads precomputed per topic (default: 1000)")
+    parser.add_argument("--pubs", type=int, default=3, help="number of publishers (default: 3)")
+    parser.add_argument("--subs", type=int, default=3, help="number of subscribers (default: 3)")
+    parser.add_argument("--pub_topics", type=int, default=3, help="topics per publisher (default: 3)")
+    parser.add_argument("--sub_topics", type=int, default=3, help="topics per subscriber (default: 3)")
+    parser.add_argument("--pub_prefix", default="pub", help="publisher names are <prefix><n> (default: pub)")
+    parser.add_argument("--sub_prefix", default="sub", help="subscriber names are <prefix><n> (default: sub)")
+    parser.add_argument("--out", default="Testing/workload.json", help="spec file (default: Testing/workload.json)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    spec = generate(args)
+    with open(args.out, "w") as f: json.dump(spec, f)
+    print(f"Wrote {len(spec['topics'])} topics, {len(spec['publishers'])} publishers and " +
+          f"{len(spec['subscribers'])} subscribers to {args.out}")
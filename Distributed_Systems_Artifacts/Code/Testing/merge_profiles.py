@@ -0,0 +1,87 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: File for merging the profiles of every role after a run
+# Semester: Spring 2023
+###############################################
+#
+# Merges the profiles the applications wrote to their --profile_dir (see
+# Apps/Common/profiling.py), by role (publisher, subscriber, broker and
+# discovery, from the start of the file names):
+# - collapsed stacks: every stack gets its role as the root frame and the
+#   samples of every process are added up into one file (--out), which
+#   flamegraph.pl or speedscope show with one tower per role. The --top
+#   functions of every role (by the samples they were running in, not
+#   waiting below) are printed
+# - pstats: the profiles of every role are merged into <role>.pstats next to
+#   --out, and their --top functions (by cumulative time) are printed
+#
+# Example:
+#   python3 Testing/merge_profiles.py --dir Logs/profiles --top 15
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import glob, pstats, argparse
+
+def role_of(path):
+    return os.path.basename(path).split("-", 1)[0]
+
+def merge_collapsed(paths):
+    # role -> stack -> samples
+    merged = {}
+    for path in paths:
+        stacks = merged.setdefault(role_of(path), {})
+        with open(path) as f:
+            for line in f:
+                stack, count = line.rstrip("\n").rsplit(" ", 1)
+                stacks[stack] = stacks.get(stack, 0) + int(count)
+    return merged
+
+def write_collapsed(merged, out):
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        for role, stacks in sorted(merged.items()):
+            for stack, count in stacks.items(): f.write(f"{role};{stack} {count}\n")
+
+def report_collapsed(merged, top):
+    for role, stacks in sorted(merged.items()):
+        total = sum(stacks.values())
+        # the function on top of a stack is the one running when it was sampled
+        running = {}
+        for stack, count in stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            running[leaf] = running.get(leaf, 0) + count
+        print(f"==== {role}: {total} samples ====")
+        for leaf, count in sorted(running.items(), key=lambda item: item[1], reverse=True)[:top]:
+            print(f"  {100 * count / total:6.2f}%  {leaf}")
+
+def merge_pstats(paths, out_dir, top):
+    roles = {}
+    for path in paths: roles.setdefault(role_of(path), []).append(path)
+    for role, files in sorted(roles.items()):
+        stats = pstats.Stats(*files)
+        merged = os.path.join(out_dir, f"{role}.pstats")
+        stats.dump_stats(merged)
+        print(f"==== {role}: {len(files)} profiles merged into {merged} ====")
+        stats.sort_stats("cumulative").print_stats(top)
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the profiles of a run by role")
+    parser.add_argument("-d", "--dir", default="Logs/profiles", help="directory of the profiles (default: Logs/profiles)")
+    parser.add_argument("-o", "--out", default="Logs/profiles/merged/all.collapsed", help="merged collapsed stacks file")
+    parser.add_argument("-t", "--top", type=int, default=20, help="number of functions shown per role")
+    args = parser.parse_args()
+    collapsed = sorted(glob.glob(os.path.join(args.dir, "*.collapsed")))
+    stats = sorted(glob.glob(os.path.join(args.dir, "*.pstats")))
+    if not collapsed and not stats: sys.exit(f"No profiles in {args.dir}")
+    if collapsed:
+        merged = merge_collapsed(collapsed)
+        write_collapsed(merged, args.out)
+        print(f"{len(collapsed)} collapsed stack profiles merged into {args.out}")
+        report_collapsed(merged, args.top)
+    if stats:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        merge_pstats(stats, os.path.dirname(args.out) or ".", args.top)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: File for running fault injection scenarios on a local cluster
+# Semester: Spring 2023
+###############################################
+#
+# run_mininet_test.py stops one broker at one fixed moment. This runner
+# starts the processes of a scenario file (TOML) on this machine, injects
+# its events at their scheduled times while the publishers run, and then
+# measures what every event did to the subscribers. Event actions:
+#   kill        SIGKILL the target
+#   pause       SIGSTOP the target (SIGCONT after duration, if given)
+#   resume      SIGCONT the target
+#   restart     start the target again (after a kill)
+#   zk_drop     cut the ZooKeeper connection of the target for duration
+#               (longer than the session timeout expires its session)
+#   zk_latency  add delay_ms to the ZooKeeper traffic of the target for duration
+# Processes with proxy_zk = true reach ZooKeeper through a local TCP proxy
+# of their own (the zk_* actions need it). Every process gets its own copy of
+# the config file pointing at its proxy (or straight at the ensemble).
+#
+# From the received records of the subscribers (--record_dir, see
+# verify_delivery.py) every event gets:
+#   failover  seconds until the first message sent after the event arrived
+#   dip       how far the delivery rate fell below the rate before the event
+#   recovery  seconds until the delivery rate was back to RECOVERED of it
+# The results of every run are appended to a JSON lines file so that repeated
+# runs (and code versions) can be compared. See Testing/scenarios/ for examples.
+#
+# Example:
+#   python3 Testing/run_chaos.py Testing/scenarios/broker_failover.toml
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import csv, glob, json, time, shlex, signal, socket, tomllib, threading, subprocess, configparser
+from Testing.verify_delivery import load_received
+
+# the entry point of every role
+COMMANDS = {"discovery": "Apps/Discovery/application.py", "broker": "Apps/Broker/application.py",
+            "publisher": "Apps/Publisher/application.py", "subscriber": "Apps/Subscriber/application.py"}
+# share of the rate before an event that counts as recovered
+RECOVERED = 0.9
+
+class ZkProxy:
+    # forwards the ZooKeeper connections of one process, optionally delayed or cut
+    def __init__(self, target):
+        host, port = target.split(",")[0].split(":")
+        self.target = (host, int(port))
+        self.delay = 0.0
+        self.dropped = False
+        self.conns = []
+        self.lock = threading.Lock()
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            client, _ = self.server.accept()
+            if self.dropped:
+                client.close()
+                continue
+            try: upstream = socket.create_connection(self.target)
+            except OSError:
+                client.close()
+                continue
+            with self.lock: self.conns += [client, upstream]
+            threading.Thread(target=self.pump, args=(client, upstream), daemon=True).start()
+            threading.Thread(target=self.pump, args=(upstream, client), daemon=True).start()
+
+    def pump(self, src, dst):
+        try:
+            while True:
+                data = src.recv(65536)
+                if not data: break
+                if self.delay: time.sleep(self.delay)
+                dst.sendall(data)
+        except OSError: pass
+        for sock in (src, dst):
+            try: sock.close()
+            except OSError: pass
+
+    def drop(self, dropped):
+        self.dropped = dropped
+        if dropped:
+            with self.lock: conns, self.conns = self.conns, []
+            for sock in conns:
+                try: sock.shutdown(socket.SHUT_RDWR)
+                except OSError: pass
+
+class Cluster:
+    # the processes (and proxies) of a scenario
+    def __init__(self, scenario, record_dir):
+        self.scenario = scenario
+        self.record_dir = record_dir
+        self.procs = {}
+        self.proxies = {}
+        self.specs = {spec["name"]: spec for spec in scenario["process"]}
+
+    def config_for(self, spec):
+        # a copy of the config file that points the process at its ZooKeeper (proxy)
+        config = configparser.ConfigParser()
+        config.read(self.scenario.get("config", "Apps/Common/config.ini"))
+        if not config.has_section("ZooKeeper"): config.add_section("ZooKeeper")
+        hosts = self.scenario.get("zookeeper", "127.0.0.1:2181")
+        if spec.get("proxy_zk"):
+            self.proxies[spec["name"]] = ZkProxy(hosts)
+            hosts = f"127.0.0.1:{self.proxies[spec['name']].port}"
+        config["ZooKeeper"]["Hosts"] = hosts
+        path = os.path.join(self.record_dir, f"{spec['name']}.ini")
+        with open(path, "w") as f: config.write(f)
+        return path
+
+    def start(self, name):
+        spec = self.specs[name]
+        if "config_path" not in spec: spec["config_path"] = self.config_for(spec)
+        cmd = ["python3", COMMANDS[spec["role"]], "-n", name, "-c", spec["config_path"]]
+        if spec["role"] in ("publisher", "subscriber"): cmd += ["-rd", self.record_dir]
+        cmd += shlex.split(spec.get("args", ""))
+        log = open(os.path.join(self.record_dir, f"{name}.log"), "a")
+        self.procs[name] = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        print(f"started {name}: {' '.join(cmd)}")
+
+    def signal(self, name, sig):
+        proc = self.procs.get(name)
+        if proc and proc.poll() is None: proc.send_signal(sig)
+
+    def stop_all(self):
+        for name in self.procs:
+            self.signal(name, signal.SIGCONT)
+            self.signal(name, signal.SIGTERM)
+        for proc in self.procs.values():
+            try: proc.wait(timeout=5)
+            except subprocess.TimeoutExpired: proc.kill()
+
+def apply(cluster, action, target, event):
+    if action == "kill": cluster.signal(target, signal.SIGKILL)
+    elif action == "pause": cluster.signal(target, signal.SIGSTOP)
+    elif action == "resume": cluster.signal(target, signal.SIGCONT)
+    elif action == "restart": cluster.start(target)
+    elif action == "zk_drop": cluster.proxies[target].drop(True)
+    elif action == "zk_restore": cluster.proxies[target].drop(False)
+    elif action == "zk_latency": cluster.proxies[target].delay = event.get("delay_ms", 100) / 1000
+    elif action == "zk_latency_off": cluster.proxies[target].delay = 0.0
+    else: raise ValueError(f"Unknown action: {action}")
+
+def schedule(events):
+    # every event with a duration is undone once it is over
+    undo = {"pause": "resume", "zk_drop": "zk_restore", "zk_latency": "zk_latency_off"}
+    timeline = []
+    for event in events:
+        timeline.append((event["at"], event["action"], event["target"], event, True))
+        if event.get("duration") and event["action"] in undo:
+            timeline.append((event["at"] + event["duration"], undo[event["action"]], event["target"], event, False))
+    return sorted(timeline, key=lambda entry: entry[0])
+
+def receipts(record_dir):
+    # (sent ts, received ts) of every live message any subscriber got
+    found = []
+    for path in glob.glob(os.path.join(record_dir, "*.recv.csv")):
+        _, rows = load_received(path)
+        found += [(row[3], row[4]) for row in rows if row[5] == "live"]
+    return sorted(found, key=lambda r: r[1])
+
+def rate(recv_times, start, end):
+    return sum(1 for t in recv_times if start <= t < end) / (end - start) if end > start else 0
+
+def measure(event_ts, found, window, bin_size):
+    recv_times = [r[1] for r in found]
+    baseline = rate(recv_times, event_ts - window, event_ts)
+    after = [r[1] for r in found if r[0] >= event_ts]
+    failover = min(after) - event_ts if after else None
+    lowest, recovery, start = None, None, event_ts
+    while start < event_ts + window:
+        current = rate(recv_times, start, start + bin_size)
+        lowest = current if lowest is None else min(lowest, current)
+        # recovered once the rate is back after having dropped
+        if recovery is None and lowest < RECOVERED * baseline <= current: recovery = start + bin_size - event_ts
+        start += bin_size
+    if recovery is None and lowest is not None and lowest >= RECOVERED * baseline: recovery = 0.0
+    dip = 1 - lowest / baseline if baseline and lowest is not None else None
+    return {"baseline_rate": baseline, "failover_s": failover, "dip": dip, "recovery_s": recovery}
+
+def run(path):
+    with open(path, "rb") as f: scenario = tomllib.load(f)
+    record_dir = scenario.get("record_dir", "Logs/chaos")
+    os.makedirs(record_dir, exist_ok=True)
+    for old in glob.glob(os.path.join(record_dir, "*.csv")): os.remove(old)
+    cluster = Cluster(scenario, record_dir)
+    for spec in scenario["process"]:
+        cluster.start(spec["name"])
+        time.sleep(spec.get("wait", 1))
+    start = time.time()
+    injected = []
+    try:
+        for at, action, target, event, measured in schedule(scenario.get("event", [])):
+            delay = start + at - time.time()
+            if delay > 0: time.sleep(delay)
+            apply(cluster, action, target, event)
+            print(f"{time.time() - start:7.2f}s {action} {target}")
+            if measured:
+                injected.append((time.time(), action, target))
+                with open(os.path.join(record_dir, "faults.csv"), "a", newline="") as f:
+                    csv.writer(f).writerow([f"{injected[-1][0]:.6f}", action, target])
+        delay = start + scenario.get("duration", 60) - time.time()
+        if delay > 0: time.sleep(delay)
+    finally: cluster.stop_all()
+    # measure every injected event on what the subscribers received
+    found = receipts(record_dir)
+    window, bin_size = scenario.get("window", 10), scenario.get("bin", 0.5)
+    results = []
+    for event_ts, action, target in injected:
+        result = {"action": action, "target": target, "at": event_ts - start}
+        result.update(measure(event_ts, found, window, bin_size))
+        results.append(result)
+        fmt = lambda v, unit="s": "-" if v is None else f"{v:.3f}{unit}"
+        print(f"{action} {target} at {result['at']:.2f}s: failover {fmt(result['failover_s'])}, " +
+              f"dip {fmt(None if result['dip'] is None else result['dip'] * 100, '%')}, " +
+              f"recovery {fmt(result['recovery_s'])} (rate before {result['baseline_rate']:.1f} msg/s)")
+    with open(scenario.get("results", os.path.join(record_dir, "results.jsonl")), "a") as f:
+        f.write(json.dumps({"scenario": path, "started": start, "events": results}) + "\n")
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("usage: python3 Testing/run_chaos.py <scenario.toml>")
+        sys.exit(1)
+    run(sys.argv[1])
@@ -0,0 +1,62 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Tests of the duplicate suppression of the subscribers
+# Semester: Spring 2023
+###############################################
+#
+# Runs with the standard library (or pytest), from the Code directory:
+#   python3 -m unittest Testing/test_dedup.py
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import unittest, configparser
+from Apps.Common.dedup import Deduplicator, SeqWindow
+
+def deduplicator(width):
+    config = configparser.ConfigParser()
+    config.read_dict({"Dissemination": {"DedupWindow": str(width)}})
+    return Deduplicator(config)
+
+class TestSeqWindow(unittest.TestCase):
+
+    def test_drops_copies(self):
+        window = SeqWindow(8)
+        self.assertEqual([window.first(seq) for seq in (1, 2, 2, 3, 1)], [True, True, False, True, False])
+
+    def test_drops_copies_older_than_the_window(self):
+        window = SeqWindow(8)
+        for seq in range(1, 21): window.first(seq)
+        self.assertFalse(window.first(12))
+
+class TestRestart(unittest.TestCase):
+
+    def test_restarted_publisher_is_delivered(self):
+        dedup = deduplicator(1024)
+        for seq in range(1, 101): self.assertTrue(dedup.first_copy("pub1", "temp", seq, run=1000))
+        # the same publisher restarted: its sequence numbers start over
+        for seq in range(1, 101): self.assertTrue(dedup.first_copy("pub1", "temp", seq, run=2000))
+        # the copies of the new run are still dropped
+        self.assertFalse(dedup.first_copy("pub1", "temp", 50, run=2000))
+
+    def test_copies_of_the_old_run_are_dropped(self):
+        dedup = deduplicator(1024)
+        dedup.first_copy("pub1", "temp", 500, run=1000)
+        dedup.first_copy("pub1", "temp", 1, run=2000)
+        self.assertFalse(dedup.first_copy("pub1", "temp", 501, run=1000))
+
+    def test_restart_without_a_run(self):
+        dedup = deduplicator(16)
+        for seq in range(1, 101): dedup.first_copy("pub1", "temp", seq)
+        # far below the window: a restart, not an old copy
+        self.assertTrue(dedup.first_copy("pub1", "temp", 1))
+        self.assertTrue(dedup.first_copy("pub1", "temp", 2))
+        self.assertFalse(dedup.first_copy("pub1", "temp", 1))
+
+    def test_no_dedup(self):
+        dedup = deduplicator(0)
+        self.assertTrue(dedup.first_copy("pub1", "temp", 1))
+        self.assertTrue(dedup.first_copy("pub1", "temp", 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Tests of the lost message accounting of the subscribers
+# Semester: Spring 2023
+###############################################
+#
+# Runs with the standard library (or pytest), from the Code directory:
+#   python3 -m unittest Testing/test_gap_accounting.py
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import unittest, logging, configparser
+from Apps.Common.flow_control import FlowControl
+from Apps.Common.content_filter import parse_filter
+from Apps.Subscriber.middleware import SubscriberMW
+
+def subscriber(dissemination, filters=()):
+    mw = SubscriberMW(logging.getLogger("test"))
+    mw.dissemination = dissemination
+    mw.filters = {f.topic: f for f in map(parse_filter, filters)}
+    mw.flow = FlowControl(mw.logger, configparser.ConfigParser(), "Subscriber")
+    return mw
+
+def header(seq):
+    return {"pub": "pub1", "seq": seq, "ts": 0, "run": 1000}
+
+class TestGapAccounting(unittest.TestCase):
+
+    def test_gaps_are_lost(self):
+        mw = subscriber("Broker")
+        for seq in (1, 2, 5, 6): mw.count_lost(header(seq), "temp")
+        self.assertEqual(mw.flow.gaps, {"pub1": 2})
+
+    def test_broker_filtered_stream_is_not_lost(self):
+        mw = subscriber("Broker", ["temp>20"])
+        # the broker only sent us the publications above 20
+        for seq in (1, 4, 9, 10): mw.count_lost(header(seq), "temp", filtered=True)
+        self.assertEqual(mw.flow.gaps, {})
+
+    def test_filtered_topic_is_not_lost(self):
+        mw = subscriber("Broker", ["temp>20"])
+        for seq in (1, 4, 9): self.assertIsNone(mw.count_lost(header(seq), "temp"))
+        # our other topics still count
+        for seq in (1, 3): mw.count_lost(header(seq), "humidity")
+        self.assertEqual(mw.flow.gaps, {"pub1": 1})
+
+    def test_direct_filtered_topic_is_lost(self):
+        # without a broker every publication reaches us and we filter it ourselves
+        mw = subscriber("Direct", ["temp>20"])
+        for seq in (1, 4): mw.count_lost(header(seq), "temp")
+        self.assertEqual(mw.flow.gaps, {"pub1": 2})
+
+if __name__ == '__main__':
+    unittest.main()
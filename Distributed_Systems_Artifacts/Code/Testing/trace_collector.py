@@ -0,0 +1,84 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: File for collecting the traces of publications and showing the slowest paths
+# Semester: Spring 2023
+###############################################
+#
+# Binds the Collector endpoint of the [Tracing] section of the config file
+# and takes in the traces the subscribers push (see Apps/Common/tracing.py).
+# Every --interval seconds (and once more at the end) it prints:
+# - per path (publisher -> brokers -> subscriber) the number of traces and
+#   the mean and p99 latency of every hop: the network between two entities
+#   and the time a broker held a message (its in -> out)
+# - the --top slowest traces end to end, hop by hop
+# With --out every trace is also written to a JSON lines file, which can be
+# looked at again later with --input (without collecting anything).
+#
+# Example:
+#   python3 Testing/trace_collector.py --duration 60 --top 5 --out Logs/traces.jsonl
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import json, time, argparse, configparser
+import zmq
+from Apps.Common.tracing import TraceCollector, tracing_settings, breakdown, trace_path
+
+def ms(seconds):
+    return f"{seconds * 1000:8.2f} ms"
+
+def report(collector, top):
+    print(f"==== {len(collector.traces)} traces ====")
+    for path, count, stats in collector.summary():
+        print(f"{' -> '.join(path)} ({count} traces)")
+        for segment, mean, p99 in stats:
+            print(f"    {segment:50s} mean {ms(mean)}  p99 {ms(p99)}")
+    print(f"---- {top} slowest traces ----")
+    for total, trace in collector.slowest(top):
+        print(f"{trace['trace']} {trace['topic']} {' -> '.join(trace_path(trace['hops']))}: {ms(total)}")
+        for segment, seconds in breakdown(trace["hops"]):
+            print(f"    {segment:50s} {ms(seconds)}")
+    sys.stdout.flush()
+
+def collect(args, endpoint, collector, out):
+    pull = zmq.Context.instance().socket(zmq.PULL)
+    pull.bind(endpoint)
+    print(f"Collecting traces on {endpoint}")
+    end = time.time() + args.duration if args.duration else None
+    next_report = time.time() + args.interval
+    try:
+        while end is None or time.time() < end:
+            if pull.poll(100):
+                trace = pull.recv_json()
+                collector.add(trace)
+                if out: out.write(json.dumps(trace) + "\n")
+            if time.time() >= next_report:
+                next_report = time.time() + args.interval
+                report(collector, args.top)
+    except KeyboardInterrupt: pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Trace collector")
+    parser.add_argument("-c", "--config", default="Apps/Common/config.ini", help="config file with the [Tracing] section")
+    parser.add_argument("-e", "--endpoint", default="", help="endpoint to collect on (default: Collector of the config file)")
+    parser.add_argument("-t", "--top", type=int, default=10, help="number of slowest traces shown")
+    parser.add_argument("-i", "--interval", type=int, default=10, help="seconds between two reports")
+    parser.add_argument("-d", "--duration", type=int, default=0, help="seconds to collect for (0 = until interrupted)")
+    parser.add_argument("-o", "--out", default="", help="JSON lines file every trace is written to")
+    parser.add_argument("-in", "--input", default="", help="JSON lines file of traces to report on instead of collecting")
+    args = parser.parse_args()
+    collector = TraceCollector()
+    if args.input:
+        with open(args.input) as f:
+            for line in f: collector.add(json.loads(line))
+    else:
+        config = configparser.ConfigParser()
+        config.read(args.config)
+        endpoint = args.endpoint or tracing_settings(config)["collector"]
+        out = open(args.out, "w") if args.out else None
+        collect(args, endpoint, collector, out)
+        if out: out.close()
+    report(collector, args.top)
+
+if __name__ == '__main__':
+    main()
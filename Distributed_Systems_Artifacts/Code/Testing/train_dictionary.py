@@ -0,0 +1,61 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: File for training the shared compression dictionary
+# Semester: Spring 2023
+###############################################
+#
+# Sensor values and history windows are short and very alike, so they
+# compress far better with a dictionary that already holds what they have in
+# common. This script builds samples of the messages publishers send (plain
+# publications and history windows) from a workload spec (gen_workload.py)
+# and writes a dictionary file to point [Compression] Dictionary at:
+# - with zstandard installed, a trained zstd dictionary (also fine for zlib)
+# - without it, a raw dictionary of the most common samples (zlib only)
+#
+# Example:
+#   python3 Testing/train_dictionary.py --workload Testing/workload.json \
+#     --history 5 --size 16384 --out Testing/payloads.dict
+#
+# import statements
+import json, argparse, collections
+try: import zstandard
+except ImportError: zstandard = None
+
+def build_samples(spec, history):
+    # what publish() would send for every precomputed payload of every topic
+    samples = []
+    for topic, entry in spec["topics"].items():
+        messages = [f"{topic}:{payload}" for payload in entry["payloads"]]
+        samples.extend(messages)
+        for i in range(len(messages)):
+            window = messages[max(0, i - history + 1):i + 1]
+            samples.append(f"{topic}:hs-{history}-hw-{window}")
+    return [sample.encode() for sample in samples]
+
+def raw_dictionary(samples, size):
+    # zlib looks back from the end of the dictionary, so the most common samples go last
+    common = [sample for sample, _ in collections.Counter(samples).most_common()]
+    data = b""
+    for sample in common:
+        if len(data) + len(sample) > size: break
+        data = sample + data
+    return data
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compression Dictionary Trainer")
+    parser.add_argument("--workload", default="Testing/workload.json", help="workload spec to take samples from")
+    parser.add_argument("--history", type=int, default=5, help="history window size of the publishers (default: 5)")
+    parser.add_argument("--size", type=int, default=16384, help="dictionary size in bytes (default: 16384)")
+    parser.add_argument("--raw", action="store_true", help="write a raw dictionary even if zstandard is installed")
+    parser.add_argument("--out", default="Testing/payloads.dict", help="dictionary file (default: Testing/payloads.dict)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(args.workload) as f: spec = json.load(f)
+    samples = build_samples(spec, args.history)
+    if zstandard and not args.raw: data = zstandard.train_dictionary(args.size, samples).as_bytes()
+    else: data = raw_dictionary(samples, args.size)
+    with open(args.out, "wb") as f: f.write(data)
+    print(f"Wrote a {len(data)} byte dictionary trained on {len(samples)} samples to {args.out}")
@@ -0,0 +1,144 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: File for verifying message delivery after a (failover) run
+# Semester: Spring 2023
+###############################################
+#
+# Joins the sent records of the publishers with the received records of the
+# subscribers (see Apps/Common/delivery_log.py) and reports per subscriber:
+# - lost: messages it should have received but did not (and how many of
+#   those a replay from the broker log made up for)
+# - duplicates: messages it received live more than once
+# - reordering: messages that came after a later one of the same stream,
+#   and the largest distance (in sequence numbers) between the two
+# A subscriber should have received a message if it is on one of its topics
+# (or patterns), passes its filter, was sent after the first message of the
+# same stream reached it (it had not subscribed before) and before the last
+# message it received at all (it was gone after).
+#
+# If the test runner wrote a faults file (one "ts,action,target" line per
+# failure it injected), every fault also gets an outage window per
+# subscriber: from the fault until the first message sent after the fault
+# arrived, with the messages lost in it. Losses outside of outage windows
+# make the script exit with 1, so it can gate failover changes.
+#
+# Example:
+#   python3 Testing/verify_delivery.py --dir Logs/records
+#
+# import statements
+import sys, os; sys.path.append(os.getcwd())
+import csv, glob, json, argparse
+from Apps.Common.content_filter import parse_filter
+from Apps.Common.topic_trie import is_pattern, topic_matches
+
+def load_sent(directory):
+    # (pub, topic) -> seq -> (kind, ts, value)
+    sent = {}
+    for path in glob.glob(os.path.join(directory, "*.sent.csv")):
+        with open(path, newline="") as f:
+            for pub, topic, seq, kind, ts, value in csv.reader(f):
+                sent.setdefault((pub, topic), {})[int(seq)] = (kind, float(ts), value)
+    return sent
+
+def load_received(path):
+    # returns the description of the subscriber and its rows in the order received
+    meta, rows = {}, []
+    with open(path, newline="") as f:
+        for line in f:
+            if line.startswith("# "):
+                key, value = line[2:].split("=", 1)
+                meta[key] = json.loads(value)
+                continue
+            pub, topic, seq, sent_ts, recv_ts, source = next(csv.reader([line]))
+            rows.append((pub, topic, int(seq), float(sent_ts), float(recv_ts), source))
+    return meta, rows
+
+def load_faults(path):
+    if not path or not os.path.exists(path): return []
+    with open(path, newline="") as f:
+        return [(float(ts), action, target) for ts, action, target in csv.reader(f)]
+
+def wants(topics, topic):
+    return any(topic == t or (is_pattern(t) and topic_matches(t, topic)) for t in topics)
+
+def expected(entry, filters, topic):
+    # histories go to every subscriber of the topic, data only if it passes the filter
+    kind, ts, value = entry
+    return kind == "h" or topic not in filters or filters[topic].matches(value)
+
+def verify_subscriber(sent, meta, rows):
+    topics = meta.get("topics", [])
+    filters = {f.topic: f for f in map(parse_filter, meta.get("filters", []))}
+    live = [row for row in rows if row[5] == "live"]
+    end = max((row[4] for row in live), default=0)
+    report = {"received": len(live), "replayed": len(rows) - len(live), "lost": [], "recovered": 0,
+              "duplicates": 0, "reordered": 0, "max_reorder": 0, "silent_streams": []}
+    streams = {}
+    for pub, topic, seq, _, _, source in rows:
+        streams.setdefault((pub, topic), {"live": [], "replay": set()})
+        if source == "live": streams[(pub, topic)]["live"].append(seq)
+        else: streams[(pub, topic)]["replay"].add(seq)
+    for (pub, topic), seqs in sent.items():
+        if not wants(topics, topic): continue
+        stream = streams.get((pub, topic))
+        if not stream or not stream["live"]:
+            report["silent_streams"].append(f"{pub}/{topic}")
+            continue
+        live_seqs = stream["live"]
+        # duplicates and reordering, in the order the messages arrived
+        seen, highest = set(), 0
+        for seq in live_seqs:
+            if seq in seen: report["duplicates"] += 1
+            elif seq < highest:
+                report["reordered"] += 1
+                report["max_reorder"] = max(report["max_reorder"], highest - seq)
+            seen.add(seq)
+            highest = max(highest, seq)
+        first = min(live_seqs)
+        for seq, entry in sent[(pub, topic)].items():
+            if seq < first or entry[1] > end or seq in seen or not expected(entry, filters, topic): continue
+            if seq in stream["replay"]: report["recovered"] += 1
+            else: report["lost"].append((pub, topic, seq, entry[1]))
+    return report
+
+def outage(fault_ts, rows, lost):
+    # from the fault until the first message sent after it got to us
+    after = [row[4] for row in rows if row[5] == "live" and row[3] >= fault_ts]
+    end = min(after) if after else None
+    in_window = [l for l in lost if l[3] >= fault_ts and (end is None or l[3] <= end)]
+    return end, in_window
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Delivery Verifier")
+    parser.add_argument("--dir", default="Logs/records", help="directory of the record files (default: Logs/records)")
+    parser.add_argument("--faults", default=None, help="faults file (default: <dir>/faults.csv)")
+    parser.add_argument("--verbose", action="store_true", help="list every lost message")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    sent = load_sent(args.dir)
+    faults = load_faults(args.faults or os.path.join(args.dir, "faults.csv"))
+    print(f"{sum(len(s) for s in sent.values())} messages sent on {len(sent)} streams, {len(faults)} faults injected")
+    unexplained = 0
+    for path in sorted(glob.glob(os.path.join(args.dir, "*.recv.csv"))):
+        name = os.path.basename(path)[:-len(".recv.csv")]
+        meta, rows = load_received(path)
+        report = verify_subscriber(sent, meta, rows)
+        lost = report["lost"]
+        print(f"{name}: received {report['received']} (+{report['replayed']} replayed), lost {len(lost)} " +
+              f"(+{report['recovered']} recovered by replay), duplicates {report['duplicates']}, " +
+              f"reordered {report['reordered']} (max distance {report['max_reorder']})")
+        if report["silent_streams"]: print(f"  never received: {', '.join(report['silent_streams'])}")
+        explained = set()
+        for fault_ts, action, target in faults:
+            end, in_window = outage(fault_ts, rows, lost)
+            explained.update(in_window)
+            length = f"{end - fault_ts:.3f}s" if end else "not recovered"
+            print(f"  {action} {target} at {fault_ts:.3f}: outage {length}, lost {len(in_window)} in it")
+        unexplained += len(set(lost) - explained)
+        if args.verbose:
+            for pub, topic, seq, ts in lost: print(f"  lost {pub}/{topic} #{seq} sent at {ts:.3f}")
+    print(f"{unexplained} messages lost outside of outage windows")
+    sys.exit(1 if unexplained else 0)